@@ -1,87 +1,480 @@
 import streamlit as st
 import pandas as pd
-from fpdf import FPDF
+import numpy as np
 import os
 from datetime import datetime
 import time
 import gspread
 from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
 from streamlit_option_menu import option_menu
 import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
-import speech_recognition as sr
-from streamlit_mic_recorder import mic_recorder
 import io
-from PIL import Image
-from pypdf import PdfWriter
-from streamlit_cropper import st_cropper
+from PIL import Image, ImageOps
 import re
 import hashlib
+import zipfile
+import wave
 import math
 import requests
 import logging
+import threading
+import json
+import functools
+import importlib.util
+import sqlite3
+import atexit
+import random
+import uuid
+import socket
+import contextlib
+import contextvars
+import bisect
+import itertools
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, as_completed
+from google.auth.transport.requests import Request as GoogleAuthRequest
+from google.auth.exceptions import RefreshError, TransportError
+import render
 
 # Set up logging to eliminate "Silent Failures"
 logging.basicConfig(level=logging.INFO)
 
 # --- 1. CONFIGURATION ---
-COMPANY_NAME = "G P Group"
-LOGO_PATH = "logo.png"
+DB_CACHE_TTL = 300 # Seconds a cached table frame is served before it is re-read, when change stamps cannot be polled
+REVISIONS_SHEET = "Revisions" # Per-table change stamps bumped by every write; readers poll this instead of re-reading tables
+REVISION_POLL_SECS = 5 # Each process reads the stamps at most this often (one small read shared by all sessions)
+REVISION_MAX_AGE = 1800 # Full re-read even with unchanged stamps, for edits made by hand in the Sheet
+REVISION_PRUNE_SECS = 7 * 86400 # Writer rows not bumped for this long (hosts and containers that are gone) are deleted
+WRITE_FLUSH_SECS = 2.0 # Write-behind queue flush interval
+WRITE_FLUSH_SIZE = 50 # ...or flush as soon as a worksheet has this many pending writes
+WRITE_MAX_ATTEMPTS = 3
+SHEETS_READS_PER_MIN = 60 # Default per-user Sheets quotas; override in [quota_settings]
+SHEETS_WRITES_PER_MIN = 60
+DRIVE_CALLS_PER_MIN = 600
+DRIVE_BATCH_SIZE = 100 # Drive's limit on requests per HTTP batch
+DRIVE_RESUMABLE_MIN = 5 * 1024 * 1024 # Larger uploads use a resumable session...
+DRIVE_UPLOAD_CHUNK = 5 * 1024 * 1024 # ...sent in chunks of this size (a multiple of 256 KB)
+API_MAX_RETRIES = 5 # Retries on 429 (and, for idempotent calls, 5xx / transport errors), with exponential backoff and full jitter
+API_BACKOFF_BASE = 1.0
+API_BACKOFF_CAP = 32.0
+SUBMIT_IO_WORKERS = 4 # Bounded pool for concurrent uploads in background submit jobs
+JOB_TTL_SECS = 3600 # Finished background jobs are forgotten after this long...
+JOB_MAX_KEPT = 100 # ...or sooner, oldest first, beyond this many
+PDF_CACHE_DIR = "temp/pdf_cache" # Downloaded Drive PDFs (by file ID) and merged bundles (by link-list hash)
+PDF_CACHE_MAX_BYTES = 500 * 1024 * 1024 # Least-recently-used entries are evicted beyond this
+DRIVE_DOWNLOAD_WORKERS = 4 # Concurrent downloads when merging; Drive quota still applies through the scheduler
+PDF_DOWNLOAD_CHUNK = 8 * 1024 * 1024
+THUMB_CACHE_DIR = "temp/thumb_cache" # Evidence photo thumbnails by Drive file ID: made at submit, or fetched from Drive once
+THUMB_CACHE_MAX_BYTES = 50 * 1024 * 1024
+THUMB_SIZE = 240 # Longest side in px; shown at half size so they stay sharp on high-DPI screens
+THUMB_RETRY_SECS = 600 # A photo that could not be fetched is not asked for again before this
+PARTITIONED_TABLES = {"DebitNotes": "Date"} # Tables that may be split by time ([db_settings] partition_by = "month" or "year"), and their date column
+PARTITION_MANIFEST = "Partitions" # Worksheet listing each partition's period, home spreadsheet and row count
+PARTITION_LOAD_WORKERS = 4 # Cold partitions of one date-range read load concurrently on their own pool
+MIRROR_DB_PATH = "mirror.db" # Optional local SQLite copy of the Sheets tables (enable with [mirror_settings] enabled = true)
+MIRROR_SYNC_SECS = 30 # Incremental sync at most this often per table
+MIRROR_FULL_SYNC_SECS = 3600 # Full background re-sync to pick up edits/deletes made elsewhere
+OUTBOX_DB_PATH = "outbox.db" # Durable queue of outgoing email / WhatsApp notifications
+EMAILS_PER_MIN = 20 # Outbox send rates; override in [quota_settings]
+WHATSAPP_PER_MIN = 60
+OUTBOX_MAX_ATTEMPTS = 6 # Then the message is marked failed in Notifications
+OUTBOX_BACKOFF_BASE = 30.0 # Seconds; exponential with full jitter between attempts
+OUTBOX_BACKOFF_CAP = 1800.0
+OUTBOX_RETENTION_SECS = 30 * 86400 # Finished outbox rows are kept this long
+SMTP_IDLE_SECS = 120 # The kept-alive SMTP connection is closed after this long without mail
+TRANSCRIBE_ENGINE_ORDER = ["vosk", "google"] # Voice engines tried in order; override with [voice_settings] engines
+VOSK_MODEL_PATH = "models/vosk-model-small-en-in-0.4" # Offline engine: pip install vosk and unpack a model here ([voice_settings] vosk_model)
+VOSK_CHUNK_FRAMES = 4000
+TRANSCRIPT_CACHE_SIZE = 64 # Transcribed clips remembered by audio hash
+TRACE_SAMPLE_RATE = 1.0 # Share of hot-path calls timed for the Performance page; 0 turns tracing off ([perf_settings] sample_rate)
+TRACE_BUFFER_SIZE = 5000 # Most recent spans kept for JSON-lines export
 REASON_CATEGORIES = ["Safety Violation", "Quality Issue", "Material Wastage", "Timeline Delay", "Site Misconduct", "Other"]
 
-# --- 2. GOOGLE SERVICES ---
+# --- 2. INSTRUMENTATION ---
+_current_span = contextvars.ContextVar("span", default=None)
+
+class Metrics:
+    """Per-operation latency histograms, errors, cache hits / misses and payload totals for every @traced call, plus
+    the most recent spans for JSON-lines export. sample_rate is the share of calls traced; at 0 a traced call
+    costs one comparison."""
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf')) # Seconds (upper bounds)
+
+    def __init__(self, sample_rate):
+        self.sample_rate = float(sample_rate); self._lock = threading.Lock(); self.reset()
+
+    def reset(self):
+        with self._lock: self.ops = {}; self.spans = deque(maxlen=TRACE_BUFFER_SIZE); self.since = time.time()
+
+    def record(self, op, secs, error, notes):
+        error = error or notes.pop('error', None); cache = notes.pop('cache', None)
+        with self._lock:
+            s = self.ops.get(op)
+            if s is None: s = self.ops[op] = {'count': 0, 'errors': 0, 'sum': 0.0, 'buckets': [0] * len(self.BUCKETS), 'recent': deque(maxlen=1024), 'hit': 0, 'miss': 0, 'totals': {}}
+            s['count'] += 1; s['sum'] += secs; s['recent'].append(secs); s['buckets'][bisect.bisect_left(self.BUCKETS, secs)] += 1
+            if error: s['errors'] += 1
+            if cache in ('hit', 'miss'): s[cache] += 1
+            for k, v in notes.items():
+                if isinstance(v, (int, float)): s['totals'][k] = s['totals'].get(k, 0) + v
+            self.spans.append({'ts': round(time.time(), 3), 'op': op, 'ms': round(secs * 1000, 3), 'error': error, 'cache': cache, **notes})
+
+    def summary(self):
+        """One row per operation: calls, errors, latency percentiles over its last 1024 calls, cache and payload totals"""
+        with self._lock: ops = {op: dict(s, recent=list(s['recent']), totals=dict(s['totals'])) for op, s in self.ops.items()}
+        rows = {}
+        for op, s in sorted(ops.items()):
+            p50, p95, p99 = np.percentile(s['recent'], [50, 95, 99]) * 1000
+            rows[op] = {'calls': s['count'], 'errors': s['errors'], 'mean ms': round(s['sum'] / s['count'] * 1000, 1), 'p50 ms': round(p50, 1), 'p95 ms': round(p95, 1),
+                        'p99 ms': round(p99, 1), 'cache hits': s['hit'], 'cache misses': s['miss'], **{f"total {k}": v for k, v in s['totals'].items()}}
+        return pd.DataFrame.from_dict(rows, orient='index')
+
+    def histogram(self, op):
+        with self._lock: counts = list(self.ops[op]['buckets'])
+        labels = [f"≤{b * 1000:g} ms" if b != float('inf') else f">{self.BUCKETS[-2] * 1000:g} ms" for b in self.BUCKETS]
+        return pd.Series(counts, index=pd.CategoricalIndex(labels, categories=labels, ordered=True), name='calls')
+
+    def prometheus(self, api_stats=None):
+        """Prometheus text exposition of the histograms and counters (plus the API scheduler's counters)"""
+        out = ["# HELP gp_op_duration_seconds Latency of traced operations.", "# TYPE gp_op_duration_seconds histogram"]
+        with self._lock:
+            ops = {op: dict(s, totals=dict(s['totals']), buckets=list(s['buckets'])) for op, s in self.ops.items()}
+        for op, s in sorted(ops.items()):
+            for le, n in zip(self.BUCKETS, itertools.accumulate(s['buckets'])):
+                out.append(f'gp_op_duration_seconds_bucket{{op="{op}",le="{"+Inf" if le == float("inf") else le}"}} {n}')
+            out += [f'gp_op_duration_seconds_sum{{op="{op}"}} {s["sum"]:.6f}', f'gp_op_duration_seconds_count{{op="{op}"}} {s["count"]}']
+        out += ["# HELP gp_op_errors_total Traced calls that failed.", "# TYPE gp_op_errors_total counter"]
+        out += [f'gp_op_errors_total{{op="{op}"}} {s["errors"]}' for op, s in sorted(ops.items())]
+        out += ["# HELP gp_op_cache_total Cache lookups by traced operations.", "# TYPE gp_op_cache_total counter"]
+        out += [f'gp_op_cache_total{{op="{op}",result="{r}"}} {s[r]}' for op, s in sorted(ops.items()) for r in ('hit', 'miss') if s['hit'] or s['miss']]
+        out += ["# HELP gp_op_payload_total Payload totals (bytes, rows, items) of traced operations.", "# TYPE gp_op_payload_total counter"]
+        out += [f'gp_op_payload_total{{op="{op}",unit="{k}"}} {v}' for op, s in sorted(ops.items()) for k, v in sorted(s['totals'].items())]
+        if api_stats:
+            out += ["# HELP gp_api_calls Google API scheduler counters.", "# TYPE gp_api_calls gauge"]
+            out += [f'gp_api_calls{{stat="{k}"}} {v}' for k, v in api_stats.items()]
+        return "\n".join(out) + "\n"
+
+    def jsonl(self):
+        with self._lock: spans = list(self.spans)
+        return "".join(json.dumps(s, default=str) + "\n" for s in spans)
+
+@st.cache_resource
+def get_metrics():
+    return Metrics(get_setting("perf_settings", "sample_rate", TRACE_SAMPLE_RATE))
+
+def traced(op):
+    """Decorator: records each (sampled) call as a span of `op`; the body can attach fields with trace_note()"""
+    def wrap(fn):
+        held = []  # the cache_resource lookup costs more than the span itself, so resolve it once per function
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            if not held: held.append(get_metrics())
+            metrics = held[0]; rate = metrics.sample_rate
+            if rate <= 0 or (rate < 1 and random.random() >= rate): return fn(*args, **kwargs)
+            notes = {}; token = _current_span.set(notes); error = None; start = time.perf_counter()
+            try: return fn(*args, **kwargs)
+            except Exception as e: error = type(e).__name__; raise
+            finally:
+                _current_span.reset(token); metrics.record(op, time.perf_counter() - start, error, notes)
+        return inner
+    return wrap
+
+def trace_note(**fields):
+    """Adds fields (cache='hit' / 'miss', error=..., or numeric payload sizes) to the innermost traced call, if any"""
+    notes = _current_span.get()
+    if notes is not None: notes.update(fields)
+
+def in_context(fn):
+    """Wraps `fn` to run in a copy of the caller's contextvars, so trace_note() on a pool thread reaches the span
+    that submitted it. Each call gets its own copy: one Context cannot be entered by two threads at once. Work sent
+    to render.cpu_pool is not covered; contextvars do not cross the process boundary, so it counts only towards
+    the submitting span's wall time."""
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.copy().run(fn, *args, **kwargs)
+
+# --- 3. GOOGLE SERVICES ---
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
 
+# Heavy modules (voice, PDF, cropper, Drive client) are imported on first use so a cold start only pays for the page it renders
+@st.cache_resource
+def drive_discovery_doc():
+    """The Drive v3 discovery document shipped with google-api-python-client (what static_discovery=True reads),
+    parsed once per process instead of on every per-thread client build; None if this client version lacks it"""
+    from googleapiclient.discovery_cache import get_static_doc
+    doc = get_static_doc('drive', 'v3')
+    return json.loads(doc) if doc else None
+
+def build_drive_service(creds):
+    from googleapiclient.discovery import build, build_from_document
+    doc = drive_discovery_doc()
+    if doc: return build_from_document(doc, credentials=creds)
+    return build('drive', 'v3', credentials=creds, static_discovery=True)
+
 def get_creds():
     return Credentials.from_service_account_info(st.secrets["gcp_service_account"], scopes=SCOPES)
 
-def get_sheet_client():
-    return gspread.authorize(get_creds())
+def _status_of(e):
+    """HTTP status of a gspread APIError or googleapiclient HttpError, else None"""
+    code = getattr(e, 'code', None)
+    if isinstance(code, int): return code
+    return getattr(getattr(e, 'resp', None), 'status', None)
 
-def get_drive_service():
-    return build('drive', 'v3', credentials=get_creds())
+def _is_retryable(e, idempotent=True):
+    """Throttling (429, or 403 rate limits, which Drive uses for per-user limits) means the request was not applied,
+    so any call may be retried. Timeouts, dropped connections and 5xx may have applied it: only idempotent calls
+    are retried on those, so an append, upload or delete is never repeated blind."""
+    status = _status_of(e)
+    if status == 429 or (status == 403 and 'ratelimitexceeded' in str(e).lower()): return True
+    if not idempotent: return False
+    if isinstance(e, (TransportError, requests.exceptions.ConnectionError, requests.exceptions.Timeout, TimeoutError, ConnectionError)): return True
+    return bool(status and status >= 500)
 
-def upload_to_drive(file_path, filename, mime_type):
-    service = get_drive_service()
-    folder_id = st.secrets["drive_settings"]["folder_id"]
-    file_metadata = {'name': filename, 'parents': [folder_id]}
-    media = MediaFileUpload(file_path, mimetype=mime_type)
-    file = service.files().create(body=file_metadata, media_body=media, fields='id, webViewLink, webContentLink', supportsAllDrives=True).execute()
-    file_id = file.get('id')
-    try:
-        service.permissions().create(fileId=file_id, body={'type': 'anyone', 'role': 'reader'}, supportsAllDrives=True).execute()
-    except Exception as e: 
-        logging.error(f"Failed to set Drive permissions: {e}")
+class TokenBucket:
+    """Refills `per_minute` tokens evenly over each minute; acquire() blocks until one is free"""
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0; self.capacity = float(per_minute); self.tokens = self.capacity
+        self.updated = time.monotonic(); self._lock = threading.Lock()
+
+    def acquire(self):
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate); self.updated = now
+                if self.tokens >= 1: self.tokens -= 1; return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay); waited += delay
+
+class ApiScheduler:
+    """Single entry point for Google API calls: per-minute token buckets matching the Sheets/Drive quotas,
+    single-flight for identical concurrent reads (callers passing the same `key` share one request), and retry
+    with exponential backoff and jitter on 429 (and on 5xx / transport errors for idempotent calls). `stats` counts calls, queued, coalesced, throttled, retried and failed."""
+    def __init__(self, limits):
+        self.buckets = {name: TokenBucket(per_min) for name, per_min in limits.items()}
+        self._lock = threading.Lock(); self._inflight = {}
+        self.stats = {'calls': 0, 'queued': 0, 'coalesced': 0, 'throttled': 0, 'retried': 0, 'failed': 0}
+
+    def _count(self, name):
+        with self._lock: self.stats[name] += 1
+
+    def call(self, bucket, fn, key=None, idempotent=True):
+        if key is None: return self._execute(bucket, fn, idempotent)
+        with self._lock:
+            fut = self._inflight.get(key); leader = fut is None
+            if leader: fut = self._inflight[key] = Future()
+            else: self.stats['coalesced'] += 1
+        if not leader: return fut.result()
+        try:
+            res = self._execute(bucket, fn, idempotent); fut.set_result(res); return res
+        except BaseException as e:
+            fut.set_exception(e); raise
+        finally:
+            with self._lock: self._inflight.pop(key, None)
+
+    def _execute(self, bucket, fn, idempotent=True):
+        for attempt in range(API_MAX_RETRIES + 1):
+            if self.buckets[bucket].acquire() > 0: self._count('queued')
+            self._count('calls')
+            try: return fn()
+            except Exception as e:
+                if _status_of(e) in (403, 429) and _is_retryable(e): self._count('throttled')
+                if attempt == API_MAX_RETRIES or not _is_retryable(e, idempotent):
+                    self._count('failed'); raise
+                delay = random.uniform(0, min(API_BACKOFF_CAP, API_BACKOFF_BASE * 2 ** attempt))
+                logging.warning(f"{bucket} call failed ({e}), retrying in {delay:.1f}s"); self._count('retried')
+                time.sleep(delay)
+
+    def snapshot(self):
+        with self._lock: return dict(self.stats, in_flight=len(self._inflight))
+
+@st.cache_resource
+def get_scheduler():
+    return ApiScheduler({
+        'sheets_read': get_setting("quota_settings", "sheets_reads_per_min", SHEETS_READS_PER_MIN),
+        'sheets_write': get_setting("quota_settings", "sheets_writes_per_min", SHEETS_WRITES_PER_MIN),
+        'drive': get_setting("quota_settings", "drive_calls_per_min", DRIVE_CALLS_PER_MIN),
+    })
+
+def _is_stale(e):
+    """True for errors that mean a pooled handle or token is no longer usable."""
+    if isinstance(e, (RefreshError, TransportError, requests.exceptions.ConnectionError, gspread.exceptions.WorksheetNotFound)): return True
+    return isinstance(e, gspread.exceptions.APIError) and getattr(e, 'code', None) in (401, 404)
+
+class GooglePool:
+    """Process-wide holder for the authorized Sheets client, open Spreadsheet/Worksheet handles and Drive services.
+    Sheets handles are shared behind a lock; Drive services are per-thread because httplib2 is not thread-safe.
+    Worksheets live in the app's spreadsheet unless place() gave them another one (partitions kept in their own file)."""
+    def __init__(self, scheduler):
+        self.scheduler = scheduler; self._lock = threading.RLock(); self._local = threading.local()
+        self._creds = None; self._client = None; self._sh = {}; self._ws = {}; self._homes = {}; self._generation = 0
+
+    def creds(self):
+        with self._lock:
+            if self._creds is None: self._creds = get_creds()
+            if not self._creds.valid: self._creds.refresh(GoogleAuthRequest()) # First use or expired token
+            return self._creds
+
+    def client(self):
+        with self._lock:
+            if self._client is None: self._client = gspread.authorize(self.creds())
+            elif not self._creds.valid: self.creds()
+            return self._client
+
+    def spreadsheet(self, key=None):
+        with self._lock:
+            sh = self._sh.get(key)
+            if sh is None: sh = self._sh[key] = self.client().open_by_key(key) if key else self.client().open_by_url(st.secrets["drive_settings"]["sheet_url"])
+            return sh
+
+    def place(self, name, key):
+        """Records that worksheet `name` lives in spreadsheet `key`"""
+        with self._lock: self._homes[name] = key
+
+    def worksheet(self, name):
+        with self._lock:
+            ws = self._ws.get(name)
+            if ws is None: ws = self._ws[name] = self.spreadsheet(self._homes.get(name)).worksheet(name)
+            return ws
+
+    def forget_worksheet(self, name):
+        with self._lock: self._ws.pop(name, None)
+
+    def drive(self):
+        creds = self.creds()
+        if getattr(self._local, 'generation', None) != self._generation or getattr(self._local, 'drive', None) is None:
+            self._local.drive = build_drive_service(creds); self._local.generation = self._generation
+        return self._local.drive
+
+    def reset(self):
+        """Drops every cached handle so the next call re-authorizes and re-opens."""
+        with self._lock:
+            self._creds = None; self._client = None; self._sh = {}; self._ws = {}; self._generation += 1
+
+    def _reconnecting(self, label, handle, fn, idempotent=True):
+        """Runs fn(handle()), re-opening stale handles once. A non-idempotent fn is not replayed after a dropped
+        connection, which may have reached the server; token, lookup and 401/404 failures mean it was not applied."""
+        try: h = handle()
+        except Exception as e:
+            if not _is_stale(e): raise
+            logging.warning(f"Reconnecting {label} after stale handle: {e}"); self.reset(); h = handle()
+        try: return fn(h)
+        except Exception as e:
+            if not _is_stale(e): raise
+            logging.warning(f"Reconnecting {label} after stale handle: {e}"); self.reset()
+            if not idempotent and isinstance(e, (TransportError, requests.exceptions.ConnectionError)): raise
+            return fn(handle())
+
+    def with_worksheet(self, name, fn, write=False, key=None, idempotent=None):
+        """Runs fn(worksheet) through the scheduler; reads with the same `key` are coalesced. Writes count as not
+        idempotent (no retry unless throttled) unless the caller says so."""
+        idempotent = not write if idempotent is None else idempotent
+        return self.scheduler.call('sheets_write' if write else 'sheets_read', lambda: self._reconnecting("Sheets", lambda: self.worksheet(name), fn, idempotent), key=key, idempotent=idempotent)
+
+    def with_spreadsheet(self, fn, write=False, idempotent=None):
+        idempotent = not write if idempotent is None else idempotent
+        return self.scheduler.call('sheets_write' if write else 'sheets_read', lambda: self._reconnecting("Sheets", self.spreadsheet, fn, idempotent), idempotent=idempotent)
+
+    def with_drive(self, fn, key=None, idempotent=True):
+        return self.scheduler.call('drive', lambda: self._reconnecting("Drive", self.drive, fn, idempotent), key=key, idempotent=idempotent)
+
+@st.cache_resource
+def get_pool():
+    return GooglePool(get_scheduler())
+
+def drive_link(file):
     return file.get('webContentLink', file.get('webViewLink'))
 
-# --- 3. HELPER FUNCTIONS ---
+@traced("drive_upload")
+def drive_upload(content, filename, mime_type):
+    """Uploads bytes / memoryview / file-like content into the app folder and returns the
+    file's {'id', 'webViewLink', 'webContentLink'}; it is not shared yet. Files over DRIVE_RESUMABLE_MIN go up as a
+    resumable session in DRIVE_UPLOAD_CHUNK pieces, so a retry after a dropped connection continues from the last
+    confirmed chunk instead of from zero."""
+    from googleapiclient.http import MediaIoBaseUpload
+    folder_id = st.secrets["drive_settings"]["folder_id"]
+    stream = content if hasattr(content, 'read') else io.BytesIO(content)
+    size = stream.seek(0, io.SEEK_END)
+    resumable = size > DRIVE_RESUMABLE_MIN; session = {}; trace_note(bytes=size)
+    def _upload(service):
+        request = session.get('request')
+        if request is None:
+            stream.seek(0) # Non-resumable retries must resend from the start
+            media = MediaIoBaseUpload(stream, mimetype=mime_type, chunksize=DRIVE_UPLOAD_CHUNK, resumable=resumable)
+            request = service.files().create(body={'name': filename, 'parents': [folder_id]}, media_body=media, fields='id, webViewLink, webContentLink', supportsAllDrives=True)
+            if resumable: session['request'] = request # Kept across scheduler retries: next_chunk() resumes the same session
+        if not resumable: return request.execute()
+        response = None
+        while response is None: status, response = request.next_chunk()
+        return response
+    return get_pool().with_drive(_upload, idempotent=resumable) # A lost reply to a one-shot create may still have made the file
+
+@traced("drive_batch")
+def drive_batch(requests_by_key):
+    """Sends {key: fn(service) -> HttpRequest} to Drive as HTTP batch requests of up to DRIVE_BATCH_SIZE and returns
+    {key: response or exception}. Items failing with a retryable error are re-sent on the scheduler's backoff."""
+    results = {}; pending = list(requests_by_key); trace_note(items=len(pending))
+    def _send(service):
+        for _ in range(len(pending) - 1): get_pool().scheduler.buckets['drive'].acquire() # Drive counts each batched request
+        try:
+            for i in range(0, len(pending), DRIVE_BATCH_SIZE):
+                chunk = pending[i:i + DRIVE_BATCH_SIZE]
+                def _done(request_id, response, exception, chunk=chunk): results[chunk[int(request_id)]] = response if exception is None else exception
+                batch = service.new_batch_http_request(callback=_done)
+                for n, key in enumerate(chunk): batch.add(requests_by_key[key](service), request_id=str(n))
+                batch.execute()
+        finally:
+            pending[:] = [k for k in pending if k not in results or (isinstance(results[k], Exception) and _is_retryable(results[k]))]
+        retry = [results[k] for k in pending if k in results]
+        if retry: raise retry[0]
+    if pending:
+        try: get_pool().with_drive(_send)
+        except Exception as e:
+            for key in pending: results.setdefault(key, e) # Never sent, or still failing after the last retry
+    return results
+
+def share_drive_files(file_ids):
+    """Makes the files link-readable in one batched call; returns {file_id: permission or exception}"""
+    return drive_batch({fid: (lambda service, fid=fid: service.permissions().create(fileId=fid, body={'type': 'anyone', 'role': 'reader'}, fields='id', supportsAllDrives=True))
+                        for fid in file_ids})
+
+@traced("upload_to_drive")
+def upload_to_drive(content, filename, mime_type):
+    """Uploads one file and makes it link-readable; returns its link"""
+    file = drive_upload(content, filename, mime_type)
+    shared = share_drive_files([file['id']])[file['id']]
+    if isinstance(shared, Exception): logging.error(f"Failed to set Drive permissions: {shared}")
+    return drive_link(file)
+
+# --- 4. HELPER FUNCTIONS ---
+def get_setting(section, key, default=None):
+    """Reads an optional secrets value without failing when the section or secrets file is missing"""
+    try: return st.secrets.get(section, {}).get(key, default)
+    except Exception: return default
+
 def hash_password(password):
     """Encrypts passwords using SHA-256"""
     return hashlib.sha256(password.encode()).hexdigest()
 
 def save_profile_pic_drive(image_input, username):
     """Replaces Local Storage to fix Ephemeral bug. Resizes and uploads DP to Drive."""
-    if not os.path.exists("temp"): os.makedirs("temp")
-    
     if isinstance(image_input, bytes):
         img = Image.open(io.BytesIO(image_input))
     else:
         img = image_input
 
+    if img.format == "JPEG": img.draft("RGB", (500, 500)) # Decode at reduced scale, never below 500px
+    img = ImageOps.exif_transpose(img)
     if img.mode in ("RGBA", "P"): img = img.convert("RGB")
     
     # 500x500 WhatsApp Standard
     img = img.resize((500, 500), Image.Resampling.LANCZOS)
     
-    temp_path = f"temp/dp_{username}_{int(time.time())}.jpg"
-    img.save(temp_path, "JPEG", quality=85, optimize=True)
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=85, optimize=True)
     
-    link = upload_to_drive(temp_path, f"ProfilePic_{username}.jpg", "image/jpeg")
+    link = upload_to_drive(buf.getbuffer(), f"ProfilePic_{username}.jpg", "image/jpeg")
     return link
 
 def safe_image(image_source, width=None, caption=None):
@@ -94,226 +487,1622 @@ def safe_image(image_source, width=None, caption=None):
     except: pass
 
 def get_file_id_from_url(url):
-    match = re.search(r'/d/([a-zA-Z0-9_-]+)', url)
+    match = re.search(r'(?:/d/|[?&]id=)([a-zA-Z0-9_-]+)', url) # webViewLink (/d/<id>/view) or webContentLink (uc?id=<id>)
     return match.group(1) if match else None
 
+@traced("download_pdf_from_drive")
 def download_pdf_from_drive(drive_link):
+    """Path of the PDF in the local cache, downloaded on first use only (Drive files never change under an ID)"""
     file_id = get_file_id_from_url(drive_link)
     if not file_id: return None
-    service = get_drive_service()
-    request = service.files().get_media(fileId=file_id)
-    fh = io.BytesIO()
-    downloader = MediaIoBaseDownload(fh, request)
-    done = False
-    while done is False: status, done = downloader.next_chunk()
-    return fh
+    cache = get_pdf_cache(); key = f"{file_id}.pdf"
+    path = cache.get(key)
+    if path: trace_note(cache="hit"); return path
+    trace_note(cache="miss")
+    from googleapiclient.http import MediaIoBaseDownload
+    with cache.writing(key) as fh:
+        def _download(service):
+            fh.seek(0); fh.truncate() # A retry starts over
+            downloader = MediaIoBaseDownload(fh, service.files().get_media(fileId=file_id), chunksize=PDF_DOWNLOAD_CHUNK)
+            done = False
+            while done is False: status, done = downloader.next_chunk()
+        get_pool().with_drive(_download)
+        trace_note(bytes=fh.tell())
+    return cache.get(key)
 
+@st.cache_resource
+def get_download_pool():
+    return ThreadPoolExecutor(max_workers=DRIVE_DOWNLOAD_WORKERS, thread_name_prefix="drive-download")
+
+@traced("merge_pdfs")
 def merge_pdfs(pdf_links):
-    merger = PdfWriter()
-    for link in pdf_links:
-        if str(link).startswith('http'):
-            pdf_bytes = download_pdf_from_drive(link)
-            if pdf_bytes: merger.append(pdf_bytes)
-    output = io.BytesIO()
-    merger.write(output)
-    return output.getvalue()
+    """Merges the linked Drive PDFs, in order, into a bundle file in the PDF cache and returns its path. Sources
+    download concurrently into the cache; a repeat of the same ordered link list is served without any download."""
+    from pypdf import PdfWriter
+    links = [str(l) for l in pdf_links if str(l).startswith('http')]
+    cache = get_pdf_cache(); key = f"bundle_{hashlib.sha256(chr(10).join(links).encode()).hexdigest()}.pdf"
+    path = cache.get(key); trace_note(files=len(links))
+    if path: trace_note(cache="hit"); return path
+    trace_note(cache="miss"); merger = PdfWriter()
+    for pdf_path in get_download_pool().map(in_context(download_pdf_from_drive), links): # map keeps link order
+        if pdf_path: merger.append(pdf_path)
+    with cache.writing(key) as f: merger.write(f); trace_note(bytes=f.tell()) # Straight to disk, never a second in-memory copy
+    return cache.get(key)
+
+def _thumbnail_to(data, f):
+    img = Image.open(io.BytesIO(data))
+    if img.format == "JPEG": img.draft("RGB", (THUMB_SIZE, THUMB_SIZE))
+    img = ImageOps.exif_transpose(img)
+    if img.mode != "RGB": img = img.convert("RGB")
+    img.thumbnail((THUMB_SIZE, THUMB_SIZE), Image.Resampling.LANCZOS); img.save(f, "JPEG", quality=70, optimize=True)
 
+def save_thumbnail(file_id, data):
+    """Caches a thumbnail of the photo `data` under its Drive file ID and returns its path"""
+    cache = get_thumb_cache(); key = f"{file_id}.jpg"
+    path = cache.get(key)
+    if path: return path
+    with cache.writing(key) as f: _thumbnail_to(data, f)
+    return cache.get(key)
+
+@traced("fetch_thumbnail")
+def _fetch_thumbnail(file_id):
+    from googleapiclient.http import MediaIoBaseDownload
+    def _download(service):
+        buf = io.BytesIO(); downloader = MediaIoBaseDownload(buf, service.files().get_media(fileId=file_id), chunksize=PDF_DOWNLOAD_CHUNK)
+        done = False
+        while done is False: status, done = downloader.next_chunk()
+        return buf.getvalue()
+    data = get_pool().with_drive(_download, key=("thumbnail", file_id)); trace_note(bytes=len(data))
+    return save_thumbnail(file_id, data) # Only the thumbnail is kept, never the photo
+
+def _fetch_thumbnail_or_none(file_id):
+    try: return _fetch_thumbnail(file_id)
+    except Exception as e:
+        logging.error(f"Thumbnail fetch failed for {file_id}: {e}"); return None
+
+@st.cache_resource
+def get_thumb_misses():
+    return {} # file id -> time a fetch failed
+
+def get_thumbnails(links):
+    """{link: thumbnail path or None} for evidence photo links. Cached thumbnails cost no Drive call; the rest are
+    downloaded concurrently, once, and shrunk into the thumbnail cache. Failed fetches are not retried for THUMB_RETRY_SECS."""
+    cache = get_thumb_cache(); misses = get_thumb_misses(); now = time.time()
+    ids = {link: get_file_id_from_url(link) for link in links if str(link).startswith('http')}
+    paths = {link: cache.get(f"{fid}.jpg") if fid else None for link, fid in ids.items()}
+    todo = sorted({fid for link, fid in ids.items() if fid and not paths[link] and now - misses.get(fid, 0) > THUMB_RETRY_SECS})
+    fetched = dict(zip(todo, get_download_pool().map(in_context(_fetch_thumbnail_or_none), todo)))
+    for fid, path in fetched.items():
+        if path is None: misses[fid] = now
+    return {link: paths[link] or fetched.get(ids[link]) for link in ids}
+
+@traced("compress_images")
+def compress_images(inputs, max_width=render.IMAGE_MAX_WIDTH, quality=65):
+    """Compresses a batch of photos (bytes or file-like) across the process pool; returns CompressedImage per input"""
+    raw = [bytes(x) if isinstance(x, (bytes, bytearray, memoryview)) else x.getvalue() for x in inputs]
+    trace_note(images=len(raw), bytes=sum(len(b) for b in raw))
+    return render.compress_all(raw, max_width, quality)
+
+@traced("compress_image")
 def compress_image(image_input):
-    if not os.path.exists("temp"): os.makedirs("temp")
-    if isinstance(image_input, Image.Image):
-        img = image_input
-        filename = f"crop_{int(datetime.now().timestamp())}.jpg"
-    elif isinstance(image_input, bytes):
-        img = Image.open(io.BytesIO(image_input))
-        filename = f"cam_{int(datetime.now().timestamp())}.jpg"
-    else:
-        img = Image.open(image_input)
-        filename = image_input.name
+    """Returns the compressed JPEG as bytes; nothing touches the disk"""
+    if isinstance(image_input, Image.Image): img = image_input
+    elif isinstance(image_input, (bytes, bytearray, memoryview)): img = Image.open(io.BytesIO(image_input))
+    else: img = Image.open(image_input)
+    return render.compress_to_jpeg(img, render.IMAGE_MAX_WIDTH, 65).data
 
-    if img.mode in ("RGBA", "P"): img = img.convert("RGB")
-    max_width = 1000
-    if img.width > max_width:
-        ratio = max_width / float(img.width)
-        new_height = int(float(img.height) * ratio)
-        img = img.resize((max_width, new_height), Image.Resampling.LANCZOS)
-    
-    save_path = f"temp/compressed_{int(datetime.now().timestamp())}_{filename}"
-    img.save(save_path, "JPEG", quality=65, optimize=True)
-    return save_path
+@st.cache_resource
+def get_vosk_model(path):
+    if not os.path.isdir(path): raise FileNotFoundError(f"Vosk model not found at {path}")
+    from vosk import Model, SetLogLevel
+    SetLogLevel(-1); return Model(path)
 
-def transcribe_audio(audio_bytes):
+def _transcribe_vosk(audio_bytes):
+    """Offline engine: feeds the WAV to Kaldi VOSK_CHUNK_FRAMES at a time, as it would a live stream"""
+    from vosk import KaldiRecognizer
+    model = get_vosk_model(get_setting("voice_settings", "vosk_model", VOSK_MODEL_PATH))
+    parts = []
+    with wave.open(io.BytesIO(audio_bytes)) as wav:
+        if wav.getsampwidth() != 2: raise ValueError(f"Unsupported sample width {wav.getsampwidth()}")
+        channels = wav.getnchannels(); rec = KaldiRecognizer(model, wav.getframerate())
+        while True:
+            frames = wav.readframes(VOSK_CHUNK_FRAMES)
+            if not frames: break
+            if channels > 1: frames = np.frombuffer(frames, dtype='<i2').reshape(-1, channels).mean(axis=1).astype('<i2').tobytes() # Downmix to mono
+            if rec.AcceptWaveform(frames): parts.append(json.loads(rec.Result()).get("text", ""))
+        parts.append(json.loads(rec.FinalResult()).get("text", ""))
+    return " ".join(p for p in parts if p)
+
+def _transcribe_google(audio_bytes):
+    """Network engine (Google Web Speech); fallback only"""
+    import speech_recognition as sr
     r = sr.Recognizer()
-    audio_file = io.BytesIO(audio_bytes)
-    try:
-        with sr.AudioFile(audio_file) as source: audio = r.record(source)
-        return r.recognize_google(audio)
-    except: return "Could not understand audio"
+    with sr.AudioFile(io.BytesIO(audio_bytes)) as source: audio = r.record(source)
+    try: return r.recognize_google(audio)
+    except sr.UnknownValueError: return ""
 
-def send_whatsapp(to_number, body):
-    """Sends a WhatsApp message via Twilio API"""
-    if "whatsapp_settings" not in st.secrets: 
-        logging.info("WhatsApp bypassed: No secrets found.")
-        return False
-    try:
-        w = st.secrets["whatsapp_settings"]
-        sid = w["account_sid"]
-        token = w["auth_token"]
-        from_num = w["from_number"]
-        url = f"https://api.twilio.com/2010-04-01/Accounts/{sid}/Messages.json"
-        data = {"From": f"whatsapp:{from_num}", "To": f"whatsapp:{to_number}", "Body": body}
-        res = requests.post(url, data=data, auth=(sid, token))
-        if res.status_code in [200, 201]: return True
-        else: 
-            logging.error(f"WhatsApp Failed: {res.text}")
-            return False
-    except Exception as e:
-        logging.error(f"WhatsApp Exception: {e}")
-        return False
+def _vosk_ready():
+    """Vosk is optional: it needs `pip install vosk` and a model unpacked at [voice_settings] vosk_model"""
+    path = get_setting("voice_settings", "vosk_model", VOSK_MODEL_PATH)
+    if importlib.util.find_spec("vosk") is None: return "the vosk package is not installed"
+    if not os.path.isdir(path): return f"no model at {path}"
+
+TRANSCRIBE_ENGINES = {"vosk": _transcribe_vosk, "google": _transcribe_google} # name -> fn(wav bytes) -> text; add engines here
+TRANSCRIBE_ENGINE_CHECKS = {"vosk": _vosk_ready} # Optional engines: name -> fn() -> why it cannot run, or None
+
+class Transcriber:
+    """Speech-to-text off the script thread. Engines are tried in [voice_settings] engines order (offline Vosk,
+    then Google) until one returns text; optional engines not set up on this host are skipped. Results are kept
+    as Futures keyed by the audio's SHA-256, so a clip is transcribed once however many reruns ask for it."""
+    def __init__(self, engines):
+        self.engines = []
+        for name in engines:
+            missing = TRANSCRIBE_ENGINE_CHECKS.get(name, lambda: None)()
+            if missing: logging.info(f"Transcription engine {name} skipped: {missing}")
+            else: self.engines.append(name)
+        self._lock = threading.Lock(); self._results = OrderedDict() # sha256 -> Future
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="transcribe")
+
+    @traced("transcribe_audio")
+    def submit(self, audio_bytes):
+        """Returns (key, Future of the text), starting the work only for audio not already seen"""
+        key = hashlib.sha256(audio_bytes).hexdigest()
+        with self._lock:
+            fut = self._results.get(key)
+            trace_note(cache="miss" if fut is None else "hit", bytes=len(audio_bytes))
+            if fut is None:
+                fut = self._results[key] = self._pool.submit(in_context(self._transcribe), bytes(audio_bytes))
+                while len(self._results) > TRANSCRIPT_CACHE_SIZE: self._results.popitem(last=False)
+            else: self._results.move_to_end(key)
+        return key, fut
+
+    def result(self, key):
+        with self._lock: return self._results.get(key)
+
+    @traced("transcribe_engine")
+    def _transcribe(self, audio_bytes):
+        for name in self.engines:
+            engine = TRANSCRIBE_ENGINES.get(name)
+            if engine is None: logging.error(f"Unknown transcription engine: {name}"); continue
+            try:
+                text = engine(audio_bytes).strip()
+                if text: trace_note(engine=name); return text
+            except Exception as e: logging.error(f"Transcription engine {name} failed: {e}")
+        trace_note(error="NoTranscript")
+        return "Could not understand audio"
 
-def send_email_with_pdf(to_emails, subject, body, attachment_path):
-    if not to_emails or "email_settings" not in st.secrets: return False
+@st.cache_resource
+def get_transcriber():
+    return Transcriber(get_setting("voice_settings", "engines", TRANSCRIBE_ENGINE_ORDER))
+
+class Undeliverable(Exception):
+    """The provider rejected the message for good (bad address or number); the outbox does not retry it"""
+
+@st.cache_resource
+def get_http_session():
+    session = requests.Session() # Keeps TLS connections to Twilio alive between messages
+    session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8))
+    return session
+
+@traced("send_whatsapp")
+def send_whatsapp(to_number, body, session=None):
+    """Sends a WhatsApp message via Twilio API on the pooled session; raises on failure"""
+    w = st.secrets["whatsapp_settings"]
+    sid = w["account_sid"]
+    token = w["auth_token"]
+    from_num = w["from_number"]
+    url = f"https://api.twilio.com/2010-04-01/Accounts/{sid}/Messages.json"
+    data = {"From": f"whatsapp:{from_num}", "To": f"whatsapp:{to_number}", "Body": body}
+    res = (session or get_http_session()).post(url, data=data, auth=(sid, token), timeout=30)
+    if res.status_code in [200, 201]: return True
+    error = f"WhatsApp Failed: {res.status_code} {res.text[:200]}"
+    if 400 <= res.status_code < 500 and res.status_code != 429: raise Undeliverable(error)
+    raise RuntimeError(error)
+
+def smtp_connect():
+    s = st.secrets["email_settings"]
+    server = smtplib.SMTP('smtp.gmail.com', 587, timeout=30); server.starttls(); server.login(s["sender_email"], s["app_password"])
+    return server
+
+@traced("send_email")
+def send_email_with_pdf(to_emails, subject, body, attachment, filename="DebitNote.pdf", server=None):
+    """`attachment` is the PDF as bytes. Sends over `server` (a logged-in SMTP connection)
+    when given, otherwise over a one-off connection; raises on failure"""
     sender_email = st.secrets["email_settings"]["sender_email"]
-    password = st.secrets["email_settings"]["app_password"]
     msg = MIMEMultipart(); msg['From'] = sender_email; msg['To'] = ", ".join(to_emails); msg['Subject'] = subject
     msg.attach(MIMEText(body, 'plain'))
-    if attachment_path and os.path.exists(attachment_path):
-        with open(attachment_path, "rb") as attachment:
-            part = MIMEBase("application", "octet-stream"); part.set_payload(attachment.read())
-        encoders.encode_base64(part); part.add_header("Content-Disposition", f"attachment; filename= {os.path.basename(attachment_path)}"); msg.attach(part)
-    try:
-        server = smtplib.SMTP('smtp.gmail.com', 587); server.starttls(); server.login(sender_email, password)
-        server.sendmail(sender_email, to_emails, msg.as_string()); server.quit(); return True
-    except Exception as e: 
-        logging.error(f"Email Failed: {e}")
-        return False
+    if isinstance(attachment, (bytes, bytearray, memoryview)):
+        part = MIMEBase("application", "octet-stream"); part.set_payload(bytes(attachment))
+        encoders.encode_base64(part); part.add_header("Content-Disposition", f"attachment; filename= {filename}"); msg.attach(part)
+        trace_note(bytes=len(attachment))
+    if server is not None: server.sendmail(sender_email, to_emails, msg.as_string()); return True
+    server = smtp_connect()
+    try: server.sendmail(sender_email, to_emails, msg.as_string())
+    finally:
+        with contextlib.suppress(Exception): server.quit()
+    return True
+
+class Outbox:
+    """Durable queue of outgoing email and WhatsApp messages in SQLite. Callers enqueue and return at once; one
+    worker drains it over a kept-alive SMTP connection and the pooled HTTP session, rate-limited per channel,
+    retrying failures with exponential backoff up to OUTBOX_MAX_ATTEMPTS. Each message ends up in the
+    Notifications table as sent or failed. Messages still pending at exit are sent after the next start."""
+    def __init__(self, path):
+        self._lock = threading.RLock(); self._cv = threading.Condition(); self._closed = False
+        self._server = None; self._server_used = 0.0
+        self._buckets = {"email": TokenBucket(get_setting("quota_settings", "emails_per_min", EMAILS_PER_MIN)),
+                         "whatsapp": TokenBucket(get_setting("quota_settings", "whatsapp_per_min", WHATSAPP_PER_MIN))}
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, uid TEXT, channel TEXT, payload TEXT, "
+                          "attachment BLOB, state TEXT DEFAULT 'pending', attempts INTEGER DEFAULT 0, next_at REAL, error TEXT, "
+                          "created REAL, done_at REAL, logged INTEGER DEFAULT 0)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (state, next_at)")
+        self.conn.execute("DELETE FROM outbox WHERE state != 'pending' AND logged = 1 AND done_at < ?", (time.time() - OUTBOX_RETENTION_SECS,))
+        for row in self.conn.execute("SELECT id, uid, channel, payload, state, error FROM outbox WHERE state != 'pending' AND logged = 0").fetchall():
+            self._log(*row) # Finished before a crash but never reached the Notifications sheet
+        self._thread = threading.Thread(target=self._run, name="outbox", daemon=True); self._thread.start()
+        atexit.register(self.close)
+
+    def enqueue(self, channel, payload, attachment=None):
+        uid = uuid.uuid4().hex[:12]; now = time.time()
+        with self._lock:
+            self.conn.execute("INSERT INTO outbox (uid, channel, payload, attachment, next_at, created) VALUES (?,?,?,?,?,?)",
+                              (uid, channel, json.dumps(payload), attachment, now, now))
+        with self._cv: self._cv.notify()
+        return uid
+
+    def _due(self):
+        with self._lock:
+            return self.conn.execute("SELECT id, uid, channel, payload, attachment, attempts FROM outbox WHERE state = 'pending' AND next_at <= ? "
+                                     "ORDER BY next_at, id LIMIT 1", (time.time(),)).fetchone()
+
+    def _idle_secs(self):
+        with self._lock: nxt = self.conn.execute("SELECT MIN(next_at) FROM outbox WHERE state = 'pending'").fetchone()[0]
+        return SMTP_IDLE_SECS if nxt is None else min(SMTP_IDLE_SECS, max(0.0, nxt - time.time()))
+
+    def _run(self):
+        while True:
+            with self._cv:
+                if self._closed: return
+            row = self._due()
+            if row is None:
+                if self._server is not None and time.monotonic() - self._server_used >= SMTP_IDLE_SECS: self._close_smtp()
+                with self._cv:
+                    if not self._closed: self._cv.wait(timeout=self._idle_secs())
+                continue
+            self._deliver(*row)
+
+    def _smtp(self):
+        if self._server is None: self._server = smtp_connect()
+        self._server_used = time.monotonic()
+        return self._server
+
+    def _close_smtp(self):
+        if self._server is not None:
+            with contextlib.suppress(Exception): self._server.quit()
+        self._server = None
+
+    def _send(self, channel, p, attachment):
+        if channel == "whatsapp": return send_whatsapp(p['to'], p['body'], get_http_session())
+        for attempt in range(2): # The server may have dropped the kept-alive connection; reconnect once
+            try: return send_email_with_pdf(p['to'], p['subject'], p['body'], attachment, p.get('filename', "DebitNote.pdf"), server=self._smtp())
+            except smtplib.SMTPServerDisconnected:
+                self._close_smtp()
+                if attempt: raise
+
+    def _deliver(self, rid, uid, channel, payload, attachment, attempts):
+        p = json.loads(payload)
+        try:
+            self._buckets[channel].acquire()
+            self._send(channel, p, attachment)
+            self._finish(rid, uid, channel, payload, "sent", None, attempts + 1)
+        except Exception as e:
+            attempts += 1
+            logging.error(f"Outbox {channel} {uid} attempt {attempts} failed: {e}")
+            if isinstance(e, (Undeliverable, smtplib.SMTPRecipientsRefused)) or attempts >= OUTBOX_MAX_ATTEMPTS: self._finish(rid, uid, channel, payload, "dead", str(e), attempts)
+            else:
+                delay = random.uniform(0, min(OUTBOX_BACKOFF_CAP, OUTBOX_BACKOFF_BASE * 2 ** attempts))
+                with self._lock: self.conn.execute("UPDATE outbox SET attempts = ?, next_at = ?, error = ? WHERE id = ?", (attempts, time.time() + delay, str(e), rid))
+
+    def _finish(self, rid, uid, channel, payload, state, error, attempts):
+        with self._lock: self.conn.execute("UPDATE outbox SET state = ?, error = ?, attempts = ?, done_at = ?, attachment = NULL WHERE id = ?", (state, error, attempts, time.time(), rid))
+        self._log(rid, uid, channel, payload, state, error)
+
+    def _log(self, rid, uid, channel, payload, state, error):
+        p = json.loads(payload)
+        to = ", ".join(p['to']) if isinstance(p['to'], list) else p['to']
+        message = f"Email to {to}: {p['subject']}" if channel == "email" else f"WhatsApp to {to}: {p['body']}"
+        if state == "dead": message = f"FAILED ({error}) {message}"
+        def _logged(fut):
+            if fut.exception() is None:
+                with self._lock: self.conn.execute("UPDATE outbox SET logged = 1 WHERE id = ?", (rid,))
+        try: db_insert("Notifications", [uid, message, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), "Email" if channel == "email" else "WhatsApp"]).add_done_callback(_logged)
+        except Exception as e: logging.error(f"Notification log failed: {e}") # Retried on the next start
+
+    def close(self):
+        with self._cv:
+            if self._closed: return
+            self._closed = True; self._cv.notify()
+        self._thread.join(timeout=5); self._close_smtp()
+
+@st.cache_resource
+def get_outbox():
+    return Outbox(OUTBOX_DB_PATH)
+
+def notify_email(to_emails, subject, body, attachment=None, filename="DebitNote.pdf"):
+    """Queues an email in the outbox and returns its id, or None when email is not configured"""
+    if not to_emails or "email_settings" not in st.secrets: return None
+    return get_outbox().enqueue("email", {"to": list(to_emails), "subject": subject, "body": body, "filename": filename},
+                                bytes(attachment) if attachment is not None else None)
+
+def notify_whatsapp(to_number, body):
+    """Queues a WhatsApp message in the outbox and returns its id, or None when WhatsApp is not configured"""
+    if "whatsapp_settings" not in st.secrets:
+        logging.info("WhatsApp bypassed: No secrets found.")
+        return None
+    return get_outbox().enqueue("whatsapp", {"to": to_number, "body": body})
+
+# --- 5. DATABASE OPERATIONS ---
+TABLES = {
+    "DebitNotes": ["ID", "Contractor Name", "Date", "Amount", "Category", "Reason", "Site Location", "Image Links", "PDF Link", "SubmittedBy"],
+    "Contractors": ["ID", "Name", "Details", "Email", "Phone"], # Added Phone for WhatsApp
+    "Users": ["Username", "Password", "Role", "ProfilePic"],
+    "Notifications": ["ID", "Message", "Timestamp", "Type"]
+}
+SCHEMA_VERSION = 1 # Bump whenever TABLES changes so running processes re-check headers
+
+@st.cache_resource
+def ensure_schema(version):
+    """Checks and migrates headers once per process and schema version: one metadata read, one batched header read,
+    and at most one write per worksheet."""
+    pool = get_pool()
+    existing = {ws.title for ws in pool.with_spreadsheet(lambda sh: sh.worksheets())}
+    if REVISIONS_SHEET not in existing:
+        pool.with_spreadsheet(lambda sh: sh.add_worksheet(REVISIONS_SHEET, 100, len(Revisions.HEADERS)), write=True)
+        pool.with_worksheet(REVISIONS_SHEET, lambda ws: ws.append_row(Revisions.HEADERS), write=True)
+    present = [name for name in TABLES if name in existing]
+    ranges = pool.with_spreadsheet(lambda sh: sh.values_batch_get([f"'{name}'!1:1" for name in present])).get('valueRanges', []) if present else []
+    current = {name: (vr.get('values') or [[]])[0] for name, vr in zip(present, ranges)}
+    for name, headers in TABLES.items():
+        if name not in existing:
+            pool.forget_worksheet(name)
+            pool.with_spreadsheet(lambda sh: sh.add_worksheet(name, 100, len(headers)), write=True)
+            pool.with_worksheet(name, lambda ws: ws.append_row(headers), write=True)
+            continue
+        curr = current.get(name, [])
+        if len(curr) < len(headers):
+            def _migrate(ws):
+                if ws.col_count < len(headers): ws.resize(cols=len(headers))
+                ws.update([headers[len(curr):]], gspread.utils.rowcol_to_a1(1, len(curr) + 1))
+            pool.with_worksheet(name, _migrate, write=True, idempotent=True); get_revisions().bump({name: True})
+    return version
 
-# --- 4. DATABASE OPERATIONS ---
 def init_db():
-    try:
-        client = get_sheet_client()
-        sh = client.open_by_url(st.secrets["drive_settings"]["sheet_url"])
-        tables = {
-            "DebitNotes": ["ID", "Contractor Name", "Date", "Amount", "Category", "Reason", "Site Location", "Image Links", "PDF Link", "SubmittedBy"],
-            "Contractors": ["ID", "Name", "Details", "Email", "Phone"], # Added Phone for WhatsApp
-            "Users": ["Username", "Password", "Role", "ProfilePic"],
-            "Notifications": ["ID", "Message", "Timestamp", "Type"]
-        }
-        for name, headers in tables.items():
-            try: 
-                ws = sh.worksheet(name)
-                curr = ws.row_values(1)
-                if len(curr) < len(headers):
-                    ws.resize(cols=len(headers))
-                    for i, h in enumerate(headers): 
-                        if i >= len(curr): ws.update_cell(1, i+1, h)
-            except: 
-                ws = sh.add_worksheet(name, 100, len(headers)); ws.append_row(headers)
+    try: ensure_schema(SCHEMA_VERSION); ensure_partitions(SCHEMA_VERSION)
     except Exception as e: st.error(f"DB Error: {e}")
 
-# CACHED TO MAKE DASHBOARD LIGHTNING FAST
-@st.cache_data(ttl=300)
-def db_get(table):
+def _q(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+def _row_from_range(a1_range):
+    """Sheet row number at the start of an A1 range such as 'DebitNotes!A12:J12'"""
+    match = re.search(r'![A-Z]+(\d+)', a1_range or "")
+    return int(match.group(1)) if match else None
+
+class SheetMirror:
+    """Local SQLite copy of the Sheets tables. The Sheet stays the system of record: reads sync incrementally
+    (only rows past the last mirrored row), a full re-sync runs in the background every MIRROR_FULL_SYNC_SECS,
+    and every write is applied to both stores."""
+    def __init__(self, path):
+        self._lock = threading.RLock(); self._syncing = set(); self._cols = {}
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS _sync (tbl TEXT PRIMARY KEY, last_row INTEGER, last_key TEXT, full_at REAL, synced_at REAL)")
+
+    def columns(self, table):
+        with self._lock:
+            if table not in self._cols:
+                info = self.conn.execute(f"PRAGMA table_info({_q(table)})").fetchall()
+                self._cols[table] = [r[1] for r in info if r[1] != '_row']
+            return self._cols[table]
+
+    def _state(self, table):
+        return self.conn.execute("SELECT last_row, last_key, full_at, synced_at FROM _sync WHERE tbl=?", (table,)).fetchone()
+
+    def _set_state(self, table, last_row, last_key, full_at=None):
+        now = time.time()
+        self.conn.execute("INSERT INTO _sync VALUES (?,?,?,?,?) ON CONFLICT(tbl) DO UPDATE SET last_row=excluded.last_row, last_key=excluded.last_key, "
+                          "full_at=COALESCE(?, full_at), synced_at=excluded.synced_at", (table, last_row, last_key, full_at or now, now, full_at))
+
+    def _pad(self, row, width):
+        row = [str(v) for v in row[:width]]
+        return row + [""] * (width - len(row))
+
+    def full_sync(self, table):
+        data = get_pool().with_worksheet(table, lambda ws: ws.get_all_values(), key=("get_all_values", table))
+        headers = [h or f"col{i+1}" for i, h in enumerate(data[0])] if data else table_headers(table) or []
+        rows = [self._pad(r, len(headers)) for r in data[1:]]
+        with self._lock:
+            c = self.conn
+            c.execute("BEGIN")
+            try:
+                c.execute(f"DROP TABLE IF EXISTS {_q(table)}")
+                c.execute(f"CREATE TABLE {_q(table)} (_row INTEGER, {', '.join(_q(h) + ' TEXT' for h in headers)})")
+                c.execute(f"CREATE INDEX {_q('ix_' + table + '_row')} ON {_q(table)} (_row)")
+                c.executemany(f"INSERT INTO {_q(table)} VALUES ({', '.join('?' * (len(headers) + 1))})", [(i + 2, *r) for i, r in enumerate(rows)])
+                last_key = rows[-1][0] if rows else (headers[0] if headers else "")
+                self._set_state(table, len(rows) + 1, last_key, full_at=time.time())
+                c.execute("COMMIT")
+            except Exception:
+                c.execute("ROLLBACK"); raise
+            self._cols[table] = headers
+
+    def incremental_sync(self, table):
+        """Fetches only the rows past the last mirrored row, overlapping by one row to detect shifted data"""
+        last_row, last_key, _, _ = self._state(table)
+        cols = self.columns(table)
+        end_col = re.sub(r'\d', '', gspread.utils.rowcol_to_a1(1, len(cols)))
+        values = get_pool().with_worksheet(table, lambda ws: ws.get_values(f"A{last_row}:{end_col}"), key=("get_values", table, last_row))
+        if not values or str(values[0][0] if values[0] else "") != str(last_key):
+            return self.full_sync(table) # Rows moved under us (edited or deleted elsewhere)
+        with self._lock:
+            # A concurrent sync or write may have moved the mirror on while we fetched: start from where it is now,
+            # and drop the fetch (the next sync retries) if that row is not in it or no longer matches
+            cur_row, cur_key, _, _ = self._state(table); skip = cur_row - last_row
+            if skip < 0 or skip >= len(values) or self.columns(table) != cols or str(values[skip][0] if values[skip] else "") != str(cur_key): return
+            new_rows = [self._pad(r, len(cols)) for r in values[skip + 1:]]
+            if new_rows:
+                self.conn.executemany(f"INSERT INTO {_q(table)} VALUES ({', '.join('?' * (len(cols) + 1))})",
+                                      [(cur_row + 1 + i, *r) for i, r in enumerate(new_rows)])
+            self._set_state(table, cur_row + len(new_rows), new_rows[-1][0] if new_rows else cur_key)
+
+    def _background_full_sync(self, table):
+        with self._lock:
+            if table in self._syncing: return
+            self._syncing.add(table)
+        def _run():
+            try: self.full_sync(table)
+            except Exception as e: logging.error(f"Mirror full sync failed for {table}: {e}")
+            finally:
+                with self._lock: self._syncing.discard(table)
+        threading.Thread(target=_run, daemon=True).start()
+
+    def sync(self, table):
+        state = self._state(table)
+        if state is None or not self.columns(table): return self.full_sync(table)
+        now = time.time()
+        if now - state[2] > MIRROR_FULL_SYNC_SECS: self._background_full_sync(table)
+        if now - state[3] > MIRROR_SYNC_SECS:
+            try: self.incremental_sync(table)
+            except Exception as e: logging.error(f"Mirror sync failed for {table}, serving local copy: {e}")
+
+    def query(self, sql, params=()):
+        with self._lock: return pd.read_sql_query(sql, self.conn, params=params)
+
+    def read(self, table):
+        cols = self.columns(table)
+        return self.query(f"SELECT {', '.join(_q(c) for c in cols)} FROM {_q(table)} ORDER BY _row")
+
+    def rows_from(self, table, first_row):
+        """Mirrored rows from sheet row `first_row` on, as lists (row 1 is the header)"""
+        cols = self.columns(table)
+        with self._lock: rows = self.conn.execute(f"SELECT {', '.join(_q(c) for c in cols)} FROM {_q(table)} WHERE _row >= ? ORDER BY _row", (max(first_row, 2),)).fetchall()
+        return ([cols] if first_row <= 1 else []) + [list(r) for r in rows]
+
+    def apply_insert(self, table, row_data, sheet_row=None):
+        cols = self.columns(table)
+        if not cols: return
+        with self._lock:
+            last_row, last_key, _, _ = self._state(table)
+            if sheet_row and sheet_row <= last_row: return # A sync already mirrored it from the sheet
+            sheet_row = sheet_row or last_row + 1
+            row = self._pad(row_data, len(cols))
+            self.conn.execute(f"INSERT INTO {_q(table)} VALUES ({', '.join('?' * (len(cols) + 1))})", (sheet_row, *row))
+            if sheet_row > last_row: self._set_state(table, sheet_row, row[0])
+
+    def apply_update(self, table, key_col, key, changes):
+        cols = self.columns(table); changes = {k: v for k, v in changes.items() if k in cols}
+        if not changes or key_col not in cols: return
+        with self._lock:
+            self.conn.execute(f"UPDATE {_q(table)} SET {', '.join(_q(k) + '=?' for k in changes)} WHERE {_q(key_col)}=?",
+                              (*[str(v) for v in changes.values()], str(key)))
+            if cols[0] in changes: # Keep the incremental-sync anchor in step with the sheet
+                last_row = self._state(table)[0]
+                anchor = self.conn.execute(f"SELECT {_q(cols[0])} FROM {_q(table)} WHERE _row=?", (last_row,)).fetchone()
+                if anchor: self._set_state(table, last_row, anchor[0])
+
+    def apply_delete(self, table, key_col, key):
+        if key_col not in self.columns(table): return
+        with self._lock:
+            hit = self.conn.execute(f"SELECT MIN(_row) FROM {_q(table)} WHERE {_q(key_col)}=?", (str(key),)).fetchone()
+            if not hit or hit[0] is None: return
+            deleted = hit[0]; c = self.conn
+            c.execute("BEGIN")
+            try:
+                c.execute(f"DELETE FROM {_q(table)} WHERE _row=?", (deleted,))
+                c.execute(f"UPDATE {_q(table)} SET _row=_row-1 WHERE _row>?", (deleted,)) # Sheet rows shift up after delete_rows
+                last_row = self._state(table)[0] - 1
+                anchor = c.execute(f"SELECT {_q(self.columns(table)[0])} FROM {_q(table)} WHERE _row=?", (last_row,)).fetchone()
+                self._set_state(table, last_row, anchor[0] if anchor else self.columns(table)[0])
+                c.execute("COMMIT")
+            except Exception:
+                c.execute("ROLLBACK"); raise
+
+@st.cache_resource
+def get_mirror():
+    if not get_setting("mirror_settings", "enabled", False): return None
+    return SheetMirror(get_setting("mirror_settings", "path", MIRROR_DB_PATH))
+
+def _mirror_write(fn):
+    """Applies a write to the local mirror; a failure only costs freshness until the next full sync"""
     try:
-        ws = get_sheet_client().open_by_url(st.secrets["drive_settings"]["sheet_url"]).worksheet(table)
-        data = ws.get_all_values()
+        m = get_mirror()
+        if m: fn(m)
+    except Exception as e: logging.error(f"Mirror write failed: {e}")
+
+class Revisions:
+    """Change stamps in the REVISIONS_SHEET worksheet, one row per (table, writing host). Every write bumps its host's
+    Revision stamp, and edits and deletes also its Layout stamp. Rows are per host so concurrent writers never
+    overwrite each other's bump. Readers poll the whole sheet at most every REVISION_POLL_SECS; TableCache keeps a
+    frame while its table's stamps are unchanged, fetches just the new rows when only Revisions moved, and
+    re-reads in full when a Layout moved. A bump that fails is carried into the next one (the write-behind
+    flusher retries it), and rows not bumped for REVISION_PRUNE_SECS are deleted."""
+    HEADERS = ["Table", "Writer", "Revision", "Layout"]
+
+    def __init__(self, pool):
+        self.pool = pool; self.writer = socket.gethostname(); self._lock = threading.Lock()
+        self._stamps = None; self._rows = {}; self._ages = [] # table -> {writer: (revision, layout)}; (table, writer) -> sheet row; [(sheet row, revision)]
+        self._next_poll = 0.0; self._next_prune = 0.0; self.unsent = {} # {table: layout} of bumps that failed
+
+    def poll(self, force=False):
+        with self._lock:
+            if not force and time.time() < self._next_poll: return self._stamps
+            self._next_poll = time.time() + REVISION_POLL_SECS
+        try: data = self.pool.with_spreadsheet(lambda sh: sh.values_get(f"'{REVISIONS_SHEET}'!A:D")).get('values', [])
+        except Exception as e:
+            logging.warning(f"Revision poll failed, caching by TTL for now: {e}")
+            with self._lock: self._stamps = None; self._next_poll = time.time() + DB_CACHE_TTL
+            return None
+        stamps, rows, ages = {}, {}, []
+        for row, r in enumerate(data[1:], start=2):
+            table, writer, revision, layout = (list(r) + [""] * 4)[:4]
+            ages.append((row, revision))
+            old = stamps.get(table, {}).get(writer)
+            if old is None or _stamp_ns(revision) > _stamp_ns(old[0]): # A writer row can be doubled by a retried append or a pruning race; the newest counts
+                rows[(table, writer)] = row; stamps.setdefault(table, {})[writer] = (revision, layout)
+        with self._lock: self._stamps = stamps; self._rows = rows; self._ages = ages
+        return stamps
+
+    def stamps(self, table):
+        """{writer: (revision, layout)} for `table`, or None when stamps are unavailable"""
+        stamps = self.poll()
+        return None if stamps is None else stamps.get(table, {})
+
+    def bump(self, changes):
+        """Records writes, {table: layout} with layout=True for edits and deletes, in one batch_update (plus one
+        append for tables this host never wrote). Each update rewrites the whole row, so one that lands on a row
+        shifted by a prune still carries this host's stamp. On failure the changes wait in `unsent` for the next bump."""
+        with self._lock:
+            retry = bool(self.unsent); changes = dict(changes)
+            for table, layout in self.unsent.items(): changes[table] = changes.get(table, False) or layout
+            self.unsent = {}
+        try:
+            if (self._stamps is None or retry) and self.poll(force=True) is None: raise RuntimeError("stamps unavailable") # Row positions unknown
+            stamp = f"{time.time_ns():x}"; updates, appends = {}, {}
+            with self._lock:
+                for table, layout in changes.items():
+                    row = self._rows.get((table, self.writer)); old = self._stamps.get(table, {}).get(self.writer)
+                    new = (stamp, stamp if layout or old is None else old[1])
+                    if row: updates[table] = (row, new)
+                    else: appends[table] = new
+            if updates: self.pool.with_worksheet(REVISIONS_SHEET, lambda ws: ws.batch_update([{'range': f"A{row}:D{row}", 'values': [[table, self.writer, *new]]} for table, (row, new) in updates.items()]), write=True, idempotent=True)
+            if appends:
+                res = self.pool.with_worksheet(REVISIONS_SHEET, lambda ws: ws.append_rows([[table, self.writer, *new] for table, new in appends.items()]), write=True)
+                start = _row_from_range((res or {}).get('updates', {}).get('updatedRange'))
+                updates.update({table: (start + i if start else None, new) for i, (table, new) in enumerate(appends.items())})
+            with self._lock:
+                stamps = dict(self._stamps)
+                for table, (row, new) in updates.items():
+                    if row: self._rows[(table, self.writer)] = row
+                    stamps[table] = {**stamps.get(table, {}), self.writer: new}
+                self._stamps = stamps
+        except Exception as e:
+            logging.error(f"Revision bump failed for {', '.join(changes)}, will retry: {e}")
+            with self._lock:
+                for table, layout in changes.items(): self.unsent[table] = self.unsent.get(table, False) or layout
+            return
+        if time.time() >= self._next_prune: self._prune()
+
+    def _prune(self):
+        """Deletes the rows of writers that have not bumped for REVISION_PRUNE_SECS, bottom-up so each range is
+        still where the poll saw it, then re-polls for the new row positions"""
+        self._next_prune = time.time() + REVISION_MAX_AGE
+        cutoff = time.time_ns() - REVISION_PRUNE_SECS * 10 ** 9
+        with self._lock: stale = sorted((row for row, revision in self._ages if _stamp_ns(revision) < cutoff), reverse=True)
+        if not stale: return
+        ranges = []
+        for row in stale:
+            if ranges and ranges[-1][0] == row + 1: ranges[-1][0] = row
+            else: ranges.append([row, row])
+        try:
+            for first, last in ranges: self.pool.with_worksheet(REVISIONS_SHEET, lambda ws: ws.delete_rows(first, last), write=True)
+            logging.info(f"Pruned {len(stale)} stale writer rows from {REVISIONS_SHEET}")
+        except Exception as e: logging.error(f"Revision prune failed: {e}")
+        self.poll(force=True)
+
+def _stamp_ns(revision):
+    """A Revision stamp (hex nanoseconds) as an int; 0 for a blank or hand-edited one, so it counts as oldest"""
+    try: return int(revision, 16)
+    except (TypeError, ValueError): return 0
+
+@st.cache_resource
+def get_revisions():
+    return Revisions(get_pool())
+
+class TableCache:
+    """Process-wide DataFrame cache keyed per table. Writes patch the cached frame of the table they touched
+    (append / update cells / drop row) so the next read is free and other tables stay warm. Derived views
+    (e.g. NotesView) are built once per fill and patched alongside the frame. Frames stay valid until their
+    table's Revisions stamps move, so writes from other sessions and hosts show up within REVISION_POLL_SECS."""
+    def __init__(self):
+        self._lock = threading.RLock(); self._frames = {} # table -> {'df': DataFrame, 'at': loaded_at, 'stamps': revisions, 'views': {factory name: view}}
+
+    def _entry(self, table, loader):
+        with self._lock: hit = self._frames.get(table)
+        stamps = get_revisions().stamps(table)
+        if hit:
+            seen = hit['stamps']; age = time.time() - hit['at']
+            if stamps is None or seen is None:
+                if age < DB_CACHE_TTL: return hit
+            elif age < REVISION_MAX_AGE:
+                if stamps == seen: return hit
+                appends_only = stamps.keys() == seen.keys() and all(stamps[w][1] == seen[w][1] for w in stamps)
+                if appends_only and self._extend(table, hit, stamps): return hit
+        df = loader(table, moved=True) if hit and stamps is not None and stamps != hit['stamps'] else loader(table)
+        if df is None: return None # Failed loads are not cached
+        entry = {'df': df, 'at': time.time(), 'stamps': stamps, 'views': {}}
+        with self._lock: self._frames[table] = entry
+        return entry
+
+    def _extend(self, table, hit, stamps):
+        """Appends the rows other writers added since `hit` was read; False when that cannot be done as a delta"""
+        n = len(hit['df']); rows = _load_appended(table, hit['df'])
+        if rows is None: return False
+        with self._lock:
+            if self._frames.get(table) is not hit: return False
+            if hit['stamps'] == stamps: return True # Another session extended it meanwhile
+            if len(hit['df']) != n: return False # A local write landed meanwhile
+            if rows:
+                width = len(hit['df'].columns); rows = [[str(v) for v in r][:width] + [""] * (width - len(r)) for r in rows]
+                self._patch(table, lambda df: pd.concat([df, pd.DataFrame(rows, columns=df.columns)], ignore_index=True),
+                            (lambda view: [view.append(r) for r in rows]) if len(rows) <= 20 else None) # Many rows: rebuild views instead
+            if self._frames.get(table) is not hit: return False
+            hit['stamps'] = stamps
+        return True
+
+    def get(self, table, loader):
+        entry = self._entry(table, loader)
+        return entry['df'].copy() if entry else pd.DataFrame()
+
+    def view(self, table, loader, factory):
+        """Returns factory(frame), built once per cache fill; views must not be mutated by callers"""
+        entry = self._entry(table, loader)
+        if entry is None: return factory(pd.DataFrame(columns=table_headers(table)))
+        with self._lock:
+            name = factory.__name__ # Classes are redefined on every Streamlit rerun, so key by name
+            view = entry['views'].get(name)
+            if view is None: view = entry['views'][name] = factory(entry['df'])
+            return view
+
+    def seed(self, table, df):
+        """Caches `df` as the frame of a table nothing has read yet (a worksheet just created), so writes queued
+        before its first flush patch it and show up at once instead of after the next read"""
+        stamps = get_revisions().stamps(table)
+        with self._lock:
+            if table not in self._frames: self._frames[table] = {'df': df, 'at': time.time(), 'stamps': stamps, 'views': {}}
+
+    def invalidate(self, table=None):
+        with self._lock:
+            if table is None: self._frames.clear()
+            else: self._frames.pop(table, None)
+
+    def _patch(self, table, fn, view_fn=None):
+        with self._lock:
+            entry = self._frames.get(table)
+            if not entry: return
+            try:
+                entry['df'] = fn(entry['df'])
+                for name, view in list(entry['views'].items()):
+                    if view_fn: view_fn(view)
+                    else: del entry['views'][name] # Rebuilt lazily from the patched frame
+            except Exception as e: # A frame we cannot patch is dropped and re-read on demand
+                logging.error(f"Cache patch failed for {table}: {e}"); self._frames.pop(table, None)
+
+    def append(self, table, row_data):
+        def _append(df):
+            row = [str(v) for v in row_data][:len(df.columns)]
+            row += [""] * (len(df.columns) - len(row))
+            return pd.concat([df, pd.DataFrame([row], columns=df.columns)], ignore_index=True)
+        self._patch(table, _append, lambda view: view.append(row_data))
+
+    def update(self, table, key_col, key, changes):
+        def _update(df):
+            hit = df.index[df[key_col].astype(str) == str(key)]
+            if len(hit) == 0: raise KeyError(key)
+            df = df.copy()
+            for col, val in changes.items():
+                if col in df.columns: df.loc[hit[0], col] = str(val)
+            return df
+        self._patch(table, _update)
+
+    def drop(self, table, key_col, key):
+        def _drop(df):
+            hit = df.index[df[key_col].astype(str) == str(key)]
+            if len(hit) == 0: raise KeyError(key)
+            return df.drop(index=hit[0]).reset_index(drop=True)
+        self._patch(table, _drop, lambda view: view.drop(key_col, key))
+
+@st.cache_resource
+def get_table_cache():
+    return TableCache()
+
+def _load_table(table, moved=False):
+    """`moved`: the table's change stamps moved, so a mirror re-syncs in full now rather than on its own schedule"""
+    trace_note(cache="miss")
+    try:
+        m = get_mirror()
+        if m:
+            if moved: m.full_sync(table)
+            else: m.sync(table)
+            return m.read(table)
+        data = get_pool().with_worksheet(table, lambda ws: ws.get_all_values(), key=("get_all_values", table))
         if len(data) < 2: return pd.DataFrame(columns=data[0] if data else None)
         return pd.DataFrame(data[1:], columns=data[0])
     except Exception as e: 
-        logging.error(f"DB Get Failed: {e}")
-        return pd.DataFrame()
+        logging.error(f"DB Get Failed: {e}"); trace_note(error=type(e).__name__)
+        return None
+
+def _load_appended(table, df):
+    """Rows appended after the ones `df` holds, read from its last row on; None when the sheet no longer continues
+    `df` there (rows were edited, deleted or moved), so the caller re-reads in full"""
+    trace_note(cache="delta")
+    last = len(df) + 1; anchor = str(df.iloc[-1, 0]) if len(df) else (str(df.columns[0]) if len(df.columns) else "")
+    try:
+        m = get_mirror()
+        if m: m.incremental_sync(table); values = m.rows_from(table, last)
+        else:
+            end_col = re.sub(r'\d', '', gspread.utils.rowcol_to_a1(1, max(len(df.columns), 1)))
+            values = get_pool().with_worksheet(table, lambda ws: ws.get_values(f"A{last}:{end_col}"), key=("get_values", table, last))
+        if not values or str(values[0][0] if values[0] else "") != anchor: return None
+        return values[1:]
+    except Exception as e:
+        logging.error(f"Delta load failed for {table}: {e}"); return None
+
+class WriteBehindQueue:
+    """Buffers Sheet writes per worksheet: pending appends go out as one append_rows call and cell edits as one
+    batch_update. Flushes every WRITE_FLUSH_SECS, as soon as a worksheet reaches WRITE_FLUSH_SIZE pending writes,
+    and at process exit. Each queued write returns a Future (appends resolve to their sheet row) for callers
+    that need read-your-writes."""
+    def __init__(self, pool):
+        self.pool = pool; self._cv = threading.Condition(); self._flush_lock = threading.Lock()
+        self._pending = {}; self._closed = False # table -> {'appends': [(row, fut)], 'edits': [((a1, value), fut)], 'attempts': n}
+        self._thread = threading.Thread(target=self._run, name="sheet-writer", daemon=True); self._thread.start()
+        atexit.register(self.close)
+
+    def _enqueue(self, table, kind, item):
+        fut = Future()
+        with self._cv:
+            p = self._pending.setdefault(table, {'appends': [], 'edits': [], 'attempts': 0})
+            p[kind].append((item, fut))
+            if len(p['appends']) + len(p['edits']) >= WRITE_FLUSH_SIZE: self._cv.notify()
+        return fut
+
+    def append(self, table, row_data):
+        return self._enqueue(table, 'appends', list(row_data))
+
+    def edit(self, table, row, col, value):
+        return self._enqueue(table, 'edits', (gspread.utils.rowcol_to_a1(row, col), value))
+
+    def _run(self):
+        while True:
+            with self._cv:
+                self._cv.wait(timeout=WRITE_FLUSH_SECS)
+                if self._closed: return
+            try: self.flush()
+            except Exception as e: logging.error(f"Write-behind flush failed: {e}")
+
+    def flush(self, table=None):
+        with self._flush_lock:
+            with self._cv:
+                names = [table] if table else list(self._pending)
+                batches = {t: self._pending.pop(t) for t in names if t in self._pending}
+            changes = {t: self._write(t, batch) for t, batch in batches.items()}
+            changes = {t: layout for t, layout in changes.items() if layout is not None}
+            if changes or get_revisions().unsent: get_revisions().bump(changes) # One stamp write per flush, plus any that failed
+
+    def _write(self, table, batch):
+        """Returns None when nothing was written, else whether rows were edited (not just appended)"""
+        edits, appends = batch['edits'], batch['appends']; changed = None
+        if edits:
+            try:
+                self.pool.with_worksheet(table, lambda ws: ws.batch_update([{'range': a1, 'values': [[v]]} for (a1, v), _ in edits], raw=False), write=True, idempotent=True)
+                changed = True
+                for _, fut in edits: fut.set_result(True)
+            except Exception as e: self._retry_or_fail(table, 'edits', edits, batch['attempts'], e)
+        if appends:
+            try:
+                unsure = batch.get('unsure', 0) # Leading rows whose last append failed in a way that may have applied it
+                start = self._landed(table, [row for row, _ in appends[:unsure]]) if unsure else None
+                if start:
+                    for i, (_, fut) in enumerate(appends[:unsure]): fut.set_result(start + i)
+                    appends = appends[unsure:]; changed = bool(changed)
+                if appends:
+                    res = self.pool.with_worksheet(table, lambda ws: ws.append_rows([row for row, _ in appends]), write=True)
+                    changed = bool(changed)
+                    start = _row_from_range((res or {}).get('updates', {}).get('updatedRange'))
+                    for i, (_, fut) in enumerate(appends): fut.set_result(start + i if start else None)
+            except Exception as e: self._retry_or_fail(table, 'appends', appends, batch['attempts'], e)
+        return changed
+
+    def _landed(self, table, rows):
+        """Sheet row of the first of `rows` if they are already in the sheet (matched on their first column), else None"""
+        keys = [str(row[0]) if row else "" for row in rows]; col = self.pool.with_worksheet(table, lambda ws: ws.col_values(1))
+        for i in range(len(col) - len(keys), 0, -1): # Newest first; row 1 is the header
+            if col[i:i + len(keys)] == keys: return i + 1
+        return None
+
+    def _retry_or_fail(self, table, kind, items, attempts, error):
+        if attempts + 1 < WRITE_MAX_ATTEMPTS:
+            logging.warning(f"Write-behind {kind} for {table} failed, will retry: {error}")
+            with self._cv:
+                p = self._pending.setdefault(table, {'appends': [], 'edits': [], 'attempts': 0})
+                p[kind] = items + p[kind]; p['attempts'] = attempts + 1
+                if kind == 'appends': p['unsure'] = 0 if _is_retryable(error, idempotent=False) else len(items) # Throttled means not applied
+            return
+        logging.error(f"Write-behind {kind} for {table} dropped after {WRITE_MAX_ATTEMPTS} attempts: {error}")
+        for _, fut in items: fut.set_exception(error)
+
+    def close(self):
+        """Stops the flusher and writes out everything still pending"""
+        with self._cv:
+            if self._closed: return
+            self._closed = True; self._cv.notify()
+        self._thread.join(timeout=WRITE_FLUSH_SECS * 2)
+        for _ in range(WRITE_MAX_ATTEMPTS):
+            self.flush()
+            with self._cv:
+                if not self._pending: return
+
+@st.cache_resource
+def get_writer():
+    return WriteBehindQueue(get_pool())
+
+class RowIndex:
+    """Key -> sheet row maps per (table, column), built from one column read. A lookup is confirmed with a
+    single-cell read and the map is rebuilt when that shows it is stale; deletes shift the rows below in memory."""
+    def __init__(self, pool):
+        self.pool = pool; self._lock = threading.RLock(); self._maps = {}; self._col_nums = {}
+
+    def _col_number(self, table, col):
+        if (table, col) not in self._col_nums:
+            headers = table_headers(table) if col in (table_headers(table) or []) else self.pool.with_worksheet(table, lambda ws: ws.row_values(1), key=("row_values", table, 1))
+            self._col_nums[(table, col)] = headers.index(col) + 1
+        return self._col_nums[(table, col)]
+
+    def _build(self, table, col):
+        c = self._col_number(table, col)
+        values = self.pool.with_worksheet(table, lambda ws: ws.col_values(c), key=("col_values", table, c))
+        keys = {}
+        for row, v in enumerate(values[1:], start=2): keys.setdefault(str(v), row)
+        with self._lock: self._maps[(table, col)] = keys
+        return keys
+
+    def locate(self, table, col, key):
+        key = str(key); c = self._col_number(table, col)
+        with self._lock: keys = self._maps.get((table, col))
+        row = keys.get(key) if keys is not None else None
+        if row is not None:
+            if str(self.pool.with_worksheet(table, lambda ws: ws.cell(row, c).value)) == key: return row
+            logging.info(f"Row index for {table}.{col} is stale, rebuilding")
+        row = self._build(table, col).get(key)
+        if row is None: raise KeyError(f"{col}={key} not found in {table}")
+        return row
+
+    def note_row(self, table, row_data, sheet_row):
+        if not sheet_row: return
+        with self._lock:
+            for (t, col), keys in self._maps.items():
+                if t == table and col in (table_headers(table) or []):
+                    pos = table_headers(table).index(col)
+                    if pos < len(row_data): keys.setdefault(str(row_data[pos]), sheet_row)
+
+    def rename(self, table, col, old, new):
+        with self._lock:
+            keys = self._maps.get((table, col))
+            if keys is not None and str(old) in keys: keys[str(new)] = keys.pop(str(old))
+
+    def forget_row(self, table, sheet_row):
+        """Mirrors ws.delete_rows: drops the row and moves every later row up by one"""
+        with self._lock:
+            for (t, col), keys in self._maps.items():
+                if t != table: continue
+                self._maps[(t, col)] = {k: (r - 1 if r > sheet_row else r) for k, r in keys.items() if r != sheet_row}
+
+@st.cache_resource
+def get_row_index():
+    return RowIndex(get_pool())
+
+def _base_table(name):
+    """'DebitNotes_2025_04' (a partition) -> 'DebitNotes'; other names are returned as they are"""
+    return re.sub(r'_\d{4}(?:_\d{2})?$', '', name)
+
+def table_headers(name):
+    return TABLES.get(name) or TABLES.get(_base_table(name))
+
+def _day(value):
+    """'YYYY-MM-DD' for a date-like value (so periods compare as strings), None for a missing one"""
+    d = pd.to_datetime(value, errors='coerce')
+    return None if pd.isna(d) else d.strftime('%Y-%m-%d')
+
+def _overlaps(lo, hi, start, end):
+    """Whether period [lo, hi] ('' = open) overlaps [start, end] (None = open); all 'YYYY-MM-DD'"""
+    return (end is None or not lo or lo <= end) and (start is None or not hi or hi >= start)
+
+class Partitions:
+    """Optional time-partitioned layout: each PARTITIONED_TABLES table is split into one worksheet per month or year
+    ('DebitNotes_2025_04' / 'DebitNotes_2025'), or with [db_settings] partition_spreadsheets into one spreadsheet
+    each, which also keeps every file under Sheets' per-spreadsheet cell limit. The PARTITION_MANIFEST worksheet
+    lists every partition with its period, home spreadsheet and row count, so date-range reads load only the
+    partitions they overlap. Inserts go to the partition of the row's date, created on first use. A table's old
+    single worksheet stays readable as an archive partition spanning the dates it holds."""
+    HEADERS = ["Partition", "Table", "Start", "End", "Spreadsheet", "Rows"]
+
+    def __init__(self, by, spreadsheets):
+        self.by = by; self.spreadsheets = spreadsheets; self._lock = threading.Lock()
+
+    def name_for(self, table, date):
+        d = pd.to_datetime(date, errors='coerce')
+        if pd.isna(d): d = pd.Timestamp.now() # Undated rows go to the current period
+        return f"{table}_{d.year}" if self.by == "year" else f"{table}_{d.year}_{d.month:02d}"
+
+    def _period(self, name):
+        period = pd.Period(re.search(r'_(\d{4}(?:_\d{2})?)$', name).group(1).replace("_", "-"), "Y" if self.by == "year" else "M")
+        return period.start_time.strftime('%Y-%m-%d'), period.end_time.strftime('%Y-%m-%d')
+
+    def manifest(self):
+        df = db_get(PARTITION_MANIFEST)
+        for c in self.HEADERS:
+            if c not in df.columns: df[c] = ""
+        pool = get_pool()
+        for name, key in zip(df['Partition'], df['Spreadsheet']):
+            if key: pool.place(name, key)
+        return df
+
+    def names(self, table, start=None, end=None):
+        """Partitions of `table` whose period overlaps [start, end] (either may be None), oldest first"""
+        return [name for name, _, _ in self.periods(table, start, end)]
+
+    def periods(self, table, start=None, end=None, df=None):
+        start, end = _day(start), _day(end); df = self.manifest() if df is None else df
+        rows = df[df['Table'] == table].sort_values(['End', 'Start'])
+        return [(name, lo, hi) for name, lo, hi in zip(rows['Partition'], rows['Start'], rows['End']) if _overlaps(lo, hi, start, end)]
+
+    def ensure(self, name):
+        """Creates partition `name` (worksheet or spreadsheet, header row, manifest row) unless it exists; returns name"""
+        if name in set(self.manifest()['Partition']): return name
+        with self._lock:
+            get_table_cache().invalidate(PARTITION_MANIFEST) # Another process may just have created it
+            if name in set(self.manifest()['Partition']): return name
+            table = _base_table(name); headers = TABLES[table]; pool = get_pool(); key = ""
+            if self.spreadsheets:
+                sh = pool.scheduler.call('sheets_write', lambda: pool.client().create(f"{render.COMPANY_NAME} {name}", folder_id=st.secrets["drive_settings"]["folder_id"]), idempotent=False)
+                key = sh.id; pool.place(name, key)
+                pool.scheduler.call('sheets_write', lambda: sh.sheet1.update_title(name))
+            else:
+                try: pool.with_spreadsheet(lambda sh: sh.add_worksheet(name, 1000, len(headers)), write=True)
+                except gspread.exceptions.APIError as e:
+                    if 'already exists' not in str(e): raise # Left by an attempt that failed before its manifest row
+            pool.forget_worksheet(name)
+            pool.with_worksheet(name, lambda ws: None if ws.row_values(1) else ws.append_row(headers), write=True, idempotent=True) # Checks before it appends
+            start, end = self._period(name); row = [name, table, start, end, key, 0]
+            pool.with_worksheet(PARTITION_MANIFEST, lambda ws: ws.append_row(row), write=True); get_revisions().bump({PARTITION_MANIFEST: False})
+            get_table_cache().append(PARTITION_MANIFEST, row); get_table_cache().seed(name, pd.DataFrame(columns=headers))
+            logging.info(f"Created partition {name}")
+        return name
+
+    def views(self, table, start=None, end=None):
+        """[(partition, start, end, NotesView)] for the partitions overlapping [start, end], oldest first; cold ones
+        load concurrently. Each view's row count is written back to the manifest when it changed."""
+        df = self.manifest(); periods = self.periods(table, start, end, df)
+        views = list(get_partition_pool().map(in_context(lambda p: get_table_cache().view(p[0], _load_table, NotesView)), periods))
+        counts = {name: view.count for (name, _, _), view in zip(periods, views)}
+        for name, rows in zip(df['Partition'], df['Rows']):
+            if name in counts and str(counts[name]) != str(rows):
+                try: row = get_row_index().locate(PARTITION_MANIFEST, "Partition", name) # By name: other hosts append manifest rows too
+                except Exception as e: logging.error(f"Manifest row count for {name} not updated: {e}"); continue
+                get_writer().edit(PARTITION_MANIFEST, row, self.HEADERS.index("Rows") + 1, counts[name])
+                get_table_cache().update(PARTITION_MANIFEST, "Partition", name, {"Rows": counts[name]})
+        return [(name, lo, hi, view) for (name, lo, hi), view in zip(periods, views)]
+
+@st.cache_resource
+def get_partition_pool():
+    return ThreadPoolExecutor(max_workers=PARTITION_LOAD_WORKERS, thread_name_prefix="partition-load")
+
+@st.cache_resource
+def get_partitions():
+    by = get_setting("db_settings", "partition_by")
+    if by not in ("month", "year"): return None
+    return Partitions(by, bool(get_setting("db_settings", "partition_spreadsheets", False)))
+
+@st.cache_resource
+def ensure_partitions(version):
+    """Once per process: creates the manifest, registers each table's old single worksheet as an archive partition,
+    and creates the current period's partition"""
+    parts = get_partitions()
+    if parts is None: return version
+    pool = get_pool()
+    existing = {ws.title for ws in pool.with_spreadsheet(lambda sh: sh.worksheets())}
+    if PARTITION_MANIFEST not in existing:
+        pool.with_spreadsheet(lambda sh: sh.add_worksheet(PARTITION_MANIFEST, 100, len(Partitions.HEADERS)), write=True)
+        pool.with_worksheet(PARTITION_MANIFEST, lambda ws: ws.append_row(Partitions.HEADERS), write=True)
+        get_table_cache().invalidate(PARTITION_MANIFEST)
+    known = set(parts.manifest()['Partition'])
+    for table, date_col in PARTITIONED_TABLES.items():
+        if table in existing and table not in known:
+            df = _load_table(table)
+            if df is not None and len(df):
+                dates = pd.to_datetime(df[date_col], errors='coerce', format='ISO8601').dropna()
+                row = [table, table, _day(dates.min()) if len(dates) else "", _day(dates.max()) if len(dates) else "", "", len(df)]
+                pool.with_worksheet(PARTITION_MANIFEST, lambda ws: ws.append_row(row), write=True); get_revisions().bump({PARTITION_MANIFEST: False})
+                get_table_cache().append(PARTITION_MANIFEST, row)
+        parts.ensure(parts.name_for(table, None))
+    return version
+
+# CACHED TO MAKE DASHBOARD LIGHTNING FAST
+@traced("db_get")
+def db_get(table):
+    trace_note(cache="hit") # _load_table turns it into a miss
+    parts = get_partitions() if table in PARTITIONED_TABLES else None
+    if parts: df = pd.concat([get_table_cache().get(t, _load_table) for t in parts.names(table)] or [pd.DataFrame(columns=TABLES[table])], ignore_index=True)
+    else: df = get_table_cache().get(table, _load_table)
+    trace_note(rows=len(df))
+    return df
+
+class RecordsIndex:
+    """Date-ordered position index over a NotesView frame: all rows, plus one posting list per Contractor Name,
+    Category and SubmittedBy value, each sorted by date with its date keys alongside. A query binary-searches
+    the date range inside the smallest matching list, so its cost follows the result, not the table."""
+    FILTERS = ("Contractor Name", "Category", "SubmittedBy")
+
+    def __init__(self, frame):
+        keys = frame['Date'].astype('datetime64[ns]').to_numpy().view('i8') # NaT sorts as oldest
+        order = np.argsort(keys, kind='stable')
+        self.all = (order, keys[order])
+        self.values = {col: frame[col].astype(str).to_numpy() for col in self.FILTERS}
+        self.postings = {}
+        for col in self.FILTERS:
+            groups = pd.Series(np.arange(len(order))).groupby(self.values[col][order]).indices
+            self.postings[col] = {k: (order[idx], keys[order][idx]) for k, idx in groups.items()}
+
+    def query(self, equals=None, start=None, end=None):
+        """Frame positions matching every `equals` column and the inclusive date range, oldest first"""
+        equals = {k: str(v) for k, v in (equals or {}).items() if v is not None}
+        lists = {col: self.postings[col].get(v, (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))) for col, v in equals.items()}
+        base_col = min(lists, key=lambda c: len(lists[c][0])) if lists else None
+        positions, keys = lists[base_col] if base_col else self.all
+        lo = np.searchsorted(keys, pd.Timestamp(start).value, 'left') if start is not None else 0
+        hi = np.searchsorted(keys, pd.Timestamp(end).value, 'right') if end is not None else len(keys)
+        positions = positions[lo:hi]
+        for col, v in equals.items():
+            if col != base_col and len(positions): positions = positions[self.values[col][positions] == v]
+        return positions
+
+class NotesState:
+    """One published version of a NotesView: the typed frame, its totals, per-category and per-contractor sums and
+    latest date, and its RecordsIndex (built on first query). Never modified once published, so a reader always
+    sees totals that match the frame it queries."""
+    def __init__(self, frame, total, latest, sums):
+        self.frame = frame; self.total = total; self.count = len(frame); self.latest = latest; self.sums_by = sums; self._index = None
+
+    def index(self):
+        """RecordsIndex for this frame, built on first use (two threads may both build it; either result is right)"""
+        if self._index is None: self._index = RecordsIndex(self.frame)
+        return self._index
+
+    def sums(self, col):
+        return pd.Series({k: v[0] for k, v in self.sums_by[col].items()}, dtype=float).rename_axis(col).rename('Amount')
+
+    def values(self, col):
+        """Distinct values of a RecordsIndex.FILTERS column"""
+        return set(self.index().postings[col])
+
+    def select(self, contractor=None, start=None, end=None, newest_first=False):
+        positions = self.index().query({"Contractor Name": contractor}, start, end)
+        return self.frame.iloc[positions[::-1] if newest_first else positions]
+
+    def page(self, filters=None, start=None, end=None, offset=0, limit=5):
+        """Newest-first page of matching rows and the total match count; only the page rows are materialized"""
+        positions = self.index().query(filters, start, end)[::-1]
+        return self.frame.iloc[positions[offset:offset + limit]], len(positions)
+
+class NotesView:
+    """Typed DebitNotes frame (Amount float, Date datetime64, Category / Contractor Name categorical) built once per
+    cache fill, with totals, per-category and per-contractor sums and the latest date materialized and kept
+    current on insert and delete instead of being recomputed on every rerun. Writes (from the flusher and job
+    threads) build a new NotesState and publish it by swapping one reference, so sessions reading the old one
+    are never shown a half-applied write."""
+    CATEGORICAL = ("Category", "Contractor Name")
+
+    def __init__(self, raw):
+        frame = self._typed(raw); amounts = frame['Amount'].fillna(0.0); self._lock = threading.Lock()
+        sums = {col: {k: (float(v), int(n)) for k, (v, n) in amounts.groupby(frame[col], observed=True).agg(['sum', 'count']).iterrows()}
+                for col in self.CATEGORICAL}
+        self.state = NotesState(frame, float(amounts.sum()), frame['Date'].max(), sums)
 
+    @property
+    def frame(self): return self.state.frame
+    @property
+    def total(self): return self.state.total
+    @property
+    def count(self): return self.state.count
+    @property
+    def latest(self): return self.state.latest
+
+    @classmethod
+    def _typed(cls, raw):
+        df = raw.copy()
+        for col in TABLES["DebitNotes"]:
+            if col not in df.columns: df[col] = ""
+        df['Amount'] = pd.to_numeric(df['Amount'], errors='coerce')
+        df['Date'] = pd.to_datetime(df['Date'], errors='coerce', format='ISO8601')
+        for col in cls.CATEGORICAL: df[col] = df[col].astype(str).astype('category')
+        return df
+
+    def _added(self, state, row, sign):
+        """Total and sums of `state` with `row` added (sign 1) or removed (-1), as new objects"""
+        amount = 0.0 if pd.isna(row['Amount']) else float(row['Amount'])
+        sums = {col: dict(state.sums_by[col]) for col in self.CATEGORICAL}
+        for col in self.CATEGORICAL:
+            total, n = sums[col].get(row[col], (0.0, 0)); bucket = (total + sign * amount, n + sign)
+            if bucket[1] > 0: sums[col][row[col]] = bucket
+            else: sums[col].pop(row[col], None)
+        return state.total + sign * amount, sums
+
+    def append(self, row_data):
+        headers = TABLES["DebitNotes"]
+        raw = pd.DataFrame([[str(v) for v in row_data][:len(headers)] + [""] * (len(headers) - len(row_data))], columns=headers)
+        new = self._typed(raw)
+        with self._lock:
+            state = self.state; frame = state.frame; widened = {}
+            for col in self.CATEGORICAL:
+                missing = set(new[col].astype(str)) - set(frame[col].cat.categories)
+                if missing: widened[col] = frame[col].cat.add_categories(sorted(missing))
+                new[col] = new[col].astype(str).astype(widened.get(col, frame[col]).dtype)
+            if widened: frame = frame.assign(**widened) # A new frame: the published one is never changed
+            frame = pd.concat([frame, new[frame.columns]], ignore_index=True)
+            row = new.iloc[0]; total, sums = self._added(state, row, 1)
+            latest = row['Date'] if not pd.isna(row['Date']) and (pd.isna(state.latest) or row['Date'] > state.latest) else state.latest
+            self.state = NotesState(frame, total, latest, sums)
+
+    def drop(self, key_col, key):
+        with self._lock:
+            state = self.state; hit = state.frame.index[state.frame[key_col].astype(str) == str(key)]
+            if len(hit) == 0: raise KeyError(key)
+            row = state.frame.loc[hit[0]]; frame = state.frame.drop(index=hit[0]).reset_index(drop=True)
+            total, sums = self._added(state, row, -1)
+            latest = frame['Date'].max() if not pd.isna(row['Date']) and row['Date'] == state.latest else state.latest # Only rescan when the max left
+            self.state = NotesState(frame, total, latest, sums)
+
+    def sums(self, col): return self.state.sums(col)
+    def values(self, col): return self.state.values(col)
+    def index(self): return self.state.index()
+
+    def select(self, contractor=None, start=None, end=None, newest_first=False):
+        return self.state.select(contractor, start, end, newest_first)
+
+    def page(self, filters=None, start=None, end=None, offset=0, limit=5):
+        return self.state.page(filters, start, end, offset, limit)
+
+class PartitionedNotes:
+    """The NotesView interface over a partitioned DebitNotes: totals and sums combine each partition's materialized
+    ones, and queries only visit the partitions whose period overlaps their date range. It holds each partition's
+    current NotesState, so one PartitionedNotes answers every query from the same versions."""
+    def __init__(self, parts):
+        self.parts = [(name, lo, hi, view.state) for name, lo, hi, view in parts] # [(partition, start, end, NotesState)], oldest first
+        views = [v for *_, v in self.parts]; dates = [v.latest for v in views if not pd.isna(v.latest)]
+        self.total = sum(v.total for v in views); self.count = sum(v.count for v in views); self.latest = max(dates) if dates else pd.NaT
+
+    def _within(self, start, end):
+        start, end = _day(start), _day(end)
+        return [v for _, lo, hi, v in self.parts if _overlaps(lo, hi, start, end)]
+
+    def sums(self, col):
+        totals = {}
+        for *_, v in self.parts:
+            for k, (amount, _) in v.sums_by[col].items(): totals[k] = totals.get(k, 0.0) + amount
+        return pd.Series(totals, dtype=float).rename_axis(col).rename('Amount')
+
+    def values(self, col):
+        return set().union(*(v.values(col) for *_, v in self.parts))
+
+    def select(self, contractor=None, start=None, end=None, newest_first=False):
+        frames = [v.select(contractor, start, end) for v in self._within(start, end)]
+        if not frames: return NotesView(pd.DataFrame()).frame
+        df = pd.concat(frames, ignore_index=True).sort_values('Date', kind='stable', na_position='first') # An archive partition may overlap the others
+        return df.iloc[::-1] if newest_first else df
+
+    def page(self, filters=None, start=None, end=None, offset=0, limit=5):
+        """Newest-first page across partitions, merged on the date keys; only the page rows are materialized"""
+        hits = [(v, v.index().query(filters, start, end)) for v in self._within(start, end)]
+        if not hits: return NotesView(pd.DataFrame()).frame, 0
+        keys = np.concatenate([v.frame['Date'].to_numpy()[pos].astype('datetime64[ns]').view('i8') for v, pos in hits])
+        owners = np.concatenate([np.full(len(pos), i) for i, (_, pos) in enumerate(hits)]); positions = np.concatenate([pos for _, pos in hits])
+        chosen = np.argsort(keys, kind='stable')[::-1][offset:offset + limit]
+        rows = [hits[owners[i]][0].frame.iloc[[positions[i]]] for i in chosen]
+        return (pd.concat(rows, ignore_index=True) if rows else hits[0][0].frame.iloc[:0]), len(keys)
+
+def get_notes_view(start=None, end=None):
+    """The current NotesState of DebitNotes, or when partitioned a PartitionedNotes over the partitions overlapping
+    [start, end]; either answers every query from the version current when it was taken"""
+    parts = get_partitions()
+    if parts is None: return get_table_cache().view("DebitNotes", _load_table, NotesView).state
+    return PartitionedNotes(parts.views("DebitNotes", start, end))
+
+@traced("db_insert")
 def db_insert(table, row_data):
-    ws = get_sheet_client().open_by_url(st.secrets["drive_settings"]["sheet_url"]).worksheet(table)
-    ws.append_row(row_data)
-    db_get.clear() # Clear cache on new data
+    """Queues the append and patches the cached frame right away; returns a Future of the sheet row"""
+    cache, mirror, index, parts = get_table_cache(), get_mirror(), get_row_index(), get_partitions()
+    if parts and table in PARTITIONED_TABLES: # Into the partition of the row's date
+        table = parts.ensure(parts.name_for(table, row_data[TABLES[table].index(PARTITIONED_TABLES[table])]))
+    fut = get_writer().append(table, row_data)
+    cache.append(table, row_data) # Patch cached frame instead of re-downloading
+    def _done(f):
+        if f.exception(): cache.invalidate(table); return # Drop the optimistic row
+        index.note_row(table, row_data, f.result())
+        if mirror: _mirror_write(lambda m: m.apply_insert(table, row_data, f.result()))
+    fut.add_done_callback(_done)
+    return fut
 
 def db_update_user(old_username, new_username, new_password, new_pic_link):
-    ws = get_sheet_client().open_by_url(st.secrets["drive_settings"]["sheet_url"]).worksheet("Users")
+    writer, index = get_writer(), get_row_index()
     try:
-        cell = ws.find(old_username)
-        if new_password: ws.update_cell(cell.row, 2, hash_password(new_password)) # Hash before save
-        if new_pic_link: ws.update_cell(cell.row, 4, new_pic_link)
-        if new_username and new_username != old_username: ws.update_cell(cell.row, 1, new_username)
-        db_get.clear() # Clear cache
+        writer.flush("Users") # Row positions must reflect earlier queued writes
+        row = index.locate("Users", "Username", old_username); futs = []
+        if new_password: futs.append(writer.edit("Users", row, 2, hash_password(new_password))) # Hash before save
+        if new_pic_link: futs.append(writer.edit("Users", row, 4, new_pic_link))
+        if new_username and new_username != old_username: futs.append(writer.edit("Users", row, 1, new_username))
+        writer.flush("Users")
+        for f in futs: f.result() # One batch_update for all cells; raises if it failed
+        changes = {"Password": hash_password(new_password) if new_password else None, "ProfilePic": new_pic_link,
+                   "Username": new_username if new_username and new_username != old_username else None}
+        changes = {k: v for k, v in changes.items() if v}
+        if "Username" in changes: index.rename("Users", "Username", old_username, new_username)
+        _mirror_write(lambda m: m.apply_update("Users", "Username", old_username, changes))
+        get_table_cache().update("Users", "Username", old_username, changes)
         return True
     except Exception as e: 
         logging.error(f"Update User Failed: {e}")
         return False
 
-def db_delete_row(table, col_name, value):
-    ws = get_sheet_client().open_by_url(st.secrets["drive_settings"]["sheet_url"]).worksheet(table)
+def _delete_keyed_row(table, col_name, value):
+    """Deletes the row whose `col_name` is `value`; KeyError if there is none. After a failure that may have reached
+    the sheet, the key is located again before retrying, so a delete that did land never removes the next row."""
+    index = get_row_index(); row = index.locate(table, col_name, value)
+    for attempt in range(API_MAX_RETRIES + 1):
+        try:
+            get_pool().with_worksheet(table, lambda ws: ws.delete_rows(row), write=True)
+            index.forget_row(table, row); return
+        except Exception as e:
+            if attempt == API_MAX_RETRIES or not _is_retryable(e): raise
+            logging.warning(f"Delete in {table} failed ({e}), checking whether it landed")
+            time.sleep(random.uniform(0, min(API_BACKOFF_CAP, API_BACKOFF_BASE * 2 ** attempt)))
+            try: row = index.locate(table, col_name, value) # Confirmed with a cell read, rebuilt when rows moved
+            except KeyError: return # It did; locate has rebuilt the index from the sheet
+
+def db_delete_row(table, col_name, value, date=None):
+    """For a partitioned table, `date` (the row's) narrows the search to the partitions covering it"""
+    parts = get_partitions()
     try:
-        cell = ws.find(str(value)); ws.delete_rows(cell.row); 
-        db_get.clear() # Clear cache
-        return True
+        for t in (parts.names(table, date, date)[::-1] if parts and table in PARTITIONED_TABLES else [table]):
+            get_writer().flush(t) # Deletes shift rows, so queued writes go first
+            try: _delete_keyed_row(t, col_name, value)
+            except KeyError: continue # In an older partition
+            get_revisions().bump({t: True})
+            _mirror_write(lambda m: m.apply_delete(t, col_name, value))
+            get_table_cache().drop(t, col_name, value)
+            return True
+        raise KeyError(f"{col_name}={value} not found in {table}")
     except Exception as e: 
         logging.error(f"Delete Row Failed: {e}")
         return False
 
-# --- 5. PDF ENGINE ---
-class PDF(FPDF):
-    def header(self):
-        if os.path.exists(LOGO_PATH): self.image(LOGO_PATH, 10, 8, 30)
-        self.set_font('Helvetica', 'B', 20); self.set_text_color(50, 50, 50); self.cell(0, 15, COMPANY_NAME, 0, 1, 'C'); self.ln(10)
-    def footer(self):
-        self.set_y(-15); self.set_font('Helvetica', 'I', 8); self.set_text_color(150); self.cell(0, 10, f'Generated by {st.session_state.get("username", "System")}', 0, 0, 'C')
-
-def create_pdf(type, data):
-    if not os.path.exists("temp"): os.makedirs("temp")
-    pdf = PDF(); pdf.add_page(); pdf.set_auto_page_break(auto=True, margin=15)
-    pdf.set_font("Helvetica", "B", 16); pdf.set_fill_color(240, 240, 240)
-    title = "DEBIT NOTE" if type == "receipt" else "STATEMENT OF ACCOUNT"
-    pdf.cell(0, 12, title, 0, 1, 'C', fill=True); pdf.ln(10)
-    
-    if type == "receipt":
-        pdf.set_font("Helvetica", "", 12)
-        fields = [("Contractor", data['contractor']), ("Date", str(data['date'])), ("Site Location", data['site']), ("Category", data['category']), ("Amount", f"INR {data['amount']}")]
-        for label, value in fields:
-            pdf.set_font("Helvetica", "B", 12); pdf.cell(50, 8, label, "B"); pdf.set_font("Helvetica", "", 12); pdf.cell(140, 8, str(value), "B", 1)
-        pdf.ln(8); pdf.set_font("Helvetica", "B", 12); pdf.cell(0, 10, "Description / Reason:", 0, 1); pdf.set_font("Helvetica", "", 11); pdf.multi_cell(0, 6, data['reason']); pdf.ln(5)
-        
-        if data.get('local_img_paths'):
-            pdf.set_font("Helvetica", "B", 12); pdf.cell(0, 10, "Evidence:", 0, 1)
-            img_paths = [p for p in data['local_img_paths'] if os.path.exists(p)]
-            box_w, box_h = 90, 75
-            for i in range(0, len(img_paths), 2):
-                if 270 - pdf.get_y() < 85: pdf.add_page()
-                y_pos = pdf.get_y()
-                with Image.open(img_paths[i]) as img: aspect = img.height/img.width
-                if aspect > (box_h/box_w): pdf.image(img_paths[i], x=10, y=y_pos, h=box_h)
-                else: pdf.image(img_paths[i], x=10, y=y_pos, w=box_w)
-                if i+1 < len(img_paths):
-                    with Image.open(img_paths[i+1]) as img: aspect = img.height/img.width
-                    if aspect > (box_h/box_w): pdf.image(img_paths[i+1], x=105, y=y_pos, h=box_h)
-                    else: pdf.image(img_paths[i+1], x=105, y=y_pos, w=box_w)
-                pdf.ln(80)
-        
-        if data.get('signature_path') and os.path.exists(data['signature_path']):
-            if 280 - pdf.get_y() < 40: pdf.add_page()
-            pdf.ln(5); pdf.set_font("Helvetica", "B", 10); sig_y = pdf.get_y(); pdf.set_x(130); pdf.cell(60, 5, "Authorized Signature:", 0, 1, 'C')
-            try: pdf.image(data['signature_path'], x=145, y=sig_y+6, w=30)
-            except: pass
-            pdf.set_y(sig_y+30); pdf.set_x(130); pdf.cell(60, 5, f"Engineer: {st.session_state.get('username')}", 0, 1, 'C')
-        filename = f"DebitNote_{int(datetime.now().timestamp())}.pdf"
-    else:
-        pdf.set_font("Helvetica", "", 12); pdf.cell(0, 8, f"Contractor: {data['contractor']}", 0, 1)
-        pdf.cell(0, 8, f"Period: {data['start']} to {data['end']}", 0, 1); pdf.ln(5)
-        pdf.set_font("Helvetica", "B", 10); pdf.set_fill_color(50, 50, 50); pdf.set_text_color(255)
-        headers = ["Date", "Category", "Reason", "Amount"]
-        for h, w in zip(headers, [30, 40, 90, 30]): pdf.cell(w, 10, h, 1, 0, 'C', True)
-        pdf.ln(); pdf.set_text_color(0); pdf.set_font("Helvetica", "", 9)
-        total = 0
-        for _, row in data['df'].iterrows():
-            pdf.cell(30, 10, str(row['Date']), 1); pdf.cell(40, 10, str(row.get('Category', '-'))[:20], 1)
-            pdf.cell(90, 10, str(row['Reason'])[:50], 1); pdf.cell(30, 10, str(row['Amount']), 1, 1)
-            total += float(row['Amount'])
-        pdf.ln(5); pdf.set_font("Helvetica", "B", 12)
-        pdf.cell(160, 10, "Total Deductions:", 0, 0, 'R'); pdf.cell(30, 10, f"INR {total}", 0, 1, 'L')
-        filename = f"Statement_{data['contractor']}.pdf"
-
-    path = f"temp/{filename}"; pdf.output(path); return path
-
-# --- 6. UI ---
+class DiskCache:
+    """Size-capped on-disk store for immutable files (Drive PDFs and photo thumbnails by file ID, merged bundles by link-list hash).
+    Entries are written to a temp file and renamed into place, so readers never see a partial file; the index
+    is rebuilt from the directory on start, and least-recently-used entries go once it is over max_bytes."""
+    def __init__(self, root, max_bytes):
+        self.root = root; self.max_bytes = max_bytes; self._lock = threading.Lock()
+        self._files = {} # key -> [size, last_used]
+        os.makedirs(root, exist_ok=True)
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            if name.endswith(".part"): # Interrupted write
+                with contextlib.suppress(OSError): os.remove(path)
+            elif os.path.isfile(path): self._files[name] = [os.path.getsize(path), os.path.getmtime(path)]
+        self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def get(self, key):
+        """Path of a cached entry, marked as just used, or None"""
+        with self._lock:
+            meta = self._files.get(key)
+            if meta is None: return None
+            meta[1] = time.time()
+        with contextlib.suppress(OSError): os.utime(self._path(key)) # Keeps the LRU order across restarts
+        return self._path(key)
+
+    @contextlib.contextmanager
+    def writing(self, key):
+        """Binary file to write an entry into; it becomes visible only if the block completes"""
+        tmp = self._path(f"{key}.{uuid.uuid4().hex[:8]}.part")
+        try:
+            with open(tmp, "wb") as f: yield f
+            os.replace(tmp, self._path(key))
+        except BaseException:
+            with contextlib.suppress(OSError): os.remove(tmp)
+            raise
+        with self._lock: self._files[key] = [os.path.getsize(self._path(key)), time.time()]
+        self._evict(keep=key)
+
+    def _evict(self, keep=None):
+        doomed = []
+        with self._lock:
+            total = sum(meta[0] for meta in self._files.values())
+            for used, key in sorted((meta[1], k) for k, meta in self._files.items()):
+                if total <= self.max_bytes: break
+                if key == keep: continue
+                total -= self._files.pop(key)[0]; doomed.append(key)
+        for key in doomed:
+            with contextlib.suppress(OSError): os.remove(self._path(key)) # Open readers keep their copy
+
+@st.cache_resource
+def get_pdf_cache():
+    return DiskCache(PDF_CACHE_DIR, PDF_CACHE_MAX_BYTES)
+
+@st.cache_resource
+def get_thumb_cache():
+    return DiskCache(THUMB_CACHE_DIR, THUMB_CACHE_MAX_BYTES)
+
+# --- 6. PDF ENGINE ---
+@traced("create_pdf")
+def create_pdf(type, data, out=None):
+    """Builds a receipt or statement (render.build_pdf) and returns the PDF as bytes, or streams it into `out` (a
+    binary file) page by page and returns None"""
+    data = dict(data, generated_by=data.get('generated_by') or st.session_state.get("username", "System")) # Background jobs pass it explicitly
+    pdf = render.build_pdf(type, data, out); trace_note(pages=pdf.page, bytes=len(pdf.buffer))
+    return None if out else pdf.buffer.getvalue()
+
+# --- 7. BACKGROUND JOBS ---
+@st.cache_resource
+def get_io_pool():
+    return ThreadPoolExecutor(max_workers=SUBMIT_IO_WORKERS, thread_name_prefix="submit-io")
+
+class JobRegistry:
+    """Job id -> job, shared by every session so progress survives reruns. Finished jobs are evicted after
+    JOB_TTL_SECS, and the oldest beyond JOB_MAX_KEPT; running jobs are never evicted."""
+    def __init__(self):
+        self._jobs = OrderedDict(); self._lock = threading.Lock()
+
+    def add(self, job):
+        with self._lock: self._jobs[job.id] = job; self._evict()
+        return job
+
+    def _evict(self):
+        finished = sorted((j for j in self._jobs.values() if j.finished_at is not None), key=lambda j: j.finished_at)
+        excess = len(finished) - JOB_MAX_KEPT; cutoff = time.time() - JOB_TTL_SECS
+        for j in finished:
+            if excess <= 0 and j.finished_at >= cutoff: break
+            del self._jobs[j.id]; excess -= 1
+
+    def get(self, jid):
+        with self._lock: self._evict(); return self._jobs.get(jid)
+
+    def pop(self, jid, default=None):
+        with self._lock: return self._jobs.pop(jid, default)
+
+    def __contains__(self, jid):
+        return self.get(jid) is not None
+
+@st.cache_resource
+def get_jobs():
+    return JobRegistry()
+
+class BackgroundJob:
+    """Runs _run() on its own thread with progress and a message for the UI; `download` is (path, file_name, mime)
+    when the job produces a file. retry() re-runs _run(), which skips any step whose result the job already holds."""
+    kind = "Background"
+    done_message = "Done"
+
+    def __init__(self, total_steps):
+        self.id = uuid.uuid4().hex; self.state = "queued"; self.error = None; self.message = "Queued"; self.download = None
+        self._lock = threading.Lock(); self.total_steps = total_steps; self.done_steps = 0; self.finished_at = None
+
+    @property
+    def progress(self):
+        return min(1.0, self.done_steps / max(1, self.total_steps))
+
+    def _tick(self, message):
+        with self._lock: self.done_steps += 1; self.message = message
+
+    def start(self):
+        self.state = "running"; self.error = None; self.finished_at = None
+        threading.Thread(target=in_context(self._main), name=f"{self.kind.lower()}-{self.id[:8]}", daemon=True).start()
+
+    def retry(self):
+        if self.state == "failed": self.start()
+
+    def _release(self):
+        """Drops whatever the job held only for _run() once it has succeeded; a failed job keeps it for retry()"""
+
+    def _main(self):
+        try:
+            self._run(); self._release()
+            self.state = "done"; self.message = self.done_message
+        except Exception as e:
+            logging.error(f"{self.kind} job {self.id} failed: {e}")
+            self.state = "failed"; self.error = str(e); self.message = f"Failed: {e}"
+        self.finished_at = time.time()
+
+class SubmitJob(BackgroundJob):
+    """One Raise Debit Note submission, run off the script thread. Photos are compressed as one batch on the CPU
+    pool, then uploaded concurrently on the IO pool while the PDF is built, and all files are shared in one batched
+    Drive call; every step's result is kept, so retry() only re-runs what failed."""
+    kind = "Submit"
+    done_message = "Submitted Successfully!"
+
+    def __init__(self, form, photos, sig_bytes, email, phone):
+        super().__init__(2 * len(photos) + (1 if sig_bytes else 0) + 5)
+        self.note_id = int(datetime.now().timestamp()); self.pdf_name = f"DebitNote_{self.note_id}.pdf"
+        self.form = form; self.photos = photos; self.sig_bytes = sig_bytes; self.email = email; self.phone = phone # photos: [(name, bytes)]
+        self.compressed = [None] * len(photos); self.files = [None] * len(photos); self.sig_jpeg = None # CompressedImage, Drive file dicts
+        self.pdf_bytes = None; self.pdf_file = None; self.shared = set(); self.inserted = False; self.notified = False
+        self.label = f"{form['contractor']} · INR {form['amount']}"
+
+    def _release(self):
+        self.photos = self.compressed = self.sig_bytes = self.sig_jpeg = self.pdf_bytes = None # Photo and PDF bytes
+
+    def _compress(self):
+        pending = [i for i, c in enumerate(self.compressed) if c is None]
+        for i, img in zip(pending, compress_images([self.photos[i][1] for i in pending])):
+            self.compressed[i] = img; self._tick(f"Compressed photo {i+1}")
+
+    def _upload(self, i):
+        if self.files[i] is None:
+            self.files[i] = drive_upload(self.compressed[i].data, self.photos[i][0], "image/jpeg"); self._tick(f"Uploaded photo {i+1}")
+            try: save_thumbnail(self.files[i]['id'], self.compressed[i].data) # Records shows it without ever fetching it back
+            except Exception as e: logging.error(f"Thumbnail for photo {i+1} failed: {e}")
+
+    def _share(self):
+        results = share_drive_files([fl['id'] for fl in self.files + [self.pdf_file] if fl['id'] not in self.shared])
+        self.shared.update(fid for fid, res in results.items() if not isinstance(res, Exception))
+        errors = [res for res in results.values() if isinstance(res, Exception)]
+        if errors: raise errors[0]
+
+    def _gather(self, futures):
+        wait(futures)
+        errors = [f.exception() for f in futures if f.exception()]
+        if errors: raise errors[0]
+
+    def _run(self):
+        pool = get_io_pool(); f = self.form
+        self._compress() # One batch across the CPU process pool
+        if self.sig_bytes and self.sig_jpeg is None: self.sig_jpeg = compress_images([self.sig_bytes])[0]; self._tick("Signature ready")
+        upload = in_context(self._upload); uploads = [pool.submit(upload, i) for i in range(len(self.photos))] # In flight while the PDF builds
+        if self.pdf_bytes is None:
+            data = {"contractor": f['contractor'], "date": f['date'], "amount": f['amount'], "category": f['category'], "reason": f['reason'],
+                    "site": f['site'], "images": self.compressed, "signature": self.sig_jpeg, "generated_by": f['username']}
+            self.pdf_bytes = create_pdf("receipt", data); self._tick("PDF built")
+        if self.pdf_file is None: self.pdf_file = drive_upload(self.pdf_bytes, self.pdf_name, "application/pdf"); self._tick("PDF uploaded")
+        self._gather(uploads)
+        if len(self.shared) < len(self.files) + 1: self._share(); self._tick("Files shared")
+        if not self.inserted:
+            links = ",".join(drive_link(fl) for fl in self.files)
+            db_insert("DebitNotes", [self.note_id, f['contractor'], f['date'], f['amount'], f['category'], f['reason'], f['site'], links, drive_link(self.pdf_file), f['username']]).result()
+            self.inserted = True; self._tick("Saved to register")
+        if not self.notified:
+            # Notification Dispatch Block: queued in the outbox, delivered (and retried) by its worker
+            if self.email: notify_email([self.email], f"Debit Note - {f['contractor']}", f"Debit Note Raised (INR {f['amount']})", self.pdf_bytes, self.pdf_name)
+            if self.phone:
+                wa_msg = f"Alert from GP Group:\nA Debit Note of INR {f['amount']} has been raised for site {f['site']}.\nReason: {f['reason']}\nEngineer: {f['username']}"
+                notify_whatsapp(self.phone, wa_msg)
+            self.notified = True; self._tick("Contractor notification queued")
+
+class ExportJob(BackgroundJob):
+    """Period close: statements for every contractor with notes in [start, end] plus a summary.csv of totals, in
+    one ZIP. Notes are grouped in a single pass over the date range, statements render in parallel on the CPU
+    pool, and each PDF is streamed into the ZIP file (in the PDF cache) as soon as it is ready."""
+    kind = "Export"
+    done_message = "Export ready"
+    COLUMNS = ["Date", "Category", "Reason", "Amount"] # All a statement needs, so workers get small frames
+
+    def __init__(self, start, end, generated_by):
+        super().__init__(1)
+        self.start_date = start; self.end_date = end; self.generated_by = generated_by
+        self.label = f"Period close {start} to {end}"
+
+    def _render(self, groups):
+        """Yields (contractor, pdf bytes) in completion order; in-thread when the process pool is unavailable"""
+        pending = dict(groups); args = (self.start_date, self.end_date, self.generated_by)
+        if len(pending) > 1 and render.CPU_WORKERS > 1:
+            try:
+                futures = {render.cpu_pool().submit(render.statement_worker, name, df, *args): name for name, df in pending.items()} # Untraced: see in_context()
+                for fut in as_completed(futures):
+                    name = futures[fut]; pdf = fut.result(); del pending[name]
+                    yield name, pdf
+            except Exception as e: logging.warning(f"Statement process pool unavailable, rendering in-thread: {e}")
+        for name, df in list(pending.items()): yield name, render.statement_worker(name, df, *args)
+
+    def _run(self):
+        frame = get_notes_view(self.start_date, self.end_date).select(start=self.start_date, end=self.end_date)
+        if frame.empty: raise ValueError("No debit notes in this period")
+        grouped = frame.groupby('Contractor Name', observed=True, sort=True)
+        summary = grouped['Amount'].agg(['count', 'sum'])
+        groups = {str(name): df[self.COLUMNS] for name, df in grouped}
+        self.total_steps = len(groups) + 1; self.done_steps = 0; self._tick(f"{len(groups)} contractors, {len(frame)} notes")
+        cache = get_pdf_cache(); key = f"export_{self.id}.zip"
+        with cache.writing(key) as f, zipfile.ZipFile(f, "w") as zf:
+            names = set()
+            for name, pdf in self._render(groups):
+                file_name = re.sub(r'[^A-Za-z0-9._-]+', '_', name).strip('_') or "contractor"
+                while file_name in names: file_name += "_"
+                names.add(file_name)
+                zf.writestr(f"Statement_{file_name}.pdf", pdf, compress_type=zipfile.ZIP_STORED) # PDF streams are already compressed
+                self._tick(f"Statement ready: {name}")
+            csv = pd.DataFrame({"Contractor": summary.index.astype(str), "Debit Notes": summary['count'].to_numpy(), "Total Deductions (INR)": summary['sum'].round(2).to_numpy()})
+            csv.loc[len(csv)] = ["TOTAL", int(summary['count'].sum()), round(float(summary['sum'].sum()), 2)]
+            zf.writestr("summary.csv", csv.to_csv(index=False), compress_type=zipfile.ZIP_DEFLATED)
+        self.download = (cache.get(key), f"Statements_{self.start_date}_to_{self.end_date}.zip", "application/zip")
+
+def render_jobs(session_key):
+    """Progress panel for this session's background jobs under `session_key`; polls only while one is running"""
+    jobs = get_jobs(); ids = [j for j in st.session_state.get(session_key, []) if j in jobs]
+    st.session_state[session_key] = ids
+    if not ids: return
+    running = any(getattr(jobs.get(j), 'state', None) == "running" for j in ids)
+    @st.fragment(run_every=1.0 if running else None)
+    def _panel():
+        for jid in list(st.session_state.get(session_key, [])):
+            job = jobs.get(jid)
+            if job is None: continue
+            if job.state == "done":
+                c1, c2 = st.columns([4, 1]); c1.success(f"{job.label}: {job.message}")
+                if job.download and job.download[0] and os.path.exists(job.download[0]):
+                    with open(job.download[0], "rb") as fh: c1.download_button("Download", fh, file_name=job.download[1], mime=job.download[2], key=f"download_{jid}")
+                if c2.button("Dismiss", key=f"dismiss_{jid}"): jobs.pop(jid, None); st.session_state[session_key].remove(jid); st.rerun()
+            elif job.state == "failed":
+                c1, c2 = st.columns([4, 1]); c1.error(f"{job.label}: {job.message}")
+                if c2.button("Retry", key=f"retry_{jid}"): job.retry(); st.rerun()
+            else: st.progress(job.progress, text=f"{job.label}: {job.message}")
+        if not any(getattr(jobs.get(j), 'state', None) == "running" for j in st.session_state.get(session_key, [])) and running: st.rerun() # Stop polling
+    _panel()
+
+def render_transcription():
+    """Puts the session's latest voice clip into the Reason box once it is transcribed; polls only while it runs"""
+    key = st.session_state.get('voice_clip'); fut = get_transcriber().result(key) if key else None
+    if fut is None or st.session_state.get('voice_applied') == key: return
+    if fut.done():
+        st.session_state['voice_text'] = st.session_state['dn_reason'] = fut.result(); st.session_state['voice_applied'] = key
+        st.success("Audio captured!"); return
+    @st.fragment(run_every=1.0)
+    def _wait():
+        if fut.done(): st.rerun()
+        st.info("🎙️ Transcribing...")
+    _wait()
+
+# --- 8. UI ---
 THEMES = { "Corporate Blue": {"bg": "#f4f6f9", "card": "rgba(255, 255, 255, 0.9)", "text": "#1e293b", "primary": "#0F52BA", "accent": "#3b82f6"} }
 def inject_css():
     t = THEMES["Corporate Blue"]
@@ -327,7 +2116,7 @@ def card_end(): st.markdown('</div>', unsafe_allow_html=True)
 def reset_form():
     st.session_state['dn_site'] = ""; st.session_state['dn_amt'] = 0.0; st.session_state['dn_reason'] = ""; st.session_state['voice_text'] = ""; st.session_state['uploader_key'] += 1; st.session_state['cam_buffer'] = []
 
-# --- 7. MAIN APP ---
+# --- 9. MAIN APP ---
 def main():
     st.set_page_config(page_title="GP Portal", page_icon="🏗️", layout="wide")
     if 'uploader_key' not in st.session_state: st.session_state['uploader_key'] = 0
@@ -379,56 +2168,67 @@ def main():
         if st.session_state.get('user_pic'): 
             st.markdown(f'<img src="{st.session_state["user_pic"]}" class="profile-pic">', unsafe_allow_html=True)
         else: 
-            if os.path.exists(LOGO_PATH): st.image(LOGO_PATH, width=80)
+            if os.path.exists(render.LOGO_PATH): st.image(render.LOGO_PATH, width=80)
             else: st.markdown(f'<div style="display:flex;justify-content:center;font-size:80px;">👤</div>', unsafe_allow_html=True)
         
         st.markdown(f"<h3 style='text-align: center;'>{st.session_state['username']}</h3>", unsafe_allow_html=True)
         st.divider()
         opts=["Dashboard", "Raise Debit Note", "My Profile"]
-        if st.session_state['role']=="Admin": opts+=["Contractors", "User Management"]
-        sel=option_menu("Nav", opts, icons=['grid', 'file-text', 'person-circle', 'building', 'people'])
+        if st.session_state['role']=="Admin": opts+=["Contractors", "User Management", "Performance"]
+        sel=option_menu("Nav", opts, icons=['grid', 'file-text', 'person-circle', 'building', 'people', 'speedometer2'])
         if st.button("Logout"): st.session_state['auth']=False; st.query_params.clear(); st.rerun()
 
     # --- DASHBOARD (WITH PAGINATION) ---
     if sel == "Dashboard":
         st.title("Dashboard")
-        df = db_get("DebitNotes"); cons = db_get("Contractors")
+        notes = get_notes_view(); cons = db_get("Contractors")
         
-        if not df.empty:
-            df['Amount'] = pd.to_numeric(df['Amount'], errors='coerce')
+        if notes.count:
             m1, m2, m3 = st.columns(3)
-            m1.metric("Total", f"₹{df['Amount'].sum():,.0f}"); m2.metric("Count", len(df)); m3.metric("Last", df['Date'].max())
+            m1.metric("Total", f"₹{notes.total:,.0f}"); m2.metric("Count", notes.count); m3.metric("Last", render.fmt_date(notes.latest))
             
             c1, c2 = st.columns(2)
-            with c1: card_start(); st.subheader("Category Breakdown"); st.bar_chart(df.groupby('Category')['Amount'].sum() if 'Category' in df.columns else []); card_end()
-            with c2: card_start(); st.subheader("Top Contractors"); st.bar_chart(df.groupby('Contractor Name')['Amount'].sum()); card_end()
+            with c1: card_start(); st.subheader("Category Breakdown"); st.bar_chart(notes.sums('Category')); card_end()
+            with c2: card_start(); st.subheader("Top Contractors"); st.bar_chart(notes.sums('Contractor Name')); card_end()
             
             card_start()
             c1, c2 = st.columns([2, 1])
             con_options = ["All"] + cons['Name'].tolist() if not cons.empty else ["All"]
             search_con = c1.selectbox("Filter Contractor", con_options)
-            if search_con != "All": df = df[df['Contractor Name'] == search_con]
-            df = df.sort_values(by="Date", ascending=False)
+            rec_range = c2.date_input("Date Range", [], key="rec_range")
+            c3, c4 = st.columns(2)
+            search_cat = c3.selectbox("Filter Category", ["All"] + REASON_CATEGORIES)
+            search_by = c4.selectbox("Submitted By", ["All"] + sorted(notes.values('SubmittedBy') - {""}))
+            filters = {"Contractor Name": search_con, "Category": search_cat, "SubmittedBy": search_by}
+            filters = {k: v for k, v in filters.items() if v != "All"}
+            rec_start, rec_end = (rec_range[0], rec_range[1]) if len(rec_range) == 2 else (None, None)
+            records = get_notes_view(rec_start, rec_end) # Partitioned: only the partitions the range overlaps
             card_end()
             
             # --- PAGINATION LOGIC ---
             st.subheader("Records")
             if 'page_number' not in st.session_state: st.session_state.page_number = 0
+            query_key = (tuple(sorted(filters.items())), rec_start, rec_end)
+            if st.session_state.get('records_query') != query_key: st.session_state.records_query = query_key; st.session_state.page_number = 0
             items_per_page = 5
-            total_pages = max(1, math.ceil(len(df) / items_per_page))
-            if st.session_state.page_number >= total_pages: st.session_state.page_number = total_pages - 1
-            
-            start_idx = st.session_state.page_number * items_per_page
-            df_page = df.iloc[start_idx : start_idx + items_per_page]
+            df_page, total_rows = records.page(filters, rec_start, rec_end, st.session_state.page_number * items_per_page, items_per_page)
+            total_pages = max(1, math.ceil(total_rows / items_per_page))
+            if st.session_state.page_number >= total_pages:
+                st.session_state.page_number = total_pages - 1
+                df_page, total_rows = records.page(filters, rec_start, rec_end, st.session_state.page_number * items_per_page, items_per_page)
             
+            photo_links = {i: [l for l in str(links).split(",") if l.startswith('http')] for i, links in df_page['Image Links'].items()}
+            thumbs = get_thumbnails([l for links in photo_links.values() for l in links]) # Whole page at once, from disk after the first view
             for i, row in df_page.iterrows():
-                with st.expander(f"{row['Date']} | {row['Contractor Name']} | ₹{row['Amount']}"):
+                with st.expander(f"{render.fmt_date(row['Date'])} | {row['Contractor Name']} | ₹{render.fmt_amount(row['Amount'])}"):
                     c1, c2 = st.columns([3, 1])
                     c1.write(f"**Reason:** {row['Reason']}")
+                    shots = [thumbs[l] for l in photo_links[i] if thumbs.get(l)]
+                    if shots: c1.image(shots, width=THUMB_SIZE // 2)
                     if str(row['PDF Link']).startswith('http'): c1.link_button("View PDF", row['PDF Link'])
                     if st.session_state['role'] == "Admin" or row['SubmittedBy'] == st.session_state['username']:
                         if c2.button("🗑️ Delete", key=f"del_{row['ID']}"):
-                            if db_delete_row("DebitNotes", "ID", row['ID']): st.success("Deleted!"); time.sleep(1); st.rerun()
+                            if db_delete_row("DebitNotes", "ID", row['ID'], row['Date']): st.success("Deleted!"); time.sleep(1); st.rerun()
 
             # Pagination Controls UI
             if total_pages > 1:
@@ -444,28 +2244,32 @@ def main():
         st.markdown("---")
         if st.button("📥 Download Tools (Statement / Merge)"): st.session_state['show_gen'] = True
         if st.session_state.get('show_gen'):
-            card_start(); st.subheader("Download Center")
-            mc = st.selectbox("Contractor", df['Contractor Name'].unique())
+            card_start(); st.subheader("Download Center"); render_jobs('export_jobs')
+            mc = st.selectbox("Contractor", sorted(notes.sums('Contractor Name').index))
             mdr = st.date_input("Period", [])
-            col_a, col_b = st.columns(2)
+            period = get_notes_view(*mdr[:2]) # Partitioned: only the partitions the period overlaps
+            col_a, col_b, col_c = st.columns(3)
             if col_a.button("📄 Account Statement"):
-                mask = (df['Contractor Name'] == mc) & (pd.to_datetime(df['Date']).dt.date >= mdr[0]) & (pd.to_datetime(df['Date']).dt.date <= mdr[1])
-                f_df = df[mask]
+                f_df = period.select(contractor=mc, start=mdr[0], end=mdr[1])
                 if not f_df.empty:
-                    path = create_pdf("statement", {"contractor": mc, "start": mdr[0], "end": mdr[1], "df": f_df})
-                    with open(path, "rb") as f: st.download_button("Download Statement PDF", f, file_name="Statement.pdf")
+                    pdf_bytes = create_pdf("statement", {"contractor": mc, "start": mdr[0], "end": mdr[1], "df": f_df})
+                    st.download_button("Download Statement PDF", pdf_bytes, file_name="Statement.pdf", mime="application/pdf")
             if col_b.button("📚 Merge All Debit Notes"):
-                mask = (df['Contractor Name'] == mc) & (pd.to_datetime(df['Date']).dt.date >= mdr[0]) & (pd.to_datetime(df['Date']).dt.date <= mdr[1])
-                f_df = df[mask]
+                f_df = period.select(contractor=mc, start=mdr[0], end=mdr[1])
                 links = f_df['PDF Link'].tolist()
                 valid_links = [l for l in links if str(l).startswith('http')]
                 if valid_links:
                     with st.spinner(f"Merging {len(valid_links)} PDFs..."):
                         try:
-                            merged_bytes = merge_pdfs(valid_links)
-                            st.download_button("Download Merged Bundle", merged_bytes, file_name="Merged_Debit_Notes.pdf", mime="application/pdf")
+                            with open(merge_pdfs(valid_links), "rb") as merged:
+                                st.download_button("Download Merged Bundle", merged, file_name="Merged_Debit_Notes.pdf", mime="application/pdf")
                         except Exception as e: st.error(f"Merge failed: {e}")
                 else: st.warning("No PDF links found.")
+            if col_c.button("🗂️ Period Close (All Contractors)"):
+                if len(mdr) < 2: st.warning("Pick a start and end date.")
+                else:
+                    job = ExportJob(mdr[0], mdr[1], st.session_state['username'])
+                    get_jobs().add(job); st.session_state.setdefault('export_jobs', []).append(job.id); job.start(); st.rerun()
             card_end()
 
     # --- MY PROFILE ---
@@ -485,6 +2289,7 @@ def main():
         pic_file = st.file_uploader("Upload New Image", type=['jpg', 'png'])
         cropped_img = None
         if pic_file:
+            from streamlit_cropper import st_cropper
             st.caption("Adjust box to crop face:")
             cropped_img = st_cropper(Image.open(pic_file), aspect_ratio=1, box_color='#0000FF', key='crop')
             st.caption("Preview:")
@@ -507,10 +2312,12 @@ def main():
 
     # --- RAISE DEBIT NOTE (WITH WHATSAPP DISPATCH) ---
     elif sel == "Raise Debit Note":
-        st.title("Raise Debit Note"); card_start()
+        st.title("Raise Debit Note"); render_jobs('submit_jobs'); card_start()
         st.write("🎙️ **Voice Description** (Record -> Speak -> Stop)")
+        from streamlit_mic_recorder import mic_recorder
         audio = mic_recorder(start_prompt="Record", stop_prompt="Stop", key='recorder', format='wav')
-        if audio: st.session_state['voice_text'] = transcribe_audio(audio['bytes']); st.success("Audio captured!")
+        if audio: st.session_state['voice_clip'] = get_transcriber().submit(audio['bytes'])[0] # Same clip on every rerun: transcribed once
+        render_transcription()
 
         with st.form("dn_form"):
             cons = db_get("Contractors"); c_list = cons['Name'].tolist() if not cons.empty else []
@@ -531,28 +2338,16 @@ def main():
             st.markdown("---"); st.write("**✍️ Signature**"); sig_file = st.file_uploader("Upload Sig", type=['png', 'jpg'], key="sig_up")
             
             if st.form_submit_button("Submit Note"):
-                imgs, links = [], []
-                for b in st.session_state['cam_buffer']: cp = compress_image(b); imgs.append(cp); links.append(upload_to_drive(cp, "cam.jpg", "image/jpeg"))
-                if files:
-                    for f in files: cp = compress_image(f); imgs.append(cp); links.append(upload_to_drive(cp, f.name, "image/jpeg"))
-                sig_path = compress_image(sig_file) if sig_file else None
-                data = {"contractor": con, "date": str(dt), "amount": amt, "category": cat, "reason": reason, "site": site, "local_img_paths": imgs, "signature_path": sig_path}
-                pdf_path = create_pdf("receipt", data); pdf_link = upload_to_drive(pdf_path, os.path.basename(pdf_path), "application/pdf")
-                db_insert("DebitNotes", [int(datetime.now().timestamp()), con, str(dt), amt, cat, reason, site, ",".join(links), pdf_link, st.session_state['username']])
-                
-                # Notification Dispatch Block
-                con_row = cons[cons['Name'] == con]
-                if not con_row.empty:
-                    # Dispatch Email
-                    if 'Email' in con_row.columns and str(con_row.iloc[0]['Email']).strip() != "":
-                        send_email_with_pdf([con_row.iloc[0]['Email']], f"Debit Note - {con}", f"Debit Note Raised (INR {amt})", pdf_path)
-                    
-                    # Dispatch WhatsApp
-                    if 'Phone' in con_row.columns and str(con_row.iloc[0]['Phone']).strip() != "":
-                        wa_msg = f"Alert from GP Group:\nA Debit Note of INR {amt} has been raised for site {site}.\nReason: {reason}\nEngineer: {st.session_state['username']}"
-                        send_whatsapp(str(con_row.iloc[0]['Phone']).strip(), wa_msg)
-
-                st.toast("Submitted Successfully!")
+                # Snapshot everything the job needs; it runs without access to session state
+                photos = [("cam.jpg", b) for b in st.session_state['cam_buffer']] + [(f.name, f.getvalue()) for f in (files or [])]
+                con_row = cons[cons['Name'] == con] if not cons.empty else cons
+                email = str(con_row.iloc[0]['Email']).strip() if not con_row.empty and 'Email' in con_row.columns else ""
+                phone = str(con_row.iloc[0]['Phone']).strip() if not con_row.empty and 'Phone' in con_row.columns else ""
+                form = {"contractor": con, "date": str(dt), "amount": amt, "category": cat, "reason": reason, "site": site, "username": st.session_state['username']}
+                job = SubmitJob(form, photos, sig_file.getvalue() if sig_file else None, email, phone)
+                get_jobs().add(job); st.session_state.setdefault('submit_jobs', []).append(job.id); job.start()
+
+                st.toast("Submitting in the background...")
                 st.session_state['cam_buffer'] = []; reset_form(); time.sleep(1); st.rerun()
         card_end()
 
@@ -580,5 +2375,23 @@ def main():
                 safe_df = users_df.drop(columns=["Password"], errors='ignore')
                 st.dataframe(safe_df, use_container_width=True)
 
+    # --- PERFORMANCE (ADMIN) ---
+    elif sel == "Performance" and st.session_state['role'] == "Admin":
+        st.title("Performance"); metrics = get_metrics(); card_start()
+        rate = st.slider("Trace sampling rate", 0.0, 1.0, float(metrics.sample_rate), 0.05, help="Share of calls timed; 0 turns tracing off")
+        if rate != metrics.sample_rate: metrics.sample_rate = rate
+        st.caption(f"Since {datetime.fromtimestamp(metrics.since).strftime('%Y-%m-%d %H:%M:%S')} · percentiles over each operation's last 1024 calls")
+        summary = metrics.summary()
+        if summary.empty: st.info("No traced calls yet.")
+        else:
+            st.dataframe(summary.fillna(0), use_container_width=True)
+            op = st.selectbox("Latency histogram", list(summary.index)); st.bar_chart(metrics.histogram(op))
+        st.write("**Google API scheduler**"); st.json(get_scheduler().snapshot())
+        c1, c2, c3 = st.columns(3)
+        c1.download_button("⬇️ Prometheus metrics", metrics.prometheus(get_scheduler().snapshot()), file_name="metrics.prom", mime="text/plain")
+        c2.download_button("⬇️ Recent spans (JSON lines)", metrics.jsonl(), file_name="spans.jsonl", mime="application/x-ndjson")
+        if c3.button("Reset"): metrics.reset(); st.rerun()
+        card_end()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
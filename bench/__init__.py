@@ -0,0 +1 @@
+"""Benchmark harness; see __main__.py or run python -m bench --help"""
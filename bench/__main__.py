@@ -0,0 +1,177 @@
+"""Benchmark harness: runs the app's real data, PDF, image, Drive and notification paths against in-process fakes
+of Sheets, Drive, SMTP and Twilio, so no credentials or network are needed. Run from the repository root:
+
+    python -m bench                                  # every scenario at 1k, 10k and 100k rows
+    python -m bench --rows 1k,1m --only 'db_get.*'   # glob over scenario names
+    python -m bench --latency drive=300 --fail drive=0.05,sheets=0.02
+    python -m bench --save-baseline                  # record bench/baseline.json
+    python -m bench --tolerance 0.15                 # compare against it (exit status 1 on a regression)
+
+Each scenario runs in a fresh subprocess so its peak RSS is its own. Reported: throughput (iterations/s and
+units/s), p50/p95 latency per iteration, peak RSS, and the app's own per-operation spans."""
+import os
+import sys
+import json
+import time
+import fnmatch
+import functools
+import argparse
+import resource
+import tempfile
+import subprocess
+
+from . import datasets
+from .scenarios import SCENARIOS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(ROOT, "bench", "baseline.json")
+DEFAULT_ROWS = "1k,10k,100k"
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024) # bytes on macOS, KB on Linux
+
+def _percentile(values, q):
+    values = sorted(values); pos = (len(values) - 1) * q; lo = int(pos)
+    return values[lo] + (values[min(lo + 1, len(values) - 1)] - values[lo]) * (pos - lo)
+
+class Context:
+    """What a scenario's setup gets: the app module (patched onto the fakes), its inputs and the run options"""
+    def __init__(self, app, store, opts):
+        self.app = app; self.store = store; self.merge_files = opts['merge_files']; self.burst = opts['burst']; self.drain_timeout = opts['drain_timeout']
+        self.photo_count = opts['photos']
+
+    @functools.cached_property
+    def photos(self):
+        return datasets.photo_set("phone", self.photo_count)
+
+    @functools.cached_property
+    def signature(self):
+        return datasets.signature()
+
+def run_child(spec):
+    """Runs one scenario in this process and returns its result dict"""
+    import logging
+    logging.disable(logging.NOTSET if spec['verbose'] else logging.CRITICAL) # Injected failures are logged by the app as errors
+    sys.path.insert(0, ROOT); os.chdir(ROOT)
+    import app
+    from .fakes import Faults, installed
+    setup, sized, unit = SCENARIOS[spec['scenario']]; rows = spec['rows'] if sized else 1000
+    tables = {"DebitNotes": datasets.debit_notes(rows, app.TABLES["DebitNotes"], app.REASON_CATEGORIES), "Contractors": datasets.contractors(app.TABLES["Contractors"]),
+              "Users": datasets.users(app.TABLES["Users"], app.hash_password("bench")), "Notifications": [app.TABLES["Notifications"]], app.REVISIONS_SHEET: [app.Revisions.HEADERS]}
+    faults = Faults(spec['latency'], spec['fail'], spec['bandwidth'], seed=spec['seed'])
+    secrets = {"drive_settings": {"folder_id": "bench-folder", "sheet_url": "https://docs.google.com/spreadsheets/d/bench"},
+               "email_settings": {"sender_email": "bench@example.com", "app_password": "x"},
+               "whatsapp_settings": {"account_sid": "ACbench", "auth_token": "x", "from_number": "+10000000000"},
+               "perf_settings": {"sample_rate": 1.0}}
+    if not spec['real_quotas']: # Measure the app, not the quota pacing (which is tested by --real-quotas)
+        secrets["quota_settings"] = {k: 10 ** 6 for k in ("sheets_reads_per_min", "sheets_writes_per_min", "drive_calls_per_min", "emails_per_min", "whatsapp_per_min")}
+    template = {}
+    def pdf_for(file_id): # Every linked PDF in the dataset is a copy of one real receipt
+        if 'pdf' not in template:
+            template['pdf'] = app.create_pdf("receipt", {"contractor": "Contractor 001", "date": "2025-04-01", "amount": "9100", "category": app.REASON_CATEGORIES[2],
+                                                         "reason": datasets.REASONS[2], "site": "Site 3", "images": app.compress_images([b for _, b in ctx.photos[:2]]),
+                                                         "signature": None, "generated_by": "engineer1"})
+        return template['pdf']
+    with tempfile.TemporaryDirectory(prefix="gp-bench-") as tmp, \
+            installed(app, tables, faults, secrets, drive_default=pdf_for, PDF_CACHE_DIR=os.path.join(tmp, "pdf_cache"), OUTBOX_DB_PATH=os.path.join(tmp, "outbox.db")) as store:
+        ctx = Context(app, store, spec)
+        step = setup(ctx, rows)
+        step() # Warm-up: imports, first connections, lazy caches
+        app.get_metrics().reset(); rss_before = _peak_rss_mb()
+        timings = []; units = 0; deadline = time.monotonic() + spec['max_secs']
+        while len(timings) < spec['repeat'] and (len(timings) < 3 or time.monotonic() < deadline):
+            start = time.perf_counter(); units += step(); timings.append(time.perf_counter() - start)
+        spans = app.get_metrics().summary()
+        app.get_writer().flush()
+    total = sum(timings)
+    return {"scenario": spec['scenario'], "rows": rows if sized else None, "unit": unit, "iterations": len(timings),
+            "throughput": len(timings) / total, "units_per_sec": units / total,
+            "p50_ms": _percentile(timings, 0.5) * 1000, "p95_ms": _percentile(timings, 0.95) * 1000,
+            "peak_rss_mb": _peak_rss_mb(), "rss_growth_mb": _peak_rss_mb() - rss_before,
+            "spans": {op: {"calls": int(r['calls']), "p50_ms": r['p50 ms'], "p95_ms": r['p95 ms']} for op, r in spans.iterrows()},
+            "faults": faults.counts}
+
+def result_key(r):
+    return r['scenario'] + (f"@{datasets.label(r['rows'])}" if r['rows'] else "")
+
+def compare(result, base, tolerance, floor_ms=1.0):
+    """Relative changes against the baseline entry and the ones that regressed: beyond `tolerance`, and for timings
+    also by more than `floor_ms`, so sub-millisecond jitter on cache hits is not reported"""
+    changes = {"p50": result['p50_ms'] / base['p50_ms'] - 1, "p95": result['p95_ms'] / base['p95_ms'] - 1,
+               "throughput": result['throughput'] / base['throughput'] - 1, "rss": result['peak_rss_mb'] / base['peak_rss_mb'] - 1}
+    slower_ms = {"p50": result['p50_ms'] - base['p50_ms'], "p95": result['p95_ms'] - base['p95_ms'],
+                 "throughput": 1000 / result['throughput'] - 1000 / base['throughput'], "rss": float("inf")}
+    worse = [k for k, v in changes.items() if (v < -tolerance if k == "throughput" else v > tolerance) and slower_ms[k] > floor_ms]
+    return changes, worse
+
+def _fmt(r, base, tolerance, floor_ms):
+    rate = f"{r['units_per_sec']:,.0f}" if r['units_per_sec'] >= 100 else f"{r['units_per_sec']:.2f}"
+    line = (f"{result_key(r):<26}{r['iterations']:>6}{r['throughput']:>10.2f}{rate:>14} {r['unit']:<9}"
+            f"{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['peak_rss_mb']:>10.0f}")
+    if base is None: return line, []
+    changes, worse = compare(r, base, tolerance, floor_ms)
+    return line + f"   p95 {changes['p95']:+.0%} thr {changes['throughput']:+.0%} rss {changes['rss']:+.0%}" + ("  REGRESSION " + ",".join(worse) if worse else ""), worse
+
+def _pairs(text, cast=float):
+    """'drive=300,sheets=80' -> {'drive': 300.0, 'sheets': 80.0}"""
+    return {k.strip(): cast(v) for k, v in (p.split("=") for p in text.split(",") if p)} if text else {}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", default=DEFAULT_ROWS, help=f"DebitNotes sizes for the sized scenarios, e.g. 1k,10k,1m (default {DEFAULT_ROWS})")
+    parser.add_argument("--only", default="*", help="Comma-separated globs over scenario names (%s)" % ", ".join(SCENARIOS))
+    parser.add_argument("--latency", default="", help="Per-service round trip in ms, e.g. drive=300,sheets=80 (services: sheets, drive, smtp, twilio)")
+    parser.add_argument("--fail", default="", help="Per-service failure rate, e.g. drive=0.05")
+    parser.add_argument("--bandwidth", default="", help="Per-service transfer rate in MB/s (sheets, drive); 0 = unlimited")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed iterations per scenario (default 20)")
+    parser.add_argument("--max-secs", type=float, default=30.0, help="Stop a scenario early after this long (at least 3 iterations)")
+    parser.add_argument("--photos", type=int, default=3, help="Phone photos per submitted note")
+    parser.add_argument("--merge-files", type=int, default=20, help="PDFs per merge")
+    parser.add_argument("--burst", type=int, default=10, help="Emails (and as many WhatsApp messages) per outbox iteration")
+    parser.add_argument("--drain-timeout", type=float, default=120.0)
+    parser.add_argument("--real-quotas", action="store_true", help="Keep the app's per-minute quotas instead of lifting them")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline file to compare against (default bench/baseline.json)")
+    parser.add_argument("--save-baseline", action="store_true", help="Write this run's results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Relative slowdown (or RSS growth) flagged as a regression (default 0.2)")
+    parser.add_argument("--floor-ms", type=float, default=1.0, help="Timing changes smaller than this are never regressions (default 1 ms)")
+    parser.add_argument("--json", help="Also write the full results, spans included, to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show the app's log output")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child: print(json.dumps(run_child(json.loads(args.child)))); return 0
+
+    globs = args.only.split(",")
+    names = [n for n in SCENARIOS if any(fnmatch.fnmatch(n, g) for g in globs)]
+    if not names: parser.error(f"--only matched no scenario; choose from {', '.join(SCENARIOS)}")
+    sizes = [datasets.parse_count(s) for s in args.rows.split(",")]
+    base = {}
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f: base = {result_key(r): r for r in json.load(f)['results']}
+    opts = {"latency": _pairs(args.latency), "fail": _pairs(args.fail), "bandwidth": _pairs(args.bandwidth), "repeat": args.repeat, "max_secs": args.max_secs,
+            "photos": args.photos, "merge_files": args.merge_files, "burst": args.burst, "drain_timeout": args.drain_timeout,
+            "real_quotas": args.real_quotas, "seed": args.seed, "verbose": args.verbose}
+    print(f"{'scenario':<26}{'iters':>6}{'ops/s':>10}{'units/s':>14} {'':<9}{'p50 ms':>10}{'p95 ms':>10}{'RSS MB':>10}" + ("   vs baseline" if base else ""))
+    results = []; regressions = []; failures = []
+    for name in names:
+        for rows in (sizes if SCENARIOS[name][1] else [None]):
+            spec = dict(opts, scenario=name, rows=rows)
+            proc = subprocess.run([sys.executable, "-m", "bench", "--child", json.dumps(spec)], cwd=ROOT, capture_output=True, text=True)
+            label = name + (f"@{datasets.label(rows)}" if rows else "")
+            if proc.returncode != 0:
+                failures.append(label); print(f"{label:<26}FAILED\n" + "\n".join("    " + l for l in proc.stderr.strip().splitlines()[-8:])); continue
+            r = json.loads(proc.stdout.strip().splitlines()[-1]); results.append(r)
+            line, worse = _fmt(r, base.get(result_key(r)), args.tolerance, args.floor_ms); print(line, flush=True)
+            if worse: regressions.append(result_key(r))
+    report = {"created": time.strftime("%Y-%m-%d %H:%M:%S"), "python": sys.version.split()[0], "cpus": os.cpu_count(), "options": opts, "results": results}
+    if args.json:
+        with open(args.json, "w") as f: json.dump(report, f, indent=1)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f: json.dump(report, f, indent=1)
+        print(f"Baseline saved to {os.path.relpath(args.baseline, ROOT)}")
+    if regressions: print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+    return 1 if regressions or failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""Synthetic tables and photo sets. Everything is seeded, so two runs (and a run and its baseline) see the same data."""
+import io
+
+import numpy as np
+from PIL import Image
+
+CONTRACTORS = 60
+ENGINEERS = 12
+SITES = 25
+REASONS = ["Helmet not worn on scaffold", "Rebar spacing outside tolerance", "Cement bags left in rain", "Slab pour delayed two days",
+           "Debris blocking access road", "Shuttering misaligned at grid C", "Unapproved material substitution", "Curing not done"]
+
+def parse_count(text):
+    """'1k' -> 1000, '1m' -> 1000000"""
+    text = str(text).strip().lower()
+    return int(float(text[:-1]) * {"k": 1_000, "m": 1_000_000}[text[-1]]) if text[-1] in "km" else int(text)
+
+def label(n):
+    return f"{n // 1_000_000}m" if n >= 1_000_000 and n % 1_000_000 == 0 else f"{n // 1000}k" if n >= 1000 and n % 1000 == 0 else str(n)
+
+def contractor_names():
+    return [f"Contractor {i:03d}" for i in range(CONTRACTORS)]
+
+def drive_link(file_id):
+    return f"https://drive.google.com/uc?id={file_id}&export=download"
+
+def debit_notes(n, headers, categories, seed=0):
+    """`n` DebitNotes rows as sheet strings: contractors Zipf-skewed (a few get most notes), dates over three years,
+    log-normal amounts, one to three photo links and a PDF link per note"""
+    rng = np.random.default_rng(seed)
+    weights = 1.0 / np.arange(1, CONTRACTORS + 1); weights /= weights.sum()
+    cols = {
+        "ID": (1_600_000_000 + np.arange(n)).astype(str),
+        "Contractor Name": np.array(contractor_names())[rng.choice(CONTRACTORS, n, p=weights)],
+        "Date": (np.datetime64("2023-01-01") + rng.integers(0, 3 * 365, n)).astype(str),
+        "Amount": np.char.mod("%.2f", np.round(rng.lognormal(8, 1.2, n), 2)),
+        "Category": np.array(categories)[rng.integers(0, len(categories), n)],
+        "Reason": np.array(REASONS)[rng.integers(0, len(REASONS), n)],
+        "Site Location": np.char.add("Site ", rng.integers(1, SITES + 1, n).astype(str)),
+        "Image Links": np.array([",".join(drive_link(f"photo{k}") for k in range(m)) for m in (1, 2, 3)])[rng.integers(0, 3, n)],
+        "PDF Link": np.char.add(np.char.add("https://drive.google.com/uc?id=pdf", np.arange(n).astype(str)), "&export=download"),
+        "SubmittedBy": np.char.add("engineer", rng.integers(1, ENGINEERS + 1, n).astype(str)),
+    }
+    return [list(headers)] + [list(row) for row in zip(*(cols[h].tolist() for h in headers))] # Not column_stack: a fixed-width copy of every cell
+
+def contractors(headers):
+    return [list(headers)] + [[str(i), name, "Civil works", f"c{i}@example.com", f"+9190000{i:05d}"] for i, name in enumerate(contractor_names())]
+
+def users(headers, password_hash):
+    return [list(headers)] + [[f"engineer{i}", password_hash, "Engineer", ""] for i in range(1, ENGINEERS + 1)] + [["admin", password_hash, "Admin", ""]]
+
+PHOTO_KINDS = {
+    "phone": (4032, 3024, "JPEG"), # 12 MP phone camera shot, EXIF-rotated
+    "small": (1280, 960, "JPEG"),
+    "screenshot": (1920, 1080, "PNG"), # RGBA, no draft decoding possible
+}
+
+def photo(kind, seed=0):
+    """One synthetic photo: smooth gradients plus sensor-like noise, so JPEG sizes and decode costs are realistic.
+    Built in uint8 with PIL, so making a 12 MP shot does not itself dominate the scenario's peak RSS."""
+    width, height, fmt = PHOTO_KINDS[kind]
+    gradient = Image.linear_gradient("L")
+    bands = [gradient.rotate(angle).resize((width, height), Image.Resampling.BILINEAR) for angle in (seed * 37 % 360, 90 + seed * 11 % 90, 200)]
+    img = Image.merge("RGB", bands)
+    noise = Image.fromarray(np.random.default_rng(seed).integers(0, 256, (height, width), dtype=np.uint8), "L").convert("RGB")
+    img = Image.blend(img, noise, 0.12); buf = io.BytesIO()
+    if fmt == "PNG": img.convert("RGBA").save(buf, "PNG")
+    else:
+        exif = Image.Exif(); exif[0x0112] = 6 # Portrait shot stored landscape, as phones do
+        img.save(buf, "JPEG", quality=90, exif=exif)
+    return buf.getvalue()
+
+def photo_set(kind, count, seed=0):
+    """[(file name, bytes)] for `count` photos of `kind`"""
+    return [(f"{kind}_{i}.{'png' if PHOTO_KINDS[kind][2] == 'PNG' else 'jpg'}", photo(kind, seed + i)) for i in range(count)]
+
+def signature():
+    img = Image.new("RGBA", (600, 200), (255, 255, 255, 0)); px = img.load()
+    for t in range(2000):
+        x = 40 + t * 520 // 2000; y = int(100 + 60 * np.sin(t / 90.0) * np.cos(t / 300.0))
+        for d in range(-2, 3): px[x, y + d] = (20, 20, 60, 255)
+    buf = io.BytesIO(); img.save(buf, "PNG"); return buf.getvalue()
@@ -0,0 +1,316 @@
+"""In-process stand-ins for Google Sheets (gspread worksheets), Drive v3, SMTP and Twilio. Each call sleeps for
+the service's latency (plus transfer time at its bandwidth) and fails at its failure rate, so the app's real
+retry, batching and caching code runs against them unchanged."""
+import json
+import random
+import re
+import smtplib
+import threading
+import time
+import uuid
+import contextlib
+import urllib.parse
+from unittest import mock
+
+import gspread
+import httplib2
+import requests
+from googleapiclient.discovery import build_from_document
+
+DEFAULT_LATENCY_MS = {"sheets": 120, "drive": 150, "smtp": 200, "twilio": 250} # Typical round trips from a hosted app
+DEFAULT_BANDWIDTH_MBPS = {"sheets": 10, "drive": 20} # Payload transfer rate; 0 means unlimited
+
+class Faults:
+    """Latency, bandwidth and failure rate per service, with counters of calls and injected failures"""
+    def __init__(self, latency_ms=None, fail=None, bandwidth_mbps=None, seed=0):
+        self.latency = {k: v / 1000.0 for k, v in dict(DEFAULT_LATENCY_MS, **(latency_ms or {})).items()}
+        self.fail = dict(fail or {}); self.bandwidth = dict(DEFAULT_BANDWIDTH_MBPS, **(bandwidth_mbps or {}))
+        self._rng = random.Random(seed); self._lock = threading.Lock()
+        self.counts = {k: {"calls": 0, "failed": 0} for k in self.latency}
+
+    def roll(self, service):
+        """Counts a call and returns True when it should fail; no delay (items inside a batch)"""
+        with self._lock:
+            failed = self._rng.random() < self.fail.get(service, 0.0)
+            c = self.counts.setdefault(service, {"calls": 0, "failed": 0}); c["calls"] += 1; c["failed"] += failed
+        return failed
+
+    def choice(self, options):
+        with self._lock: return self._rng.choice(options)
+
+    def hit(self, service, nbytes=0):
+        """Sleeps for one round trip plus transfer time and returns True when this call should fail"""
+        with self._lock: jitter = self._rng.lognormvariate(0, 0.25)
+        mbps = self.bandwidth.get(service) or 0
+        time.sleep(self.latency.get(service, 0.0) * jitter + (nbytes / (mbps * 1e6) if mbps else 0.0))
+        return self.roll(service)
+
+# --- SHEETS ---
+def _api_error(code):
+    res = requests.Response(); res.status_code = code
+    status = "RESOURCE_EXHAUSTED" if code == 429 else "UNAVAILABLE"
+    res._content = json.dumps({"error": {"code": code, "message": "Injected failure", "status": status}}).encode()
+    return gspread.exceptions.APIError(res)
+
+class FakeWorksheet:
+    """The slice of gspread.Worksheet the app uses, over an in-memory grid (row 1 holds the headers)"""
+    def __init__(self, title, rows, faults):
+        self.title = title; self.data = [list(r) for r in rows]; self.faults = faults; self._lock = threading.Lock()
+        sample = self.data[1:201] or self.data
+        self.row_bytes = sum(len(c) + 3 for r in sample for c in r) / max(1, len(sample)) # JSON size estimate per row
+
+    @property
+    def col_count(self):
+        return max((len(r) for r in self.data), default=0)
+
+    def _call(self, rows=1):
+        if self.faults.hit("sheets", int(rows * self.row_bytes)): raise _api_error(self.faults.choice((429, 503)))
+
+    def get_all_values(self):
+        self._call(len(self.data))
+        with self._lock: return [list(r) for r in self.data]
+
+    def get_values(self, a1_range):
+        c1, r1, c2, r2 = re.fullmatch(r"([A-Z]+)(\d*):([A-Z]+)(\d*)", a1_range).groups() # e.g. A120:J (open-ended)
+        first, last = gspread.utils.a1_to_rowcol(f"{c1}1")[1], gspread.utils.a1_to_rowcol(f"{c2}1")[1]
+        with self._lock: rows = [r[first - 1:last] for r in self.data[int(r1 or 1) - 1:int(r2) if r2 else None]]
+        self._call(len(rows)); return rows
+
+    def row_values(self, row):
+        self._call()
+        with self._lock: return list(self.data[row - 1]) if row <= len(self.data) else []
+
+    def col_values(self, col):
+        self._call(len(self.data) / 10) # One column of each row
+        with self._lock: return [r[col - 1] if col <= len(r) else "" for r in self.data]
+
+    def cell(self, row, col):
+        self._call()
+        with self._lock: value = self.data[row - 1][col - 1] if row <= len(self.data) and col <= len(self.data[row - 1]) else None
+        return gspread.cell.Cell(row, col, value)
+
+    def append_row(self, values, **kwargs):
+        return self.append_rows([values], **kwargs)
+
+    def append_rows(self, values, **kwargs):
+        self._call(len(values))
+        with self._lock:
+            start = len(self.data) + 1; self.data.extend([str(v) for v in row] for row in values); end = len(self.data)
+        last = gspread.utils.rowcol_to_a1(end, max(len(r) for r in values)).rstrip("0123456789")
+        return {"updates": {"updatedRange": f"'{self.title}'!A{start}:{last}{end}", "updatedRows": len(values)}}
+
+    def batch_update(self, data, **kwargs):
+        self._call(len(data))
+        with self._lock:
+            for d in data:
+                row, col = gspread.utils.a1_to_rowcol(d['range'].split("!")[-1].split(":")[0])
+                for i, values in enumerate(d['values']):
+                    while len(self.data) < row + i: self.data.append([])
+                    cells = self.data[row + i - 1]; cells.extend([""] * (col + len(values) - 1 - len(cells)))
+                    cells[col - 1:col - 1 + len(values)] = [str(v) for v in values]
+
+    def update(self, values, range_name=None, **kwargs):
+        row, col = gspread.utils.a1_to_rowcol(range_name or "A1")
+        self.batch_update([{'range': gspread.utils.rowcol_to_a1(row + i, col + j), 'values': [[v]]} for i, r in enumerate(values) for j, v in enumerate(r)])
+
+    def delete_rows(self, start, end=None):
+        self._call()
+        with self._lock: del self.data[start - 1:(end or start)]
+
+    def resize(self, rows=None, cols=None):
+        self._call()
+
+class FakeSpreadsheet:
+    def __init__(self, tables, faults):
+        self.faults = faults; self.sheets = {name: FakeWorksheet(name, rows, faults) for name, rows in tables.items()}
+
+    def _call(self):
+        if self.faults.hit("sheets"): raise _api_error(503)
+
+    def worksheets(self):
+        self._call(); return list(self.sheets.values())
+
+    def worksheet(self, name):
+        self._call()
+        if name not in self.sheets: raise gspread.exceptions.WorksheetNotFound(name)
+        return self.sheets[name]
+
+    def add_worksheet(self, title, rows, cols):
+        self._call(); ws = self.sheets[title] = FakeWorksheet(title, [], self.faults); return ws
+
+    def values_get(self, a1_range):
+        self._call(); name = a1_range.split("!")[0].strip("'")
+        if name not in self.sheets: raise _api_error(400) # Sheets answers "Unable to parse range"
+        return {'range': a1_range, 'values': [list(r) for r in self.sheets[name].data]}
+
+    def values_batch_get(self, ranges):
+        self._call()
+        return {'valueRanges': [{'range': r, 'values': self.sheets[r.split("!")[0].strip("'")].data[:1]} for r in ranges]}
+
+# --- DRIVE ---
+def _response(status, body=b"", **headers):
+    resp = httplib2.Response(dict({"status": status, "content-type": "application/json"}, **{k.replace("_", "-"): v for k, v in headers.items()}))
+    return resp, body if isinstance(body, bytes) else json.dumps(body).encode()
+
+def _http_error(code):
+    reason = "rateLimitExceeded" if code == 403 else "backendError"
+    return _response(code, {"error": {"code": code, "message": "Injected failure", "errors": [{"reason": reason}]}})
+
+class FakeDriveStore:
+    """File contents and metadata by ID. `default(file_id)` supplies bytes for IDs that were never uploaded, so
+    links in a synthetic dataset resolve without seeding every file."""
+    def __init__(self, default=None):
+        self.files = {}; self.uploads = {}; self.shared = set(); self.default = default; self._lock = threading.Lock()
+
+    def put(self, name, content, mime_type, file_id=None):
+        fid = file_id or uuid.uuid4().hex[:20]
+        with self._lock: self.files[fid] = {"name": name, "mimeType": mime_type, "content": bytes(content)}
+        return fid
+
+    def get(self, fid):
+        with self._lock: f = self.files.get(fid)
+        if f is None and self.default: f = {"name": f"{fid}.pdf", "mimeType": "application/pdf", "content": self.default(fid)}
+        return f
+
+    def metadata(self, fid):
+        f = self.get(fid); link = f"https://drive.google.com/uc?id={fid}&export=download"
+        return {"id": fid, "name": f["name"], "mimeType": f["mimeType"], "size": str(len(f["content"])), "webContentLink": link,
+                "webViewLink": f"https://drive.google.com/file/d/{fid}/view", "thumbnailLink": f"https://lh3.googleusercontent.com/d/{fid}=s220"}
+
+class FakeDriveHttp:
+    """httplib2.Http look-alike that answers the Drive v3 REST calls googleapiclient makes: multipart and resumable
+    uploads, ranged media downloads, metadata gets, permission creates and multipart/mixed batches"""
+    def __init__(self, store, faults):
+        self.store = store; self.faults = faults
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        if hasattr(body, 'read'): body = body.read()
+        if isinstance(body, str): body = body.encode()
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+        if self.faults.hit("drive", len(body or b"")): return _http_error(self.faults.choice((403, 429, 503)))
+        return self._route(urllib.parse.urlsplit(uri), method, body or b"", headers)
+
+    def _route(self, url, method, body, headers):
+        path = url.path; query = dict(urllib.parse.parse_qsl(url.query))
+        if path == "/batch/drive/v3": return self._batch(body, headers)
+        if path == "/upload/drive/v3/files":
+            if query.get("upload_id"): return self._resume(query["upload_id"], body, headers)
+            if query.get("uploadType") == "resumable":
+                uid = uuid.uuid4().hex; self.store.uploads[uid] = (json.loads(body or b"{}"), headers.get("x-upload-content-type"), bytearray())
+                return _response(200, b"", location=f"https://www.googleapis.com/upload/drive/v3/files?uploadType=resumable&upload_id={uid}")
+            meta, media, mime = self._multipart(body, headers["content-type"])
+            return _response(200, self.store.metadata(self.store.put(meta.get("name", "file"), media, mime)))
+        parts = path.split("/") # ['', 'drive', 'v3', 'files', id, ...]
+        if len(parts) < 5 or parts[3] != "files": return _response(404, {"error": {"code": 404, "message": "Not found"}})
+        fid = parts[4]
+        f = self.store.get(fid)
+        if f is None: return _response(404, {"error": {"code": 404, "message": f"File not found: {fid}"}})
+        if len(parts) > 5 and parts[5] == "permissions": self.store.shared.add(fid); return _response(200, {"id": "anyoneWithLink"})
+        if query.get("alt") == "media":
+            data = f["content"]; first, last = 0, len(data) - 1
+            if "range" in headers:
+                lo, hi = headers["range"].split("=")[1].split("-"); first, last = int(lo), min(int(hi), len(data) - 1)
+            return _response(206, data[first:last + 1], content_range=f"bytes {first}-{last}/{len(data)}", content_type=f["mimeType"])
+        return _response(200, self.store.metadata(fid))
+
+    def _multipart(self, body, content_type):
+        boundary = content_type.split('boundary="')[1].split('"')[0].encode()
+        parts = [p for p in body.split(b"--" + boundary) if p.strip(b"\r\n-")]
+        def payload(part):
+            part = part.lstrip(b"\r\n"); sep = b"\r\n\r\n" if b"\r\n\r\n" in part else b"\n\n"
+            head, data = part.split(sep, 1)
+            mime = next((l.split(b":", 1)[1].strip().decode() for l in head.splitlines() if l.lower().startswith(b"content-type")), "")
+            return mime, data[:-2] if data.endswith(b"\r\n") else data[:-1] if data.endswith(b"\n") else data
+        (_, meta), (mime, media) = payload(parts[0]), payload(parts[1])
+        return json.loads(meta), media, mime
+
+    def _resume(self, uid, body, headers):
+        meta, mime, data = self.store.uploads[uid]
+        first, total = headers.get("content-range", "bytes */0")[6:].split("/")
+        if first != "*": data[int(first.split("-")[0]):] = body
+        if total != "*" and len(data) == int(total):
+            del self.store.uploads[uid]
+            return _response(200, self.store.metadata(self.store.put(meta.get("name", "file"), data, mime)))
+        return _response(308, b"", **({"range": f"bytes=0-{len(data) - 1}"} if data else {}))
+
+    def _batch(self, body, headers):
+        boundary = headers["content-type"].split('boundary="')[1].split('"')[0]
+        out = []
+        for part in body.decode().replace("\r\n", "\n").split("--" + boundary)[1:]:
+            if part.startswith("--"): break
+            head, request = part.strip("\n").split("\n\n", 1)
+            cid = next(l.split(":", 1)[1].strip() for l in head.splitlines() if l.lower().startswith("content-id"))
+            method, target = request.split("\n", 1)[0].split(" ")[:2]
+            # Items in one batch succeed or fail independently
+            resp, content = _http_error(self.faults.choice((403, 503))) if self.faults.roll("drive") \
+                else self._route(urllib.parse.urlsplit(target), method, b"", {})
+            out.append(f"--batch_bench\r\nContent-Type: application/http\r\nContent-ID: <response-{cid[1:-1]}>\r\n\r\n"
+                       f"HTTP/1.1 {resp.status} OK\r\nContent-Type: application/json\r\n\r\n{content.decode()}\r\n")
+        return _response(200, ("".join(out) + "--batch_bench--").encode(), content_type="multipart/mixed; boundary=batch_bench")
+
+class BenchPool:
+    """Mixin over app.GooglePool: serves the fake spreadsheet and builds Drive services on the fake transport,
+    so scheduling, reconnects and per-thread Drive handles are the app's own"""
+    def __init__(self, scheduler, spreadsheet, drive_http, discovery):
+        super().__init__(scheduler); self.fake_sheet = spreadsheet; self.drive_http = drive_http; self.discovery = discovery
+
+    def creds(self): return None
+    def client(self): return None
+    def spreadsheet(self, key=None): return self.fake_sheet
+
+    def drive(self):
+        if getattr(self._local, 'generation', None) != self._generation or getattr(self._local, 'drive', None) is None:
+            self._local.drive = build_from_document(self.discovery, http=self.drive_http); self._local.generation = self._generation
+        return self._local.drive
+
+# --- SMTP / TWILIO ---
+class FakeSMTP:
+    """smtplib.SMTP replacement: connect, STARTTLS and login each cost a round trip; sendmail fails at the smtp rate
+    with a dropped connection, which the outbox handles by reconnecting"""
+    faults = None; sent = []
+
+    def __init__(self, host="", port=0, timeout=None):
+        self.faults.hit("smtp"); self.open = True
+
+    def starttls(self): self.faults.hit("smtp")
+    def login(self, user, password): self.faults.hit("smtp")
+    def noop(self): self.faults.hit("smtp"); return (250, b"OK")
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        if not self.open: raise smtplib.SMTPServerDisconnected("Connection closed")
+        if self.faults.hit("smtp", len(msg)): self.open = False; raise smtplib.SMTPServerDisconnected("Injected disconnect")
+        self.sent.append((from_addr, tuple(to_addrs), len(msg))); return {}
+
+    def quit(self): self.open = False; return (221, b"Bye")
+
+class FakeTwilioAdapter(requests.adapters.BaseAdapter):
+    """Transport for https://api.twilio.com/ on the app's pooled requests.Session"""
+    def __init__(self, faults):
+        super().__init__(); self.faults = faults; self.sent = []
+
+    def send(self, request, **kwargs):
+        res = requests.Response(); res.request = request; res.url = request.url
+        if self.faults.hit("twilio"): res.status_code = 503; res._content = b'{"message": "Injected failure"}'
+        else:
+            fields = dict(urllib.parse.parse_qsl(request.body or "")); self.sent.append(fields)
+            res.status_code = 201; res._content = json.dumps({"sid": "SM" + uuid.uuid4().hex, "status": "queued"}).encode()
+        return res
+
+    def close(self): pass
+
+@contextlib.contextmanager
+def installed(app, tables, faults, secrets, drive_default=None, **constants):
+    """Points the app at the fakes for the duration: get_pool() returns a BenchPool over `tables`, smtplib.SMTP and
+    the Twilio endpoint are replaced, st.secrets is `secrets`, and app constants (cache paths, flush intervals)
+    are overridden from `constants`. Yields the Drive store."""
+    store = FakeDriveStore(drive_default); pool_cls = type("Pool", (BenchPool, app.GooglePool), {})
+    FakeSMTP.faults = faults; FakeSMTP.sent = []
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(mock.patch.object(app.st, "secrets", secrets))
+        for name, value in constants.items(): stack.enter_context(mock.patch.object(app, name, value))
+        pool = pool_cls(app.get_scheduler(), FakeSpreadsheet(tables, faults), FakeDriveHttp(store, faults), app.drive_discovery_doc())
+        stack.enter_context(mock.patch.object(app, "get_pool", lambda: pool))
+        stack.enter_context(mock.patch.object(app.smtplib, "SMTP", FakeSMTP))
+        twilio = FakeTwilioAdapter(faults); app.get_http_session().mount("https://api.twilio.com/", twilio)
+        store.pool = pool; store.twilio = twilio
+        yield store
@@ -0,0 +1,139 @@
+"""Benchmark scenarios. Each one is set up once against the fakes and returns a step() that runs one iteration of
+a real app flow and returns how many units (rows, photos, files, messages) it processed."""
+import time
+import itertools
+
+from . import datasets
+
+SCENARIOS = {} # name -> (setup(ctx, n) -> step, sized, unit)
+
+def scenario(name, sized=False, unit="ops"):
+    """`sized` scenarios run once per --rows size over a DebitNotes table of that many rows"""
+    def wrap(fn):
+        SCENARIOS[name] = (fn, sized, unit); return fn
+    return wrap
+
+def _dashboard(app, filters, date_range=(None, None)):
+    """What one Dashboard rerun computes: metrics, both breakdowns, the filter choices and one page of records"""
+    notes = app.get_notes_view(); cons = app.db_get("Contractors")
+    app.render.fmt_date(notes.latest); notes.sums('Category'); notes.sums('Contractor Name')
+    cons['Name'].tolist(); sorted(notes.values('SubmittedBy') - {""})
+    df_page, total = notes.page(filters, date_range[0], date_range[1], 0, 5)
+    for _, row in df_page.iterrows(): f"{app.render.fmt_date(row['Date'])} | {row['Contractor Name']} | {app.render.fmt_amount(row['Amount'])}"
+    return notes.count
+
+@scenario("db_get.cold", sized=True, unit="rows")
+def db_get_cold(ctx, n):
+    app = ctx.app
+    def step():
+        app.get_table_cache().invalidate("DebitNotes") # As after the TTL expires or another process writes
+        return len(app.db_get("DebitNotes"))
+    return step
+
+@scenario("db_get.warm", sized=True, unit="rows")
+def db_get_warm(ctx, n):
+    app = ctx.app; app.db_get("DebitNotes")
+    return lambda: len(app.db_get("DebitNotes"))
+
+@scenario("db_get.delta", sized=True, unit="rows")
+def db_get_delta(ctx, n):
+    """Another host appends a note and bumps its change stamp: the next read fetches only the new row"""
+    app = ctx.app; sheet = ctx.store.pool.fake_sheet; ids = itertools.count(); app.db_get("DebitNotes")
+    def step():
+        i = next(ids); stamps = sheet.sheets[app.REVISIONS_SHEET].data # The peer's writes go straight into the grid, untimed
+        sheet.sheets["DebitNotes"].data.append([f"peer{i}", "Contractor 001", "2025-04-01", "100", app.REASON_CATEGORIES[0], "", "", "", "", "engineer1"])
+        if i == 0: stamps.append(["DebitNotes", "bench-peer", "0", "0"]) # A new writer: the warm-up step reads in full
+        else: stamps[-1][2] = str(i)
+        app.get_revisions().poll(force=True) # Instead of waiting out REVISION_POLL_SECS
+        return len(app.db_get("DebitNotes"))
+    return step
+
+@scenario("dashboard.cold", sized=True, unit="rows")
+def dashboard_cold(ctx, n):
+    app = ctx.app
+    def step():
+        app.get_table_cache().invalidate()
+        return _dashboard(app, {})
+    return step
+
+@scenario("dashboard.warm", sized=True, unit="rows")
+def dashboard_warm(ctx, n):
+    app = ctx.app; _dashboard(app, {})
+    names = datasets.contractor_names()
+    choices = itertools.cycle([({}, (None, None)), ({"Contractor Name": names[0]}, (None, None)), ({"Category": app.REASON_CATEGORIES[1]}, ("2024-01-01", "2024-06-30")),
+                               ({"Contractor Name": names[7], "SubmittedBy": "engineer3"}, ("2023-03-01", "2025-12-31"))])
+    def step():
+        filters, date_range = next(choices) # The filter changes a user makes between reruns
+        return _dashboard(app, filters, date_range)
+    return step
+
+@scenario("statement", sized=True, unit="rows")
+def statement(ctx, n):
+    app = ctx.app
+    df = app.get_notes_view().select(contractor=datasets.contractor_names()[0]) # The busiest contractor
+    data = {"contractor": datasets.contractor_names()[0], "start": "2023-01-01", "end": "2025-12-31", "df": df, "generated_by": "bench"}
+    def step():
+        app.create_pdf("statement", data); return len(df)
+    return step
+
+def _compress(kind):
+    def setup(ctx, n):
+        photos = itertools.cycle(datasets.photo_set(kind, 4))
+        def step():
+            ctx.app.compress_image(next(photos)[1]); return 1
+        return step
+    return setup
+
+scenario("compress.phone", unit="photos")(_compress("phone"))
+scenario("compress.screenshot", unit="photos")(_compress("screenshot"))
+
+@scenario("receipt", unit="pdfs")
+def receipt(ctx, n):
+    app = ctx.app
+    images = app.compress_images([b for _, b in ctx.photos]); sig = app.compress_images([ctx.signature])[0]
+    data = {"contractor": "Contractor 001", "date": "2025-04-01", "amount": "12500", "category": app.REASON_CATEGORIES[0],
+            "reason": datasets.REASONS[0], "site": "Site 4", "images": images, "signature": sig, "generated_by": "engineer1"}
+    def step():
+        app.create_pdf("receipt", data); return 1
+    return step
+
+@scenario("merge.cold", unit="files")
+def merge_cold(ctx, n):
+    counter = itertools.count()
+    def step():
+        start = next(counter) * ctx.merge_files # Links never merged or downloaded before
+        return ctx.app.merge_pdfs([datasets.drive_link(f"pdf{i}") for i in range(start, start + ctx.merge_files)]) and ctx.merge_files
+    return step
+
+@scenario("merge.warm", unit="files")
+def merge_warm(ctx, n):
+    links = [datasets.drive_link(f"pdf{i}") for i in range(ctx.merge_files)]; ctx.app.merge_pdfs(links)
+    return lambda: ctx.app.merge_pdfs(links) and ctx.merge_files
+
+@scenario("submit", unit="notes")
+def submit(ctx, n):
+    """The whole Raise Debit Note job: compress, upload, PDF, share, register insert and notification enqueue"""
+    app = ctx.app
+    form = {"contractor": "Contractor 002", "date": "2025-04-01", "amount": "8400", "category": app.REASON_CATEGORIES[1],
+            "reason": datasets.REASONS[1], "site": "Site 9", "username": "engineer2"}
+    def step():
+        job = app.SubmitJob(form, ctx.photos, ctx.signature, "c2@example.com", "+919000000002")
+        job._main() # What the job thread runs
+        if job.state != "done": raise RuntimeError(job.error)
+        return 1
+    return step
+
+@scenario("outbox", unit="messages")
+def outbox(ctx, n):
+    """Enqueue a burst of emails (with a PDF attached) and WhatsApp messages and wait until the outbox drains"""
+    app = ctx.app; box = app.get_outbox(); pdf = app.create_pdf("receipt", {"contractor": "C", "date": "", "amount": "1", "category": "", "reason": "",
+                                                                          "site": "", "images": [], "signature": None, "generated_by": ""})
+    def step():
+        for i in range(ctx.burst):
+            app.notify_email([f"c{i}@example.com"], "Debit Note", "Debit Note Raised", pdf); app.notify_whatsapp(f"+91900000{i:04d}", "Debit Note raised")
+        deadline = time.monotonic() + ctx.drain_timeout # Injected failures wait out the outbox's real backoff
+        while box.conn.execute("SELECT COUNT(*) FROM outbox WHERE state = 'pending'").fetchone()[0]:
+            if time.monotonic() > deadline: raise TimeoutError("Outbox did not drain")
+            time.sleep(0.01)
+        return 2 * ctx.burst
+    return step
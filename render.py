@@ -0,0 +1,211 @@
+"""CPU-bound work shared by app.py and its process pool. Spawned workers pickle functions by module and name, and
+Streamlit re-executes app.py as a new __main__ on every rerun, so anything submitted to the pool lives here, in a
+module that is imported once per process."""
+import io
+import os
+import zlib
+import logging
+import functools
+import threading
+import itertools
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from PIL import Image, ImageOps
+from datetime import datetime
+
+CPU_WORKERS = max(1, (os.cpu_count() or 2) - 1) # Process pool for CPU-bound batches (photo compression, bulk statements)
+IMAGE_MAX_WIDTH = 1000
+COMPANY_NAME = "G P Group"
+LOGO_PATH = "logo.png"
+FPDF_VERSION = "1.7.2" # pdf_class overrides this PyFPDF's private page-output methods; fpdf2 is not compatible
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def cpu_pool():
+    """The process pool, started on first use. spawn, not fork: the server process is multi-threaded."""
+    global _pool
+    with _pool_lock:
+        if _pool is None: _pool = ProcessPoolExecutor(max_workers=CPU_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+# --- PHOTOS ---
+CompressedImage = namedtuple("CompressedImage", "data width height") # JPEG bytes plus final size, so nothing reopens it
+
+def compress_to_jpeg(img, max_width, quality):
+    if img.format == "JPEG":
+        # JPEG draft mode decodes at 1/2, 1/4 or 1/8 scale, still at least the target size, instead of the full 12-48 MP
+        rotated = img.getexif().get(0x0112, 1) in (5, 6, 7, 8) # EXIF orientation that swaps width and height
+        width = img.height if rotated else img.width
+        if width > max_width:
+            scale = max_width / float(width)
+            img.draft("RGB", (int(img.width * scale), int(img.height * scale)))
+    img = ImageOps.exif_transpose(img) # Orientation applied once, here
+    if img.mode != "RGB": img = img.convert("RGB") # Always RGB, so the PDF engine can embed it without parsing
+    if img.width > max_width:
+        ratio = max_width / float(img.width)
+        new_height = int(float(img.height) * ratio)
+        img = img.resize((max_width, new_height), Image.Resampling.LANCZOS)
+    
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=quality, optimize=True)
+    return CompressedImage(buf.getvalue(), img.width, img.height)
+
+def compress_worker(data, max_width=IMAGE_MAX_WIDTH, quality=65):
+    return compress_to_jpeg(Image.open(io.BytesIO(data)), max_width, quality)
+
+def compress_all(raw, max_width=IMAGE_MAX_WIDTH, quality=65):
+    """CompressedImage per photo (bytes), across the process pool for batches; in-thread if the pool is unavailable"""
+    if len(raw) > 1 and CPU_WORKERS > 1:
+        try: return list(cpu_pool().map(compress_worker, raw, itertools.repeat(max_width), itertools.repeat(quality)))
+        except Exception as e: logging.warning(f"Image process pool unavailable, compressing in-thread: {e}")
+    return [compress_worker(b, max_width, quality) for b in raw]
+
+# --- PDFS ---
+def fmt_date(value):
+    return value.strftime('%Y-%m-%d') if isinstance(value, (pd.Timestamp, datetime)) and not pd.isna(value) else ("" if pd.isna(value) else str(value))
+
+def fmt_amount(value):
+    return "-" if pd.isna(value) else ("%.2f" % value).rstrip('0').rstrip('.')
+
+class _PdfBuffer:
+    """Stand-in for fpdf's str output buffer: += and len() cost O(1) instead of copying the whole document on
+    every line, and with a `sink` (binary file) the bytes go straight out instead of being held at all"""
+    def __init__(self, sink=None):
+        self.sink = sink; self.parts = []; self.size = 0
+    def __iadd__(self, s):
+        if self.sink: self.sink.write(s.encode('latin-1'))
+        else: self.parts.append(s)
+        self.size += len(s); return self
+    def __len__(self):
+        return self.size
+    def getvalue(self):
+        return "".join(self.parts).encode('latin-1')
+
+@functools.lru_cache(maxsize=None)
+def pdf_class():
+    import fpdf
+    if fpdf.FPDF_VERSION != FPDF_VERSION: raise ImportError(f"PDF output needs PyFPDF {FPDF_VERSION} (pip install fpdf=={FPDF_VERSION}), found {fpdf.FPDF_VERSION}")
+    from fpdf import FPDF
+    from fpdf.php import sprintf
+    class PDF(FPDF):
+        """PyFPDF that writes each page out as soon as it is finished, instead of keeping every page's content until
+        output(); statements with thousands of rows are produced page by page in flat memory"""
+        def __init__(self, sink=None):
+            super().__init__(); self.buffer = _PdfBuffer(sink)
+        def header(self):
+            logo = _logo_info()
+            if logo: self.embed(LOGO_PATH, logo, 10, 8, w=30)
+            self.set_font('Helvetica', 'B', 20); self.set_text_color(50, 50, 50); self.cell(0, 15, COMPANY_NAME, 0, 1, 'C'); self.ln(10)
+        def footer(self):
+            self.set_y(-15); self.set_font('Helvetica', 'I', 8); self.set_text_color(150); self.cell(0, 10, f'Generated by {self.generated_by}', 0, 0, 'C')
+        def embed(self, name, info, x, y, w=0, h=0):
+            """image() from already-parsed image info: registered once per document, never read or parsed again"""
+            if name not in self.images: self.images[name] = dict(info, i=len(self.images) + 1) # Copy: output() strips 'data'
+            self.image(name, x, y, w, h)
+        def _putheader(self):
+            if not len(self.buffer): super()._putheader()
+        def _endpage(self):
+            super()._endpage(); self._putheader()
+            # Same objects _putpages would write at the end (page n is object 1+2n, its content 2+2n), written now
+            n = self.page; self._newobj(); self._out('<</Type /Page'); self._out('/Parent 1 0 R')
+            if n in self.orientation_changes: self._out(sprintf('/MediaBox [0 0 %.2f %.2f]', *reversed(self._page_size())))
+            self._out('/Resources 2 0 R')
+            if self.pdf_version > '1.3': self._out('/Group <</Type /Group /S /Transparency /CS /DeviceRGB>>')
+            self._out(f'/Contents {self.n + 1} 0 R>>'); self._out('endobj')
+            content = self.pages[n].encode('latin-1'); self.pages[n] = "" # Released as soon as it is written
+            if self.compress: content = zlib.compress(content)
+            self._newobj(); self._out(('<</Filter /FlateDecode ' if self.compress else '<<') + f'/Length {len(content)}>>')
+            self._putstream(content); self._out('endobj')
+        def _page_size(self):
+            return (self.fw_pt, self.fh_pt) if self.def_orientation == 'P' else (self.fh_pt, self.fw_pt)
+        def _putpages(self):
+            w_pt, h_pt = self._page_size()
+            self.offsets[1] = len(self.buffer); self._out('1 0 obj'); self._out('<</Type /Pages')
+            self._out('/Kids [' + ''.join(f'{3 + 2 * i} 0 R ' for i in range(self.page)) + ']'); self._out(f'/Count {self.page}')
+            self._out(sprintf('/MediaBox [0 0 %.2f %.2f]', w_pt, h_pt)); self._out('>>'); self._out('endobj')
+    return PDF
+
+@functools.lru_cache(maxsize=None)
+def _logo_info():
+    """The logo parsed once per process (fpdf would re-read and re-parse it for every document); None if missing"""
+    if not os.path.exists(LOGO_PATH): return None
+    try:
+        from fpdf import FPDF
+        probe = FPDF(); probe.add_page(); probe.image(LOGO_PATH, 0, 0)
+        return probe.images[LOGO_PATH]
+    except Exception as e:
+        logging.error(f"Logo unusable: {e}"); return None
+
+def _jpeg_info(img):
+    # CompressedImage is always an RGB baseline JPEG of known size, so fpdf needs neither a file nor a parse
+    return {'w': img.width, 'h': img.height, 'cs': 'DeviceRGB', 'bpc': 8, 'f': 'DCTDecode', 'data': img.data}
+
+def build_pdf(type, data, out=None):
+    """Renders a receipt or statement and returns the closed PDF: its bytes are in pdf.buffer, or were streamed page
+    by page into `out` (a binary file). Receipt `images` and `signature` are CompressedImage, embedded from memory."""
+    pdf = pdf_class()(out); pdf.generated_by = data.get('generated_by') or "System"
+    pdf.add_page(); pdf.set_auto_page_break(auto=True, margin=15)
+    pdf.set_font("Helvetica", "B", 16); pdf.set_fill_color(240, 240, 240)
+    title = "DEBIT NOTE" if type == "receipt" else "STATEMENT OF ACCOUNT"
+    pdf.cell(0, 12, title, 0, 1, 'C', fill=True); pdf.ln(10)
+    (_render_receipt if type == "receipt" else _render_statement)(pdf, data)
+    pdf.close(); return pdf
+
+def _render_receipt(pdf, data):
+    pdf.set_font("Helvetica", "", 12)
+    fields = [("Contractor", data['contractor']), ("Date", str(data['date'])), ("Site Location", data['site']), ("Category", data['category']), ("Amount", f"INR {data['amount']}")]
+    for label, value in fields:
+        pdf.set_font("Helvetica", "B", 12); pdf.cell(50, 8, label, "B"); pdf.set_font("Helvetica", "", 12); pdf.cell(140, 8, str(value), "B", 1)
+    pdf.ln(8); pdf.set_font("Helvetica", "B", 12); pdf.cell(0, 10, "Description / Reason:", 0, 1); pdf.set_font("Helvetica", "", 11); pdf.multi_cell(0, 6, data['reason']); pdf.ln(5)
+    
+    if data.get('images'):
+        pdf.set_font("Helvetica", "B", 12); pdf.cell(0, 10, "Evidence:", 0, 1)
+        images = [img for img in data['images'] if img]
+        box_w, box_h = 90, 75
+        for i in range(0, len(images), 2):
+            if 270 - pdf.get_y() < 85: pdf.add_page()
+            y_pos = pdf.get_y()
+            for j, x in ((i, 10), (i + 1, 105)):
+                if j >= len(images): break
+                fit = {'h': box_h} if images[j].height / images[j].width > box_h / box_w else {'w': box_w} # Size known from compression
+                pdf.embed(f"evidence_{j}", _jpeg_info(images[j]), x, y_pos, **fit)
+            pdf.ln(80)
+    
+    if data.get('signature'):
+        if 280 - pdf.get_y() < 40: pdf.add_page()
+        pdf.ln(5); pdf.set_font("Helvetica", "B", 10); sig_y = pdf.get_y(); pdf.set_x(130); pdf.cell(60, 5, "Authorized Signature:", 0, 1, 'C')
+        try: pdf.embed("signature", _jpeg_info(data['signature']), 145, sig_y+6, w=30)
+        except Exception as e: logging.error(f"Signature not embedded: {e}")
+        pdf.set_y(sig_y+30); pdf.set_x(130); pdf.cell(60, 5, f"Engineer: {pdf.generated_by}", 0, 1, 'C')
+
+def _statement_columns(df):
+    """Printed Date / Category / Reason / Amount strings, formatted column-wise, and the total of valid amounts"""
+    dates = df['Date']
+    dates = dates.dt.strftime('%Y-%m-%d').fillna("") if pd.api.types.is_datetime64_any_dtype(dates) else dates.map(fmt_date)
+    categories = df['Category'].astype(str).str[:20] if 'Category' in df.columns else pd.Series("-", index=df.index)
+    amounts = pd.to_numeric(df['Amount'], errors='coerce')
+    rows = zip(dates.tolist(), categories.tolist(), df['Reason'].astype(str).str[:50].tolist(), amounts.map(fmt_amount).tolist())
+    return rows, float(amounts.sum())
+
+def _render_statement(pdf, data):
+    pdf.set_font("Helvetica", "", 12); pdf.cell(0, 8, f"Contractor: {data['contractor']}", 0, 1)
+    pdf.cell(0, 8, f"Period: {data['start']} to {data['end']}", 0, 1); pdf.ln(5)
+    def table_header():
+        pdf.set_font("Helvetica", "B", 10); pdf.set_fill_color(50, 50, 50); pdf.set_text_color(255)
+        for h, w in zip(["Date", "Category", "Reason", "Amount"], [30, 40, 90, 30]): pdf.cell(w, 10, h, 1, 0, 'C', True)
+        pdf.ln(); pdf.set_text_color(0); pdf.set_font("Helvetica", "", 9)
+    table_header()
+    rows, total = _statement_columns(data['df'])
+    for date, category, reason, amount in rows:
+        if pdf.get_y() + 10 > pdf.page_break_trigger: pdf.add_page(); table_header() # Header repeated on every page
+        pdf.cell(30, 10, date, 1); pdf.cell(40, 10, category, 1); pdf.cell(90, 10, reason, 1); pdf.cell(30, 10, amount, 1, 1)
+    pdf.ln(5); pdf.set_font("Helvetica", "B", 12)
+    pdf.cell(160, 10, "Total Deductions:", 0, 0, 'R'); pdf.cell(30, 10, f"INR {total}", 0, 1, 'L')
+
+def statement_worker(contractor, df, start, end, generated_by):
+    """One contractor's statement as PDF bytes (a process-pool entry point)"""
+    return build_pdf("statement", {"contractor": contractor, "start": start, "end": end, "df": df, "generated_by": generated_by}).buffer.getvalue()
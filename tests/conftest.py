@@ -0,0 +1,66 @@
+"""Shared fixtures: the app wired to bench.fakes with no latency and no injected failures, and fresh process-wide
+singletons (st.cache_resource) for every test"""
+import os
+import sys
+import logging
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import app
+from bench import datasets
+from bench.fakes import Faults, installed, _api_error
+
+QUOTAS = {k: 10 ** 6 for k in ("sheets_reads_per_min", "sheets_writes_per_min", "drive_calls_per_min", "emails_per_min", "whatsapp_per_min")}
+
+def note(note_id, date, contractor="Contractor 001", amount="100", photos=""):
+    """One DebitNotes row as the Raise Debit Note job inserts it"""
+    return [note_id, contractor, date, amount, "Other", "Reason", "Site 1", photos, "", "engineer1"]
+
+def flaky(monkeypatch, ws, name, code=503, land=False, times=1):
+    """Makes the first `times` `name` calls on worksheet `ws` raise an APIError with `code`, after applying them
+    when `land`; returns the list of calls made on `ws`"""
+    cls = type(ws); real = getattr(cls, name); calls = []
+    def _call(self, *args, **kwargs):
+        if self is not ws: return real(self, *args, **kwargs)
+        calls.append(args)
+        if len(calls) > times: return real(self, *args, **kwargs)
+        if land: real(self, *args, **kwargs)
+        raise _api_error(code)
+    monkeypatch.setattr(cls, name, _call)
+    return calls
+
+def insert(table, row):
+    """db_insert, flushed now; returns the sheet row"""
+    fut = app.db_insert(table, row); app.get_writer().flush(); return fut.result(timeout=10)
+
+def _reset():
+    app.st.cache_resource.clear() # Every singleton is rebuilt against the current fakes
+
+@pytest.fixture
+def make_env(tmp_path):
+    """make_env(notes=20, mirror=False, partition_by=None, revisions=True, **constants) installs the fakes and
+    returns the Drive store; store.pool.fake_sheet.sheets holds the worksheets"""
+    stack = []
+    def _make(notes=20, mirror=False, partition_by=None, revisions=True, **constants):
+        H = app.TABLES
+        tables = {"DebitNotes": datasets.debit_notes(notes, H["DebitNotes"], app.REASON_CATEGORIES) if notes else [H["DebitNotes"]],
+                  "Contractors": datasets.contractors(H["Contractors"]), "Users": datasets.users(H["Users"], app.hash_password("x")),
+                  "Notifications": [H["Notifications"]]}
+        if revisions: tables[app.REVISIONS_SHEET] = [app.Revisions.HEADERS]
+        secrets = {"drive_settings": {"folder_id": "f", "sheet_url": "u"}, "quota_settings": QUOTAS,
+                   "mirror_settings": {"enabled": mirror, "path": str(tmp_path / "mirror.db")}, "db_settings": {"partition_by": partition_by}}
+        faults = Faults({k: 0 for k in ("sheets", "drive", "smtp", "twilio")})
+        constants = dict({"THUMB_CACHE_DIR": str(tmp_path / "thumbs"), "PDF_CACHE_DIR": str(tmp_path / "pdfs"),
+                          "OUTBOX_DB_PATH": str(tmp_path / "outbox.db"), "WRITE_FLUSH_SECS": 60, # Tests flush explicitly
+                          "API_BACKOFF_BASE": 0.001}, **constants)
+        _reset(); ctx = installed(app, tables, faults, secrets, **constants); store = ctx.__enter__(); stack.append(ctx)
+        store.faults = faults; app.ensure_schema(app.SCHEMA_VERSION)
+        return store
+    logging.disable(logging.CRITICAL) # Tests that inject failures make the app log errors
+    yield _make
+    logging.disable(logging.NOTSET)
+    for ctx in reversed(stack):
+        app.get_writer().close(); _reset(); ctx.__exit__(None, None, None)
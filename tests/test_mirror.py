@@ -0,0 +1,44 @@
+import threading
+import time
+
+import app
+from conftest import note
+
+def _mirrored(m, table="DebitNotes"):
+    return [list(r) for r in m.conn.execute(f'SELECT _row, "ID" FROM "{table}" ORDER BY _row')]
+
+def _sheet(store, table="DebitNotes"):
+    return [[i + 2, r[0]] for i, r in enumerate(store.pool.fake_sheet.sheets[table].data[1:])]
+
+def test_incremental_sync_fetches_only_new_rows(make_env):
+    store = make_env(notes=5, mirror=True); m = app.get_mirror(); m.full_sync("DebitNotes")
+    dn = store.pool.fake_sheet.sheets["DebitNotes"]; dn.append_rows([[str(c) for c in note(900 + i, "2025-01-02")] for i in range(3)])
+    m.incremental_sync("DebitNotes")
+    assert _mirrored(m) == _sheet(store) and m._state("DebitNotes")[:2] == (9, "902")
+
+def test_concurrent_incremental_syncs_insert_each_row_once(make_env, monkeypatch):
+    store = make_env(notes=5, mirror=True); m = app.get_mirror(); m.full_sync("DebitNotes")
+    dn = store.pool.fake_sheet.sheets["DebitNotes"]; get_values = type(dn).get_values
+    monkeypatch.setattr(type(dn), "get_values", lambda self, *a: (get_values(self, *a), time.sleep(0.05))[0]) # Widen the race
+    for rnd in range(3):
+        dn.append_rows([[str(c) for c in note(f"{rnd}{i}", "2025-01-02")] for i in range(3)])
+        threads = [threading.Thread(target=m.incremental_sync, args=("DebitNotes",)) for _ in range(4)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+    assert _mirrored(m) == _sheet(store)
+
+def test_apply_insert_after_sync_leaves_one_row(make_env):
+    store = make_env(notes=5, mirror=True); m = app.get_mirror(); m.full_sync("DebitNotes")
+    row = note(999, "2025-01-02"); store.pool.fake_sheet.sheets["DebitNotes"].append_row([str(c) for c in row]) # The write landed...
+    m.incremental_sync("DebitNotes") # ...a reader mirrored it...
+    m.apply_insert("DebitNotes", row, 7) # ...before the write's own callback ran
+    assert _mirrored(m) == _sheet(store) and [r for r in _mirrored(m) if r[1] == "999"] == [[7, "999"]]
+
+def test_apply_delete_shifts_rows_and_keeps_the_sync_anchor(make_env):
+    store = make_env(notes=5, mirror=True); m = app.get_mirror(); m.full_sync("DebitNotes")
+    dn = store.pool.fake_sheet.sheets["DebitNotes"]; victim = dn.data[3][0]
+    dn.delete_rows(4); m.apply_delete("DebitNotes", "ID", victim)
+    assert _mirrored(m) == _sheet(store)
+    dn.append_row([str(c) for c in note(901, "2025-01-02")]); full_at = m._state("DebitNotes")[2]
+    m.incremental_sync("DebitNotes")
+    assert _mirrored(m) == _sheet(store) and m._state("DebitNotes")[2] == full_at # No fallback to a full sync
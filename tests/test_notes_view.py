@@ -0,0 +1,48 @@
+import threading
+
+import pandas as pd
+
+import app
+from bench import datasets
+from conftest import note
+
+def _view(n=200):
+    rows = datasets.debit_notes(n, app.TABLES["DebitNotes"], app.REASON_CATEGORIES)
+    return app.NotesView(pd.DataFrame(rows[1:], columns=rows[0]))
+
+def _consistent(state):
+    amounts = state.frame['Amount'].fillna(0.0)
+    by_contractor = amounts.groupby(state.frame['Contractor Name'], observed=True).sum()
+    return (abs(state.total - amounts.sum()) < 1e-6 and state.count == len(state.frame)
+            and all(abs(state.sums_by['Contractor Name'][k][0] - v) < 1e-6 for k, v in by_contractor.items()))
+
+def test_insert_and_delete_match_a_rebuild():
+    view = _view()
+    view.append(note(900, "2026-01-02", contractor="New Contractor", amount="123.5")); view.drop("ID", "1600000007")
+    rebuilt = app.NotesView(view.frame.astype({"Amount": str, "Date": str, "Category": str, "Contractor Name": str}))
+    assert round(view.total, 2) == round(rebuilt.total, 2) and view.count == rebuilt.count and view.latest == pd.Timestamp("2026-01-02")
+    assert view.sums('Contractor Name').round(2).sort_index().equals(rebuilt.sums('Contractor Name').round(2).sort_index())
+    assert list(view.page({"Contractor Name": "New Contractor"})[0]['ID']) == ["900"]
+
+def test_a_taken_state_is_never_changed_by_later_writes():
+    view = _view(); state = view.state; frame, total = state.frame, state.total
+    view.append(note(900, "2026-01-02", contractor="New Contractor")); view.drop("ID", "1600000003")
+    assert state.frame is frame and len(frame) == 200 and state.total == total and "New Contractor" not in state.sums_by['Contractor Name']
+    assert view.count == 200 and _consistent(view.state)
+
+def test_readers_never_see_a_half_applied_write():
+    view = _view(); stop = threading.Event(); bad = []
+    def write():
+        for i in range(150):
+            view.append(note(900 + i, "2025-06-01", contractor=f"Contractor {i % 70:03d}", amount=str(i)))
+            if i % 3 == 0: view.drop("ID", str(900 + i))
+        stop.set()
+    def read():
+        while not stop.is_set():
+            state = view.state
+            if not _consistent(state): bad.append(state)
+            state.page({"Contractor Name": "Contractor 001"}, offset=0, limit=5)
+    threads = [threading.Thread(target=write)] + [threading.Thread(target=read) for _ in range(3)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert not bad and view.count == 200 + 150 - 50
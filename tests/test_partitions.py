@@ -0,0 +1,39 @@
+import pandas as pd
+
+import app
+from conftest import insert, note
+
+def _partitioned(make_env, **kwargs):
+    store = make_env(notes=0, partition_by="month", **kwargs); app.ensure_partitions(app.SCHEMA_VERSION)
+    return store
+
+def test_page_across_partitions_has_unique_labels(make_env):
+    _partitioned(make_env)
+    insert("DebitNotes", note(1, "2025-01-10", photos="https://drive.google.com/uc?id=JANPHOTO"))
+    insert("DebitNotes", note(2, "2025-02-10", photos="https://drive.google.com/uc?id=FEBPHOTO"))
+    page, total = app.get_notes_view().page({}, None, None, 0, 5)
+    assert total == 2 and page.index.is_unique
+    assert dict(zip(page['ID'].astype(str), page['Image Links'])) == {"1": "https://drive.google.com/uc?id=JANPHOTO", "2": "https://drive.google.com/uc?id=FEBPHOTO"}
+
+def test_insert_into_new_partition_is_visible_before_flush(make_env):
+    store = _partitioned(make_env)
+    app.db_insert("DebitNotes", note(3, "2019-06-03"))
+    assert len(store.pool.fake_sheet.sheets["DebitNotes_2019_06"].data) == 1 # Header only: still queued
+    view = app.get_notes_view("2019-06-01", "2019-06-30")
+    assert [p[0] for p in view.parts] == ["DebitNotes_2019_06"] and view.count == 1
+
+def test_range_reads_skip_other_partitions(make_env):
+    _partitioned(make_env)
+    for i, day in enumerate(["2024-11-05", "2024-12-05", "2025-01-05"]): insert("DebitNotes", note(10 + i, day))
+    view = app.get_notes_view("2024-12-01", "2024-12-31")
+    assert [p[0] for p in view.parts] == ["DebitNotes_2024_12"]
+    assert list(view.select(start=pd.Timestamp("2024-12-01"), end=pd.Timestamp("2024-12-31"))['ID']) == ["11"]
+
+def test_manifest_row_counts_are_written_to_the_named_row(make_env):
+    store = _partitioned(make_env, revisions=False); manifest = store.pool.fake_sheet.sheets[app.PARTITION_MANIFEST] # TTL caching: the manifest is not re-read
+    insert("DebitNotes", note(4, "2019-06-03")); app.db_get(app.PARTITION_MANIFEST)
+    manifest.data.insert(1, ["DebitNotes_2018_01", "DebitNotes", "2018-01-01", "2018-01-31", "", "7"]) # Another host's row shifts ours down
+    insert("DebitNotes", note(5, "2019-06-04"))
+    app.get_notes_view("2019-06-01", "2019-06-30"); app.get_writer().flush()
+    rows = {r[0]: r[5] for r in manifest.data[1:]}
+    assert rows["DebitNotes_2019_06"] == "2" and rows["DebitNotes_2018_01"] == "7"
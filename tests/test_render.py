@@ -0,0 +1,40 @@
+import io
+
+import fpdf
+import pandas as pd
+import pytest
+from PIL import Image
+from pypdf import PdfReader
+
+import render
+
+def _statement(rows):
+    df = pd.DataFrame({"Date": pd.date_range("2025-01-01", periods=rows, freq="h"), "Category": "Other",
+                       "Reason": [f"Reason {i}" for i in range(rows)], "Amount": [float(i) for i in range(rows)]})
+    return {"contractor": "Contractor 001", "start": "2025-01-01", "end": "2025-03-31", "df": df, "generated_by": "tester"}
+
+def test_statement_pages_are_written_as_they_finish():
+    pdf = render.build_pdf("statement", _statement(400))
+    reader = PdfReader(io.BytesIO(pdf.buffer.getvalue()))
+    assert pdf.page > 1 and len(reader.pages) == pdf.page
+    assert all(content == "" for content in pdf.pages.values()) # Released once written
+    text = "".join(page.extract_text() for page in reader.pages)
+    assert "Reason 0" in text and "Reason 399" in text and "Generated by tester" in text
+
+def test_streamed_output_matches_in_memory_output(tmp_path):
+    with open(tmp_path / "s.pdf", "wb") as out: render.build_pdf("statement", _statement(150), out)
+    assert (tmp_path / "s.pdf").read_bytes() == render.build_pdf("statement", _statement(150)).buffer.getvalue()
+
+def test_receipt_embeds_compressed_photos():
+    img = Image.new("RGB", (1600, 1200), (120, 60, 30)); photo = render.compress_to_jpeg(img, render.IMAGE_MAX_WIDTH, 65)
+    data = {"contractor": "Contractor 001", "date": "2025-01-02", "amount": "100", "category": "Other", "reason": "Reason",
+            "site": "Site 1", "images": [photo, photo], "signature": None, "generated_by": "tester"}
+    reader = PdfReader(io.BytesIO(render.build_pdf("receipt", data).buffer.getvalue()))
+    images = [im for page in reader.pages for im in page.images]
+    assert len(images) >= 2 and images[0].image.size == (photo.width, photo.height)
+
+def test_other_fpdf_versions_are_refused(monkeypatch):
+    monkeypatch.setattr(fpdf, "FPDF_VERSION", "2.7.8"); render.pdf_class.cache_clear()
+    try:
+        with pytest.raises(ImportError, match="fpdf==1.7.2"): render.pdf_class()
+    finally: monkeypatch.undo(); render.pdf_class.cache_clear()
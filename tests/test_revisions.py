@@ -0,0 +1,67 @@
+import socket
+import time
+
+import app
+from conftest import flaky, insert, note
+
+ME = socket.gethostname()
+
+def _stamp(age_secs=0):
+    return f"{time.time_ns() - int(age_secs * 1e9):x}"
+
+def _env(make_env, rows=()):
+    store = make_env(notes=5, REVISION_POLL_SECS=0); sheets = store.pool.fake_sheet.sheets
+    sheets[app.REVISIONS_SHEET].data.extend([list(r) for r in rows])
+    return store, sheets
+
+def _reads(monkeypatch, ws):
+    return flaky(monkeypatch, ws, "get_all_values", times=0), flaky(monkeypatch, ws, "get_values", times=0)
+
+def test_unchanged_stamps_serve_the_cached_frame(make_env, monkeypatch):
+    store, sheets = _env(make_env); app.db_get("DebitNotes")
+    full, delta = _reads(monkeypatch, sheets["DebitNotes"])
+    assert len(app.db_get("DebitNotes")) == 5 and not full and not delta
+
+def test_appends_by_another_host_are_fetched_as_a_delta(make_env, monkeypatch):
+    stamp = _stamp(); store, sheets = _env(make_env, [["DebitNotes", "other", stamp, stamp]]); app.db_get("DebitNotes")
+    sheets["DebitNotes"].append_rows([[str(c) for c in note(900 + i, "2025-01-02")] for i in range(2)])
+    sheets[app.REVISIONS_SHEET].data[1][2] = _stamp() # Revision only: appends
+    full, delta = _reads(monkeypatch, sheets["DebitNotes"])
+    df = app.db_get("DebitNotes")
+    assert list(df['ID'][-2:]) == ["900", "901"] and not full and len(delta) == 1
+
+def test_a_layout_bump_reloads_in_full(make_env, monkeypatch):
+    stamp = _stamp(); store, sheets = _env(make_env, [["DebitNotes", "other", stamp, stamp]]); app.db_get("DebitNotes")
+    gone = sheets["DebitNotes"].data[2][0]; sheets["DebitNotes"].delete_rows(3)
+    sheets[app.REVISIONS_SHEET].data[1][2:4] = [_stamp()] * 2
+    full, delta = _reads(monkeypatch, sheets["DebitNotes"])
+    assert gone not in set(app.db_get("DebitNotes")['ID']) and len(full) == 1
+
+def test_own_writes_bump_one_row_per_table(make_env):
+    store, sheets = _env(make_env)
+    insert("DebitNotes", note(900, "2025-01-02")); insert("DebitNotes", note(901, "2025-01-02"))
+    assert [r[:2] for r in sheets[app.REVISIONS_SHEET].data[1:]] == [["DebitNotes", ME]]
+    assert len(app.db_get("DebitNotes")) == 7
+
+def test_a_failed_bump_is_retried_on_the_next_flush(make_env, monkeypatch):
+    store, sheets = _env(make_env); revisions = sheets[app.REVISIONS_SHEET]
+    flaky(monkeypatch, revisions, "append_rows")
+    insert("DebitNotes", note(900, "2025-01-02"))
+    assert len(revisions.data) == 1 and app.get_revisions().unsent == {"DebitNotes": False}
+    app.get_writer().flush() # Nothing queued: just the carried bump
+    assert [r[:2] for r in revisions.data[1:]] == [["DebitNotes", ME]] and not app.get_revisions().unsent
+
+def test_stale_writer_rows_are_pruned(make_env):
+    old, fresh = _stamp(app.REVISION_PRUNE_SECS + 60), _stamp()
+    store, sheets = _env(make_env, [["DebitNotes", "gone-1", old, old], ["Users", "alive", fresh, fresh], ["DebitNotes", "gone-2", old, old]])
+    insert("DebitNotes", note(900, "2025-01-02"))
+    assert [r[:2] for r in sheets[app.REVISIONS_SHEET].data[1:]] == [["Users", "alive"], ["DebitNotes", ME]]
+    assert app.get_revisions().poll(force=True)["DebitNotes"].keys() == {ME}
+
+def test_a_bump_onto_a_row_shifted_by_a_prune_still_counts(make_env):
+    stamp = _stamp()
+    store, sheets = _env(make_env, [["Users", "gone", stamp, stamp], ["DebitNotes", ME, stamp, stamp], ["Users", "alive", stamp, stamp]])
+    revisions = app.get_revisions(); revisions.poll(force=True); revisions._next_prune = time.time() + 3600
+    del sheets[app.REVISIONS_SHEET].data[1] # Another host pruned the row above ours after we polled
+    revisions.bump({"DebitNotes": True})
+    assert revisions.poll(force=True)["DebitNotes"][ME][0] > stamp
@@ -0,0 +1,41 @@
+import app
+from conftest import flaky
+
+def _reads(monkeypatch, ws):
+    return flaky(monkeypatch, ws, "col_values", times=0)
+
+def test_locate_builds_once_and_confirms_with_a_cell_read(make_env, monkeypatch):
+    store = make_env(notes=10); ws = store.pool.fake_sheet.sheets["DebitNotes"]; index = app.get_row_index()
+    builds = _reads(monkeypatch, ws)
+    assert index.locate("DebitNotes", "ID", ws.data[4][0]) == 5 and index.locate("DebitNotes", "ID", ws.data[7][0]) == 8
+    assert len(builds) == 1
+
+def test_stale_index_is_rebuilt(make_env, monkeypatch):
+    store = make_env(notes=10); ws = store.pool.fake_sheet.sheets["DebitNotes"]; index = app.get_row_index()
+    key = ws.data[6][0]; index.locate("DebitNotes", "ID", key)
+    ws.delete_rows(3) # Another host deleted a row above it
+    builds = _reads(monkeypatch, ws)
+    assert index.locate("DebitNotes", "ID", key) == 6 and len(builds) == 1
+
+def test_delete_shifts_later_rows_without_a_rebuild(make_env, monkeypatch):
+    store = make_env(notes=10); ws = store.pool.fake_sheet.sheets["DebitNotes"]; index = app.get_row_index()
+    victim, later, earlier = ws.data[3][0], ws.data[8][0], ws.data[2][0]
+    index.locate("DebitNotes", "ID", victim)
+    builds = _reads(monkeypatch, ws)
+    assert app.db_delete_row("DebitNotes", "ID", victim)
+    assert index.locate("DebitNotes", "ID", later) == 8 and index.locate("DebitNotes", "ID", earlier) == 3 and len(builds) == 0
+    assert victim not in [r[0] for r in ws.data]
+
+def test_delete_that_failed_after_landing_keeps_the_next_row(make_env, monkeypatch):
+    store = make_env(notes=10); ws = store.pool.fake_sheet.sheets["DebitNotes"]
+    victim, following = ws.data[3][0], ws.data[4][0]
+    flaky(monkeypatch, ws, "delete_rows", land=True)
+    assert app.db_delete_row("DebitNotes", "ID", victim)
+    ids = [r[0] for r in ws.data]
+    assert victim not in ids and following in ids and len(ids) == 10
+
+def test_update_user_edits_the_located_row(make_env):
+    store = make_env(notes=0); ws = store.pool.fake_sheet.sheets["Users"]
+    assert app.db_update_user("engineer3", "engineer3b", None, "https://example.com/pic.jpg")
+    assert ws.data[3][0] == "engineer3b" and ws.data[3][3] == "https://example.com/pic.jpg"
+    assert app.get_row_index().locate("Users", "Username", "engineer3b") == 4
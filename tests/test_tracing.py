@@ -0,0 +1,9 @@
+import app
+
+def test_pool_work_notes_reach_the_submitting_span(make_env):
+    make_env(notes=0); metrics = app.get_metrics(); metrics.reset()
+    @app.traced("outer")
+    def outer():
+        return list(app.get_download_pool().map(app.in_context(lambda n: app.trace_note(**{f"part{n}": n})), range(4)))
+    outer()
+    assert metrics.ops["outer"]["totals"] == {"part0": 0, "part1": 1, "part2": 2, "part3": 3}
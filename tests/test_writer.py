@@ -0,0 +1,43 @@
+import gspread
+
+import app
+from conftest import flaky, note
+
+def _ids(store, table="DebitNotes"):
+    return [r[0] for r in store.pool.fake_sheet.sheets[table].data[1:]]
+
+def test_appends_go_out_as_one_call_and_resolve_to_their_rows(make_env, monkeypatch):
+    store = make_env(notes=3); ws = store.pool.fake_sheet.sheets["DebitNotes"]
+    calls = flaky(monkeypatch, ws, "append_rows", times=0)
+    futs = [app.db_insert("DebitNotes", note(900 + i, "2025-01-02")) for i in range(3)]
+    app.get_writer().flush()
+    assert [f.result(timeout=5) for f in futs] == [5, 6, 7] and len(calls) == 1
+
+def test_append_that_failed_after_landing_is_not_repeated(make_env, monkeypatch):
+    store = make_env(notes=3); ws = store.pool.fake_sheet.sheets["DebitNotes"]
+    calls = flaky(monkeypatch, ws, "append_rows", land=True)
+    fut = app.db_insert("DebitNotes", note(999, "2025-01-02")); writer = app.get_writer()
+    writer.flush(); assert not fut.done() # Ambiguous: requeued, not replayed by the scheduler
+    writer.flush()
+    assert fut.result(timeout=5) == 5 and _ids(store).count("999") == 1 and len(calls) == 1
+
+def test_throttled_append_is_retried(make_env, monkeypatch):
+    store = make_env(notes=3); ws = store.pool.fake_sheet.sheets["DebitNotes"]
+    calls = flaky(monkeypatch, ws, "append_rows", 429)
+    fut = app.db_insert("DebitNotes", note(999, "2025-01-02")); app.get_writer().flush()
+    assert fut.result(timeout=5) == 5 and _ids(store).count("999") == 1 and len(calls) == 2
+
+def test_append_is_dropped_after_max_attempts(make_env, monkeypatch):
+    store = make_env(notes=3); ws = store.pool.fake_sheet.sheets["DebitNotes"]
+    flaky(monkeypatch, ws, "append_rows", times=app.WRITE_MAX_ATTEMPTS)
+    fut = app.db_insert("DebitNotes", note(999, "2025-01-02")); writer = app.get_writer()
+    for _ in range(app.WRITE_MAX_ATTEMPTS): writer.flush()
+    assert isinstance(fut.exception(timeout=5), gspread.exceptions.APIError) and "999" not in _ids(store)
+    assert "999" not in set(app.db_get("DebitNotes")['ID']) # The optimistic cached row is dropped too
+
+def test_edits_are_batched_into_one_update(make_env, monkeypatch):
+    store = make_env(notes=3); ws = store.pool.fake_sheet.sheets["Users"]
+    calls = flaky(monkeypatch, ws, "batch_update", times=0)
+    writer = app.get_writer(); futs = [writer.edit("Users", 2, 3, "Admin"), writer.edit("Users", 3, 3, "Admin")]
+    writer.flush()
+    assert all(f.result(timeout=5) for f in futs) and len(calls) == 1 and [r[2] for r in ws.data[1:3]] == ["Admin", "Admin"]